@@ -0,0 +1,180 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from columnar_output import COLUMNAR_FORMATS
+from session_layout import is_session_dir, session_paths
+
+# --- 默认参数 ---
+MANIFEST_FILENAME = "batch_manifest.json"
+HASH_CHUNK_BYTES = 8 << 20
+
+
+def discover_sessions(roots: List[str]) -> List[str]:
+    """递归查找包含 final_output.mp4 / 事件日志 / video_start_time.txt 的会话目录，按路径排序。"""
+    sessions = []
+    for root in roots:
+        for directory, subdirs, _ in os.walk(root):
+            if is_session_dir(directory):
+                sessions.append(os.path.abspath(directory))
+                subdirs[:] = []  # 会话目录内部不会再嵌套会话
+            else:
+                subdirs.sort()
+    return sorted(set(sessions))
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint_inputs(session_dir: str, previous: Optional[Dict[str, dict]] = None) -> Dict[str, dict]:
+    """
+    会话各输入文件的 大小 / 修改时间 / SHA-256。大小和修改时间都与上次清单中的记录相同时沿用上次的哈希，
+    避免每次重跑都把几 GB 的视频完整读一遍。
+    """
+    paths = session_paths(session_dir)
+    previous = previous or {}
+    inputs = {}
+    for path in (paths.video, paths.events, paths.sync_time, paths.skipped_frames, paths.frame_index):
+        if not os.path.isfile(path):
+            continue
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        old = previous.get(name)
+        if old and old.get('size') == stat.st_size and old.get('mtime_ns') == stat.st_mtime_ns:
+            sha256 = old['sha256']
+        else:
+            sha256 = _sha256(path)
+        inputs[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+    return inputs
+
+
+def _same_inputs(a: Dict[str, dict], b: Dict[str, dict]) -> bool:
+    return {name: info['sha256'] for name, info in a.items()} == {name: info['sha256'] for name, info in b.items()}
+
+
+def load_manifest(manifest_path: str) -> dict:
+    if not os.path.exists(manifest_path):
+        return {'sessions': {}}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_path: str, manifest: dict):
+    """先写临时文件再替换，批处理中途被打断也不会留下损坏的清单。"""
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+# ==============================================================================
+# 工作进程: 处理一个会话，任何异常都转换为失败记录返回，不影响其它会话
+# ==============================================================================
+def process_session(session_dir: str, options: dict) -> dict:
+    from videoandevents_decoder import load_aligned_session, write_session_outputs
+
+    paths = session_paths(session_dir)
+    timings = {}
+    started = time.time()
+    try:
+        t0 = time.perf_counter()
+        session = load_aligned_session(paths.video, paths.events, paths.sync_time, paths.skipped_frames,
+                                       paths.frame_index, options['verify_index'])
+        timings['load_and_align'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        outputs = write_session_outputs(session, paths.analysis_csv, options['output_format'],
+                                        paths.input_state if options['input_state'] else None)
+        timings['write_outputs'] = time.perf_counter() - t0
+    except (Exception, SystemExit) as e:  # 保证总能返回失败记录
+        return {'status': 'failed', 'started_at': started, 'finished_at': time.time(), 'timings': timings,
+                'error': f"{type(e).__name__}: {e}", 'traceback': traceback.format_exc()}
+
+    return {'status': 'done', 'started_at': started, 'finished_at': time.time(), 'timings': timings,
+            'frames': len(session.frame_timestamps), 'events': len(session.events),
+            'outputs': [os.path.relpath(path, session_dir) for path in outputs]}
+
+
+def run_batch(roots: List[str], manifest_path: str, options: dict, workers: Optional[int] = None,
+              force: bool = False) -> dict:
+    """处理所有新增、输入有变化或上次失败的会话，返回更新后的清单。"""
+    manifest = load_manifest(manifest_path)
+    records = manifest.setdefault('sessions', {})
+    sessions = discover_sessions(roots)
+
+    pending = {}
+    for session_dir in sessions:
+        record = records.get(session_dir, {})
+        inputs = fingerprint_inputs(session_dir, record.get('inputs'))
+        unchanged = (record.get('status') == 'done' and record.get('options') == options
+                     and _same_inputs(record.get('inputs', {}), inputs)
+                     and all(os.path.exists(os.path.join(session_dir, path)) for path in record.get('outputs', [])))
+        if unchanged and not force:
+            continue
+        pending[session_dir] = inputs
+
+    print(f"[批处理] 发现 {len(sessions)} 个会话，{len(sessions) - len(pending)} 个已是最新，{len(pending)} 个待处理。")
+    counts = {'done': 0, 'failed': 0}
+    t0 = time.perf_counter()
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(process_session, session_dir, options): session_dir for session_dir in pending}
+            for future in as_completed(futures):
+                session_dir = futures[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # 工作进程被系统杀死 (例如内存不足)，只能记为失败
+                    result = {'status': 'failed', 'finished_at': time.time(), 'error': f"工作进程异常退出: {e}"}
+                result['inputs'] = pending[session_dir]
+                result['options'] = options
+                if 'started_at' in result:
+                    result['seconds'] = result['finished_at'] - result['started_at']
+                records[session_dir] = result
+                counts[result['status']] += 1
+                save_manifest(manifest_path, manifest)
+
+                if result['status'] == 'done':
+                    print(f"[批处理] 完成 {session_dir}: {result['frames']} 帧, {result['events']} 个事件, "
+                          f"{result['seconds']:.2f} 秒")
+                else:
+                    print(f"[批处理] 失败 {session_dir}: {result['error']}")
+    save_manifest(manifest_path, manifest)
+
+    print(f"[批处理] 本次完成 {counts['done']} 个，失败 {counts['failed']} 个，耗时 {time.perf_counter() - t0:.2f} 秒。"
+          f"清单: {manifest_path}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量解码多个录制会话 (对齐事件并写出逐帧分析结果)")
+    parser.add_argument('roots', nargs='+', help="包含会话目录的根目录，例如 Y:\\jist_dataset\\simple")
+    parser.add_argument('--manifest', help=f"清单文件路径 (默认第一个根目录下的 {MANIFEST_FILENAME})")
+    parser.add_argument('--workers', type=int, default=None, help="并行进程数，默认等于核数")
+    parser.add_argument('--output-format', choices=('csv',) + COLUMNAR_FORMATS, default='csv')
+    parser.add_argument('--input-state', action='store_true', help="同时写出逐帧输入状态张量 (input_state/*.npy)")
+    parser.add_argument('--verify-index', action='store_true', help="用视频本身校验帧索引")
+    parser.add_argument('--force', action='store_true', help="忽略清单，重新处理所有会话")
+    args = parser.parse_args()
+
+    manifest_path = args.manifest or os.path.join(args.roots[0], MANIFEST_FILENAME)
+    options = {'output_format': args.output_format, 'input_state': args.input_state, 'verify_index': args.verify_index}
+    manifest = run_batch(args.roots, manifest_path, options, args.workers, args.force)
+    if any(record.get('status') == 'failed' for record in manifest['sessions'].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,572 @@
+import collections.abc
+import csv
+import itertools
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from native_events import BUTTON_NAMES, EVENT_TYPE_CODES as NATIVE_EVENT_TYPE_CODES, NATIVE_EVENT_DTYPE
+
+# ==============================================================================
+# 文件格式
+#   [64 字节头部][32 字节定长记录 × N]
+#   头部: magic(8) 版本(u2) 头部长度(u2) 记录长度(u2) 保留(u2) 创建时间 unix ns(i8) 时钟源(32 字节 ASCII)
+#   记录: timestamp_ns(i8) code(u2) flags(u2) p1..p4(i4) ext(i4)
+#   ext: 未知事件类型为类型名的符号 id；原生 mouse_move 为合并的原始样本数 (未合并时为 1)
+#   合并了多个样本的 mouse_move 后面紧跟一条 code=254 的窗口起点记录，其 timestamp_ns 为窗口内第一个样本的时间戳
+#   (版本 2 起；版本 1 的日志没有这种记录)
+#   flags 每 2 位描述一个参数槽: 0=None 1=整数 2=符号(字符串表 id) 3=该列不存在
+#   字符串 (按键名、鼠标按键名等) 以 code=0 的符号记录内联写入，在第一次被引用之前出现，
+#   每条符号记录携带 24 字节 UTF-8 片段，长字符串会拆成多条连续的符号记录。
+# ==============================================================================
+MAGIC = b'SICTEVT\x00'
+SCHEMA_VERSION = 2
+HEADER_SIZE = 64
+RECORD_SIZE = 32
+_HEADER_STRUCT = struct.Struct('<8sHHHHq32s')
+
+EVENT_DTYPE = np.dtype([
+    ('timestamp_ns', '<i8'),
+    ('code', '<u2'),
+    ('flags', '<u2'),
+    ('p1', '<i4'),
+    ('p2', '<i4'),
+    ('p3', '<i4'),
+    ('p4', '<i4'),
+    ('ext', '<i4'),
+])
+
+# 符号记录与事件记录共用 32 字节，code 字段位置相同，文本分布在 code 前后的 8 + 16 字节中
+_SYMBOL_DTYPE = np.dtype({
+    'names': ['text_head', 'code', 'length', 'sid', 'text_tail'],
+    'formats': [('u1', 8), '<u2', '<u2', '<i4', ('u1', 16)],
+    'offsets': [0, 8, 10, 12, 16],
+    'itemsize': RECORD_SIZE,
+})
+_SYMBOL_CHUNK = 24
+
+# --- 事件类型编码: 1~6 与原生模块 (native_events.py) 相同，7~10 为 pynput 监听的事件 ---
+CODE_SYMBOL = 0
+EVENT_TYPE_CODES = dict(NATIVE_EVENT_TYPE_CODES)
+EVENT_TYPE_CODES.update({
+    'key_press': 7,
+    'key_release': 8,
+    'mouse_press': 9,
+    'mouse_release': 10,
+})
+CODE_MOVE_WINDOW = 254  # 合并的 mouse_move 的窗口起点记录，不是独立的事件
+CODE_OTHER = 255  # 未知事件类型，类型名的符号 id 存在 ext 字段
+EVENT_TYPE_NAMES = {code: name for name, code in EVENT_TYPE_CODES.items()}
+# 类型码 -> 类型名的查表，CODE_OTHER (类型名存在符号表中) 为 None
+_EVENT_NAME_TABLE = np.array([EVENT_TYPE_NAMES.get(code) for code in range(CODE_OTHER + 1)], dtype=object)
+
+KIND_NONE, KIND_INT, KIND_SYMBOL, KIND_ABSENT = 0, 1, 2, 3
+_INT32_MIN, _INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+# input_events.csv 的表头: param5 / param6 只有合并了多个样本的 mouse_move 才有 (样本数、第一个样本的时间戳)
+CSV_HEADER = ['timestamp_ns', 'event_type', 'param1', 'param2', 'param3', 'param4', 'param5', 'param6']
+
+
+def pack_flags(kinds) -> int:
+    """把 4 个参数槽的类型打包成 flags。"""
+    flags = 0
+    for i, kind in enumerate(kinds):
+        flags |= kind << (2 * i)
+    return flags
+
+
+def slot_kind(flags, slot: int):
+    """取出第 slot (0~3) 个参数槽的类型，flags 可以是整数或 NumPy 数组。"""
+    return (flags >> (2 * slot)) & 0b11
+
+
+# --- 原生记录 -> 二进制记录的查表: 每种原生事件类型的 flags，以及 p1..p4 各取自哪一列 ---
+# 源列 0 为常数 0，1..6 为 _NATIVE_PARAM_COLUMNS，_SRC_BUTTON_SYMBOL 为鼠标按键名的符号 id；
+# 原生类型码超过 _NATIVE_OTHER 的记录按未知类型处理 (参数全部缺省)
+_NATIVE_PARAM_COLUMNS = ('dx', 'dy', 'abs_x', 'abs_y', 'wheel', 'button')
+_SRC_DX, _SRC_DY, _SRC_ABS_X, _SRC_ABS_Y, _SRC_WHEEL, _SRC_BUTTON, _SRC_BUTTON_SYMBOL = range(1, 8)
+_NATIVE_OTHER = max(NATIVE_EVENT_TYPE_CODES.values()) + 1
+_NO_PARAMS_FLAGS = pack_flags([KIND_ABSENT] * 4)
+_NATIVE_FLAGS = np.full(_NATIVE_OTHER + 1, _NO_PARAMS_FLAGS, dtype=np.uint16)
+_NATIVE_PARAM_SOURCES = np.zeros((_NATIVE_OTHER + 1, 4), dtype=np.intp)
+for _name, _kinds, _sources in (
+        ('mouse_move', [KIND_INT] * 4, [_SRC_DX, _SRC_DY, _SRC_ABS_X, _SRC_ABS_Y]),
+        ('mouse_down', [KIND_SYMBOL, KIND_INT, KIND_INT, KIND_ABSENT], [_SRC_BUTTON_SYMBOL, _SRC_ABS_X, _SRC_ABS_Y, 0]),
+        ('mouse_up', [KIND_SYMBOL, KIND_INT, KIND_INT, KIND_ABSENT], [_SRC_BUTTON_SYMBOL, _SRC_ABS_X, _SRC_ABS_Y, 0]),
+        ('mouse_wheel', [KIND_INT, KIND_INT, KIND_INT, KIND_ABSENT], [_SRC_WHEEL, _SRC_ABS_X, _SRC_ABS_Y, 0]),
+        ('key_down', [KIND_INT, KIND_ABSENT, KIND_ABSENT, KIND_ABSENT], [_SRC_BUTTON, 0, 0, 0]),
+        ('key_up', [KIND_INT, KIND_ABSENT, KIND_ABSENT, KIND_ABSENT], [_SRC_BUTTON, 0, 0, 0])):
+    _NATIVE_FLAGS[NATIVE_EVENT_TYPE_CODES[_name]] = pack_flags(_kinds)
+    _NATIVE_PARAM_SOURCES[NATIVE_EVENT_TYPE_CODES[_name]] = _sources
+
+
+def is_binary_event_log(path: str) -> bool:
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+# ==============================================================================
+# 写入端
+# ==============================================================================
+class BinaryEventWriter:
+    """
+    追加写入的二进制事件日志。记录先放进预分配的块缓冲区，
+    块写满或距离上次刷新超过 flush_interval 秒时整块写入磁盘。
+    """
+
+    def __init__(self, path: str, clock_source: str = 'perf_counter_ns',
+                 block_records: int = 4096, flush_interval: float = 1.0):
+        self.path = path
+        self.block_records = block_records
+        self.flush_interval = flush_interval
+        self.records_written = 0
+        self._block = np.zeros(block_records, dtype=EVENT_DTYPE)
+        self._count = 0
+        self._last_flush = time.perf_counter()
+        self._symbols: Dict[str, int] = {}
+        # pynput 的键盘和鼠标监听器在各自的线程里回调，写入需要互斥
+        self._lock = threading.RLock()
+
+        self._file = open(path, 'wb')
+        header = _HEADER_STRUCT.pack(MAGIC, SCHEMA_VERSION, HEADER_SIZE, RECORD_SIZE, 0,
+                                     time.time_ns(), clock_source.encode('ascii')[:32])
+        self._file.write(header.ljust(HEADER_SIZE, b'\x00'))
+        self._file.flush()
+
+        # 原生模块的鼠标按键名预先登记，批量写入时可以直接查表
+        self._button_symbols = np.array([self.intern(BUTTON_NAMES.get(i, 'unknown')) for i in range(max(BUTTON_NAMES) + 1)],
+                                        dtype=np.int32)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- 内部: 块缓冲 ---
+    def _reserve(self, n: int) -> int:
+        """保证块缓冲区还能放下 n 条记录，返回写入起点。"""
+        if self._count + n > self.block_records:
+            self._write_block()
+        if n > self.block_records:
+            self._block = np.zeros(n, dtype=EVENT_DTYPE)
+            self.block_records = n
+        start = self._count
+        self._count += n
+        return start
+
+    def _write_block(self):
+        if self._count:
+            self._file.write(self._block[:self._count].tobytes())
+            self.records_written += self._count
+            self._count = 0
+
+    def _maybe_flush(self):
+        if self._count >= self.block_records or time.perf_counter() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def intern(self, text: str) -> int:
+        """返回字符串的符号 id，第一次出现时先写入符号记录。"""
+        sid = self._symbols.get(text)
+        if sid is not None:
+            return sid
+        sid = len(self._symbols)
+        self._symbols[text] = sid
+        data = text.encode('utf-8')
+        chunks = [data[i:i + _SYMBOL_CHUNK] for i in range(0, len(data), _SYMBOL_CHUNK)] or [b'']
+        start = self._reserve(len(chunks))
+        view = self._block[start:start + len(chunks)].view(_SYMBOL_DTYPE)
+        for i, chunk in enumerate(chunks):
+            padded = np.frombuffer(chunk.ljust(_SYMBOL_CHUNK, b'\x00'), dtype=np.uint8)
+            view[i]['text_head'] = padded[:8]
+            view[i]['code'] = CODE_SYMBOL
+            view[i]['length'] = len(chunk)
+            view[i]['sid'] = sid
+            view[i]['text_tail'] = padded[8:]
+        return sid
+
+    # --- 公开接口 ---
+    def write_row(self, row):
+        """写入一行与 input_events.csv 相同结构的事件: [timestamp_ns, event_type, param1..param4]，参数可以缺省。"""
+        with self._lock:
+            self._write_row(row)
+
+    def _write_row(self, row):
+        event_type = row[1]
+        code = EVENT_TYPE_CODES.get(event_type, CODE_OTHER)
+        ext = self.intern(event_type) if code == CODE_OTHER else 0
+        window_start = None
+        if code == EVENT_TYPE_CODES['mouse_move'] and len(row) >= 8 and isinstance(row[6], int) and isinstance(row[7], int):
+            # 合并的 mouse_move: 样本数写进 ext，第一个样本的时间戳写进紧跟其后的窗口起点记录
+            ext, window_start = row[6], row[7]
+
+        kinds = []
+        values = []
+        for slot in range(4):
+            if 2 + slot >= len(row):
+                kinds.append(KIND_ABSENT)
+                values.append(0)
+                continue
+            value = row[2 + slot]
+            if value is None:
+                kinds.append(KIND_NONE)
+                values.append(0)
+            elif isinstance(value, int) and not isinstance(value, bool) and _INT32_MIN <= value <= _INT32_MAX:
+                kinds.append(KIND_INT)
+                values.append(value)
+            else:
+                kinds.append(KIND_SYMBOL)
+                values.append(self.intern(str(value)))
+
+        start = self._reserve(1 if window_start is None else 2)
+        self._block[start] = (int(row[0]), code, pack_flags(kinds), values[0], values[1], values[2], values[3], ext)
+        if window_start is not None:
+            self._block[start + 1] = (window_start, CODE_MOVE_WINDOW, _NO_PARAMS_FLAGS, 0, 0, 0, 0, 0)
+        self._maybe_flush()
+
+    def write_records(self, records: np.ndarray):
+        """批量写入 input_module_all_inf.drain() 返回的原生事件记录 (查表转换，直接写进块缓冲区，不逐条处理)。"""
+        n = len(records)
+        if n == 0:
+            return
+        records = np.asarray(records).view(NATIVE_EVENT_DTYPE) if records.dtype != NATIVE_EVENT_DTYPE else records
+        code = records['type'].astype(np.uint16)
+        kind = np.minimum(code, _NATIVE_OTHER)
+        # 超出按键名表的按键号与 records_to_rows 一样记为 'unknown' (表中的第 0 项)
+        button = records['button'].astype(np.uint32)
+        button = np.where(button < len(self._button_symbols), button, 0)
+        columns = np.zeros((len(_NATIVE_PARAM_COLUMNS) + 2, n), dtype=np.int32)
+        for i, name in enumerate(_NATIVE_PARAM_COLUMNS, start=1):
+            columns[i] = records[name]
+        columns[_SRC_BUTTON_SYMBOL] = self._button_symbols[button]
+        params = columns[_NATIVE_PARAM_SOURCES[kind].T, np.arange(n)]
+        is_move = code == EVENT_TYPE_CODES['mouse_move']
+        # 合并了多个样本的 mouse_move 之后各插入一条窗口起点记录，事件记录依次后移
+        coalesced = is_move & (records['samples'] > 1)
+        n_windows = int(np.count_nonzero(coalesced))
+        positions = slice(None)
+        if n_windows:
+            positions = np.arange(n) + np.concatenate(([0], np.cumsum(coalesced)[:-1]))
+
+        with self._lock:
+            start = self._reserve(n + n_windows)
+            out = self._block[start:start + n + n_windows]
+            out['timestamp_ns'][positions] = records['timestamp_ns']
+            out['code'][positions] = code
+            out['flags'][positions] = _NATIVE_FLAGS[kind]
+            out['p1'][positions] = params[0]
+            out['p2'][positions] = params[1]
+            out['p3'][positions] = params[2]
+            out['p4'][positions] = params[3]
+            out['ext'][positions] = np.where(is_move, records['samples'], 0)
+            if n_windows:
+                window_positions = positions[coalesced] + 1
+                out['timestamp_ns'][window_positions] = records['first_timestamp_ns'][coalesced]
+                out['code'][window_positions] = CODE_MOVE_WINDOW
+                out['flags'][window_positions] = _NO_PARAMS_FLAGS
+                for field in ('p1', 'p2', 'p3', 'p4', 'ext'):
+                    out[field][window_positions] = 0
+            self._maybe_flush()
+
+    def flush(self):
+        with self._lock:
+            self._write_block()
+            self._file.flush()
+            self._last_flush = time.perf_counter()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+class CsvEventWriter:
+    """与 BinaryEventWriter 接口相同的 6 列 CSV 写入器，录制脚本据此在两种格式之间切换。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(CSV_HEADER)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_row(self, row):
+        self._writer.writerow(row)
+
+    def write_records(self, records: np.ndarray):
+        from native_events import records_to_rows
+
+        self._writer.writerows(records_to_rows(records))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def open_event_writer(path: str, log_format: str = 'csv', clock_source: str = 'perf_counter_ns'):
+    """log_format: 'csv' 为原有的 6 列 CSV，'binary' 为定长记录的二进制日志。"""
+    if log_format == 'binary':
+        return BinaryEventWriter(path, clock_source=clock_source)
+    if log_format == 'csv':
+        return CsvEventWriter(path)
+    raise ValueError(f"未知的事件日志格式: {log_format}")
+
+
+# ==============================================================================
+# 读取端
+# ==============================================================================
+class BinaryEventLog:
+    """
+    以内存映射方式打开二进制事件日志，records 是整份文件的 NumPy 结构化数组视图 (打开时间与文件大小无关)。
+    文件末尾因崩溃而不完整的记录会被忽略。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            raw = f.read(HEADER_SIZE)
+        if len(raw) < _HEADER_STRUCT.size or raw[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"'{path}' 不是二进制事件日志")
+        magic, version, header_size, record_size, _, created_ns, clock = _HEADER_STRUCT.unpack_from(raw)
+        if version > SCHEMA_VERSION:
+            raise ValueError(f"不支持的事件日志版本: {version}")
+        if record_size != RECORD_SIZE:
+            raise ValueError(f"记录长度不匹配: {record_size}")
+
+        self.schema_version = version
+        self.created_unix_ns = created_ns
+        self.clock_source = clock.rstrip(b'\x00').decode('ascii')
+
+        count = (os.path.getsize(path) - header_size) // record_size
+        if count > 0:
+            self.records = np.memmap(path, dtype=EVENT_DTYPE, mode='r', offset=header_size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=EVENT_DTYPE)
+        self._symbols: Optional[Dict[int, str]] = None
+        self._event_index: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.event_index)
+
+    @property
+    def symbols(self) -> Dict[int, str]:
+        """符号 id -> 字符串，第一次访问时从符号记录中还原。"""
+        if self._symbols is None:
+            rows = np.flatnonzero(self.records['code'] == CODE_SYMBOL)
+            chunks: Dict[int, bytes] = {}
+            view = self.records.view(_SYMBOL_DTYPE)
+            for row in view[rows]:
+                data = (row['text_head'].tobytes() + row['text_tail'].tobytes())[:row['length']]
+                chunks[int(row['sid'])] = chunks.get(int(row['sid']), b'') + data
+            self._symbols = {sid: data.decode('utf-8') for sid, data in chunks.items()}
+        return self._symbols
+
+    @property
+    def event_index(self) -> np.ndarray:
+        """事件记录 (不含符号记录和窗口起点记录) 在 records 中的行号。"""
+        if self._event_index is None:
+            codes = self.records['code']
+            self._event_index = np.flatnonzero((codes != CODE_SYMBOL) & (codes != CODE_MOVE_WINDOW))
+        return self._event_index
+
+    @property
+    def events(self) -> np.ndarray:
+        return self.records[self.event_index]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return np.asarray(self.records['timestamp_ns'][self.event_index])
+
+    def event_type_names(self, events: Optional[np.ndarray] = None) -> List[str]:
+        events = self.events if events is None else events
+        names = _EVENT_NAME_TABLE[np.minimum(events['code'], CODE_OTHER)]
+        other = np.flatnonzero(np.equal(names, None))
+        if len(other):
+            symbols = self.symbols
+            names[other] = [symbols.get(ext, 'unknown') for ext in events['ext'][other].tolist()]
+        return names.tolist()
+
+    def build_rows(self, positions: Optional[np.ndarray] = None) -> List[list]:
+        """
+        把第 positions 个事件 (事件序号，不含符号记录；默认全部) 还原为与 read_input_events 相同结构的行:
+        [timestamp_ns(int), event_type, param...]，参数为字符串，None 为空串，缺省的参数不出现在行中。
+        按列转换，只有逐行组装是 Python 循环。
+        """
+        rows_index = self.event_index if positions is None else self.event_index[positions]
+        events = self.records[rows_index]
+        flags = events['flags']
+        counts = np.zeros(len(events), dtype=np.intp)
+        columns = []
+        for slot, field in enumerate(('p1', 'p2', 'p3', 'p4')):
+            kind = slot_kind(flags, slot)
+            present = kind != KIND_ABSENT
+            counts += present
+            if not present.any():
+                columns.append(itertools.repeat(''))
+                continue
+            values = events[field].tolist()
+            column = list(map(str, values))
+            symbol_rows = np.flatnonzero(kind == KIND_SYMBOL).tolist()
+            if symbol_rows:
+                symbols = self.symbols
+                for i in symbol_rows:
+                    column[i] = symbols[values[i]]
+            for i in np.flatnonzero(kind == KIND_NONE).tolist():
+                column[i] = ''
+            columns.append(column)
+        rows = [[ts, name, p1, p2, p3, p4] for ts, name, p1, p2, p3, p4 in
+                zip(events['timestamp_ns'].tolist(), self.event_type_names(events), *columns)]
+        # 缺省的参数只出现在末尾，截掉即可 (参数不满 4 个的事件通常只占少数)
+        for i in np.flatnonzero(counts < 4).tolist():
+            del rows[i][2 + counts[i]:]
+        # 合并的 mouse_move 后面紧跟窗口起点记录: 行末追加样本数和第一个样本的时间戳
+        following = np.minimum(rows_index + 1, len(self.records) - 1)
+        windows = np.flatnonzero((events['code'] == EVENT_TYPE_CODES['mouse_move']) & (rows_index + 1 < len(self.records))
+                                 & (self.records['code'][following] == CODE_MOVE_WINDOW))
+        if len(windows):
+            first_timestamps = self.records['timestamp_ns'][following[windows]].tolist()
+            for i, samples, first_ts in zip(windows.tolist(), events['ext'][windows].tolist(), first_timestamps):
+                rows[i] += [str(samples), str(first_ts)]
+        return rows
+
+    def to_rows(self) -> List[list]:
+        """还原为与 read_input_events 相同结构的行: [timestamp_ns(int), event_type, param...] (参数为字符串或 None 的空串)。"""
+        return self.build_rows()
+
+    def rows(self) -> 'BinaryEventRows':
+        """按需构造行的只读序列，见 BinaryEventRows。"""
+        return BinaryEventRows(self)
+
+
+class BinaryEventRows(collections.abc.Sequence):
+    """
+    BinaryEventLog 的逐行视图，可以代替 read_input_events 读 CSV 得到的行列表 (len / 下标 / 切片 / 迭代)。
+    timestamps 直接来自内存映射的记录，对齐只用它而不构造任何行；
+    行按 ROW_BLOCK 条一块，在块中第一次有行被访问时才构造，只输出部分事件时不必还原整个日志。
+    """
+
+    ROW_BLOCK = 4096
+
+    def __init__(self, log: BinaryEventLog):
+        self.log = log
+        self.timestamps = log.timestamps
+        self._blocks: Dict[int, List[list]] = {}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _block(self, block: int) -> List[list]:
+        rows = self._blocks.get(block)
+        if rows is None:
+            start = block * self.ROW_BLOCK
+            rows = self._blocks[block] = self.log.build_rows(np.arange(start, min(start + self.ROW_BLOCK, len(self))))
+        return rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        block, offset = divmod(index, self.ROW_BLOCK)
+        return self._block(block)[offset]
+
+    def __iter__(self):
+        for block in range((len(self) + self.ROW_BLOCK - 1) // self.ROW_BLOCK):
+            yield from self._block(block)
+
+    def take(self, indices) -> List[list]:
+        """一次构造 indices 指定的事件行 (新列表，调用方可以修改)，比逐个下标访问少了每行的 Python 开销。"""
+        return self.log.build_rows(np.asarray(indices, dtype=np.intp))
+
+
+def take_rows(events: Sequence[list], indices) -> List[list]:
+    """
+    按下标取事件行，events 是 read_input_events 的结果。
+    BinaryEventRows 只构造这些行；普通的行列表逐个取，返回的是原来的行对象。
+    """
+    take = getattr(events, 'take', None)
+    if take is not None:
+        return take(indices)
+    return [events[i] for i in np.asarray(indices).tolist()]
+
+
+def event_timestamps(events: Sequence[list]) -> np.ndarray:
+    """事件的绝对时间戳 (int64 纳秒)。二进制日志直接取内存映射的时间戳列，不构造事件行。"""
+    timestamps = getattr(events, 'timestamps', None)
+    if timestamps is not None:
+        return np.asarray(timestamps, dtype=np.int64)
+    return np.fromiter((e[0] for e in events), dtype=np.int64, count=len(events))
+
+
+def read_binary_events(path: str) -> BinaryEventLog:
+    return BinaryEventLog(path)
+
+
+# ==============================================================================
+# 与 input_events.csv 之间的转换
+# ==============================================================================
+def _parse_csv_value(value: str):
+    """CSV 中的空串对应 None，能无损往返的整数转为 int，其余保持字符串。"""
+    if value == '':
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        return value
+    return number if str(number) == value else value
+
+
+def csv_to_binary(csv_path: str, binary_path: str, clock_source: str = 'perf_counter_ns') -> int:
+    """把现有的 input_events.csv 转换为二进制事件日志，返回事件数量。"""
+    count = 0
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f, \
+            BinaryEventWriter(binary_path, clock_source=clock_source, flush_interval=float('inf')) as writer:
+        reader = csv.reader(f)
+        next(reader)  # 跳过表头
+        for row in reader:
+            writer.write_row([int(row[0]), row[1]] + [_parse_csv_value(v) for v in row[2:]])
+            count += 1
+    return count
+
+
+def binary_to_csv(binary_path: str, csv_path: str) -> int:
+    """把二进制事件日志还原为与录制脚本输出格式相同的 CSV，返回事件数量。"""
+    rows = BinaryEventLog(binary_path).to_rows()
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="input_events.csv 与二进制事件日志互相转换")
+    parser.add_argument('source')
+    parser.add_argument('target')
+    args = parser.parse_args()
+
+    if is_binary_event_log(args.source):
+        n = binary_to_csv(args.source, args.target)
+    else:
+        n = csv_to_binary(args.source, args.target)
+    print(f"已转换 {n} 个事件: {args.source} -> {args.target}")
@@ -0,0 +1,173 @@
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+import numpy as np
+
+from frame_ring_buffer import attach_shared_memory
+from pipeline_telemetry import HISTOGRAM_BUCKETS, bucket_of, histogram_percentiles
+
+# --- 默认参数 ---
+SPIN_NS = 1_500_000        # 距截止时间不足这么多时改为自旋；Windows 上 time.sleep 的精度约 1 ms (Python 3.11 起使用高精度定时器)
+STOP_CHECK_FRAMES = 8      # 捕获循环每隔多少帧检查一次停止标志
+FLAG_POLL_INTERVAL = 0.005  # SharedFlag.wait() 的轮询间隔（秒）
+
+# 由捕获调度器控制节拍时，帧源本身不应再节拍或启动自己的捕获线程；这些参数作为默认值合并到 frame_source_options 之下
+EXTERNALLY_PACED_OPTIONS = {
+    'dxcam': {'mode': 'grab'},
+    'synthetic': {'fps': 0},
+    'replay': {'realtime': False},
+}
+
+
+def paced_source_options(kind: str, options: Optional[dict]) -> dict:
+    """帧源参数: 外部节拍的默认值 < 配置中显式给出的参数。"""
+    return {**EXTERNALLY_PACED_OPTIONS.get(kind, {}), **(options or {})}
+
+
+class SharedFlag:
+    """
+    放在 multiprocessing.shared_memory 中的布尔标志，接口与 mp.Event 的 set/clear/is_set/wait 相同。
+    is_set() 只是一次内存读取，不经过信号量/内核调用，适合在捕获热循环中检查；wait() 以短间隔轮询。
+    与 SharedFrameRing 一样可以直接作为 mp.Process 的参数传递。
+    """
+
+    def __init__(self):
+        self._shm = shared_memory.SharedMemory(create=True, size=8)
+        self._owner = True
+        self._flag = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._flag[0] = 0
+
+    def __getstate__(self):
+        return {'name': self._shm.name}
+
+    def __setstate__(self, state):
+        self._shm = attach_shared_memory(state['name'])
+        self._owner = False
+        self._flag = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+
+    def set(self):
+        self._flag[0] = 1
+
+    def clear(self):
+        self._flag[0] = 0
+
+    def is_set(self) -> bool:
+        return bool(self._flag[0])
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self._flag[0]:
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(FLAG_POLL_INTERVAL, remaining))
+            else:
+                time.sleep(FLAG_POLL_INTERVAL)
+        return True
+
+    def close(self):
+        self._flag = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+class DeadlineTimer:
+    """
+    按目标帧率给出抓帧时刻: 先 sleep 到截止时间前 spin_ns，再自旋到截止时间，避免整个进程忙等，
+    同时不受 sleep 粒度影响。截止时间按 start + k * 周期 推进，不累积误差；
+    落后超过一个周期时跳过已经错过的截止时间 (计入 missed)，而不是连续补抓。
+    """
+
+    def __init__(self, fps: float, spin_ns: int = SPIN_NS):
+        if fps <= 0:
+            raise ValueError("fps 必须大于 0")
+        self.period_ns = int(round(1e9 / fps))
+        self.spin_ns = int(spin_ns)
+        self.missed = 0
+        self._origin_ns = None
+        self._tick = 0
+
+    def start(self, now_ns: Optional[int] = None):
+        self._origin_ns = time.perf_counter_ns() if now_ns is None else now_ns
+        self._tick = 0
+
+    def wait(self) -> int:
+        """等待下一个截止时间，返回该截止时间 (perf_counter_ns)。"""
+        if self._origin_ns is None:
+            self.start()
+        self._tick += 1
+        deadline = self._origin_ns + self._tick * self.period_ns
+        now = time.perf_counter_ns()
+        if now - deadline >= self.period_ns:
+            skipped = (now - deadline) // self.period_ns
+            self.missed += skipped
+            self._tick += skipped
+            deadline += skipped * self.period_ns
+        remaining = deadline - now
+        if remaining > self.spin_ns:
+            time.sleep((remaining - self.spin_ns) / 1e9)
+        while time.perf_counter_ns() < deadline:
+            pass
+        return deadline
+
+
+class PacingStats:
+    """
+    帧间隔统计: 相邻两帧 capture_time_ns 之差相对目标周期的偏差 (抖动) 用对数分桶直方图记录，
+    另外记录唤醒时刻相对截止时间的延迟。correlate_events_to_frames 把帧间隔当作事件窗口，这些数字直接反映窗口的稳定性。
+    """
+
+    def __init__(self, period_ns: int):
+        self.period_ns = period_ns
+        self.frames = 0
+        self.jitter_hist = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+        self.lateness_hist = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+        self._previous_ns = None
+        self._interval_sum = 0
+        self._interval_sq_sum = 0
+        self._max_jitter_ns = 0
+
+    def record(self, capture_time_ns: int, deadline_ns: int) -> Optional[int]:
+        """记录一帧，返回与上一帧的间隔偏差 (纳秒，第一帧为 None)。"""
+        self.frames += 1
+        self.lateness_hist[bucket_of(capture_time_ns - deadline_ns)] += 1
+        previous, self._previous_ns = self._previous_ns, capture_time_ns
+        if previous is None:
+            return None
+        interval = capture_time_ns - previous
+        jitter = abs(interval - self.period_ns)
+        self._interval_sum += interval
+        self._interval_sq_sum += interval * interval
+        self._max_jitter_ns = max(self._max_jitter_ns, jitter)
+        self.jitter_hist[bucket_of(jitter)] += 1
+        return jitter
+
+    def summary(self, missed: int = 0) -> Dict[str, float]:
+        intervals = self.frames - 1
+        result = {'target_interval_ms': self.period_ns / 1e6, 'frames': self.frames, 'missed_deadlines': int(missed)}
+        if intervals > 0:
+            mean = self._interval_sum / intervals
+            variance = max(self._interval_sq_sum / intervals - mean * mean, 0.0)
+            result.update({
+                'interval_mean_ms': mean / 1e6,
+                'interval_std_ms': float(np.sqrt(variance)) / 1e6,
+                'jitter_ms': histogram_percentiles(self.jitter_hist, (50, 99)),
+                'jitter_max_ms': self._max_jitter_ns / 1e6,
+                'wake_lateness_ms': histogram_percentiles(self.lateness_hist, (50, 99)),
+            })
+        return result
+
+
+def format_pacing_summary(summary: dict) -> str:
+    text = (f"目标间隔 {summary['target_interval_ms']:.2f} ms，{summary['frames']} 帧，"
+            f"错过截止时间 {summary['missed_deadlines']} 次")
+    if 'interval_mean_ms' in summary:
+        text += (f"；实际间隔 {summary['interval_mean_ms']:.3f} ± {summary['interval_std_ms']:.3f} ms，"
+                 f"抖动 p50 {summary['jitter_ms']['p50']:.3f} / p99 {summary['jitter_ms']['p99']:.3f} / "
+                 f"最大 {summary['jitter_max_ms']:.3f} ms")
+    return text
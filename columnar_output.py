@@ -0,0 +1,246 @@
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from binary_event_log import event_timestamps, take_rows
+
+# 列式分析结果: 帧表 + 以帧序号为键的事件表，替代每帧一行、事件挤在一个多行单元格里的 CSV。
+#   帧表:   frame_index, timestamp_ns, timestamp_sec, duration_ms [, source_frame_index]
+#   事件表: frame_index, timestamp_ns (相对视频开始), event_type, param1 .. param4 (原始字段的字符串，缺省为空串)
+# 'npz' 只依赖 NumPy，写成一个 <base>.npz，数组名带 frames_ / events_ 前缀；
+# 'parquet' / 'arrow' 需要 pyarrow，分别写成 <base>_frames.<ext> 和 <base>_events.<ext>。
+COLUMNAR_FORMATS = ('npz', 'parquet', 'arrow')
+EVENT_PARAM_COLUMNS = ('param1', 'param2', 'param3', 'param4')
+DEFAULT_CHUNK_FRAMES = 65536  # 每次写出的帧数，峰值内存只与这一块的帧和事件数有关
+
+
+def columnar_output_paths(output_base: str, fmt: str) -> List[str]:
+    """给定不带扩展名的输出路径，返回该格式会写出的文件。"""
+    if fmt == 'npz':
+        return [f"{output_base}.npz"]
+    if fmt in ('parquet', 'arrow'):
+        return [f"{output_base}_frames.{fmt}", f"{output_base}_events.{fmt}"]
+    raise ValueError(f"未知的列式输出格式: {fmt} (可选 {', '.join(COLUMNAR_FORMATS)})")
+
+
+def _event_fields(row: Sequence) -> Tuple[str, ...]:
+    """[ts, event_type, p1, p2, ...] -> (event_type, p1..p4)，参数统一为字符串，缺省或 None 为空串。"""
+    params = [('' if value is None else str(value)) for value in row[2:2 + len(EVENT_PARAM_COLUMNS)]]
+    params.extend([''] * (len(EVENT_PARAM_COLUMNS) - len(params)))
+    return (str(row[1]), *params)
+
+
+def _iter_chunks(frame_times: np.ndarray, offsets: np.ndarray, event_indices: np.ndarray, event_times: np.ndarray,
+                 events: Sequence[list], source_frame_indices: Optional[np.ndarray],
+                 chunk_frames: int) -> Iterator[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]]:
+    """按帧分块产出 (帧表列, 事件表列)，每块的事件正好是这些帧的事件。"""
+    n_frames = len(frame_times)
+    durations_ms = np.zeros(n_frames, dtype=np.float64)
+    durations_ms[:-1] = np.diff(frame_times) / 1e6
+
+    for start in range(0, n_frames, chunk_frames):
+        end = min(start + chunk_frames, n_frames)
+        frames = {
+            'frame_index': np.arange(start, end, dtype=np.int64),
+            'timestamp_ns': frame_times[start:end],
+            'timestamp_sec': frame_times[start:end] / 1e9,
+            'duration_ms': durations_ms[start:end],
+        }
+        if source_frame_indices is not None:
+            frames['source_frame_index'] = source_frame_indices[start:end]
+
+        chunk_events = event_indices[offsets[start]:offsets[end]]
+        fields = list(zip(*(_event_fields(row) for row in take_rows(events, chunk_events)))) or [()] * (1 + len(EVENT_PARAM_COLUMNS))
+        event_columns = {
+            'frame_index': np.repeat(np.arange(start, end, dtype=np.int64), np.diff(offsets[start:end + 1])),
+            'timestamp_ns': event_times[chunk_events],
+            'event_type': np.array(fields[0], dtype=str),
+        }
+        for name, values in zip(EVENT_PARAM_COLUMNS, fields[1:]):
+            event_columns[name] = np.array(values, dtype=str)
+        yield frames, event_columns
+
+
+class _NpyColumn:
+    """以流的方式写一个 .npy 文件: 先按最终长度写好头部，再逐块追加数据，不需要把整列放进内存。"""
+
+    def __init__(self, path: str, dtype, length: int):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self._file = open(path, 'wb')
+        header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': (length,)}
+        np.lib.format.write_array_header_2_0(self._file, header)
+        self._remaining = length
+
+    def write(self, values: np.ndarray):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        self._remaining -= len(values)
+        self._file.write(values.tobytes())
+
+    def close(self):
+        self._file.close()
+        if self._remaining != 0:
+            raise ValueError(f"{self.path}: 写入的行数与头部声明不一致 (差 {self._remaining} 行)")
+
+
+class _NpyTextColumn:
+    """
+    定长 Unicode 字符串列，宽度在写完之前未知: 每块先按自己的宽度写成一个临时 .npy，
+    关闭时再按所有块的最大宽度拼成一个 .npy，不需要为了宽度预先扫描一遍事件。
+    """
+
+    def __init__(self, path: str, length: int):
+        self.path = path
+        self._length = length
+        self._parts: List[str] = []
+        self._width = 1
+
+    def write(self, values: np.ndarray):
+        if len(values) == 0:
+            return
+        values = np.asarray(values, dtype=str)
+        part = f"{self.path}.{len(self._parts)}"
+        with open(part, 'wb') as f:
+            np.lib.format.write_array(f, values, allow_pickle=False)
+        self._parts.append(part)
+        self._width = max(self._width, values.dtype.itemsize // np.dtype('<U1').itemsize)
+
+    def close(self):
+        column = _NpyColumn(self.path, f'<U{self._width}', self._length)
+        try:
+            for part in self._parts:
+                column.write(np.load(part, mmap_mode='r'))
+                os.remove(part)
+        finally:
+            column.close()
+
+
+class _NpzWriter:
+    """
+    每一列先流式写成临时目录中的一个 .npy，全部写完后再依次打包成不压缩的 zip (与 np.savez 的格式相同，np.load 直接读取)。
+    字符串列 (dtype 为不定宽度的 str) 是定长的 NumPy Unicode 数组，宽度取写入的最长值，见 _NpyTextColumn。
+    """
+
+    def __init__(self, path: str, frame_dtypes: Dict[str, np.dtype], event_dtypes: Dict[str, np.dtype],
+                 n_frames: int, n_events: int):
+        self.path = path
+        self._temp_dir = tempfile.mkdtemp(prefix='.columnar_', dir=os.path.dirname(os.path.abspath(path)))
+        self._columns = {}
+        for table, dtypes, length in (('frames', frame_dtypes, n_frames), ('events', event_dtypes, n_events)):
+            for name, dtype in dtypes.items():
+                member = f"{table}_{name}"
+                path = os.path.join(self._temp_dir, f"{member}.npy")
+                if np.dtype(dtype) == np.dtype(str):
+                    self._columns[member] = _NpyTextColumn(path, length)
+                else:
+                    self._columns[member] = _NpyColumn(path, dtype, length)
+
+    def write_batch(self, frames: Dict[str, np.ndarray], events: Dict[str, np.ndarray]):
+        for table, columns in (('frames', frames), ('events', events)):
+            for name, values in columns.items():
+                self._columns[f"{table}_{name}"].write(values)
+
+    def close(self):
+        try:
+            for column in self._columns.values():
+                column.close()
+            temp_path = self.path + '.tmp'
+            with zipfile.ZipFile(temp_path, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+                for member, column in self._columns.items():
+                    archive.write(column.path, arcname=f"{member}.npy")
+            os.replace(temp_path, self.path)
+        finally:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def _to_arrow_batch(pa, columns: Dict[str, np.ndarray], text_columns: Sequence[str]):
+    arrays = {}
+    for name, values in columns.items():
+        if name in text_columns:
+            # 空串在 Arrow 中记为 null
+            array = pa.array(values.tolist(), type=pa.string())
+            arrays[name] = pa.compute.if_else(pa.compute.equal(array, ''), pa.scalar(None, pa.string()), array)
+        else:
+            arrays[name] = pa.array(values)
+    return pa.RecordBatch.from_pydict(arrays)
+
+
+def write_columnar_output(output_base: str, frame_timestamps_relative: Sequence[int], offsets: np.ndarray,
+                          event_indices: np.ndarray, events_absolute: Sequence[list], video_start_ns: int,
+                          source_frame_indices: Optional[Sequence[int]] = None, fmt: str = 'npz',
+                          chunk_frames: int = DEFAULT_CHUNK_FRAMES) -> List[str]:
+    """
+    把对齐结果 (videoandevents_decoder.align_events_to_frames 返回的 CSR) 按块写成列式文件，返回实际写出的文件路径。
+    需要 pyarrow 的格式在未安装 pyarrow 时退回 'npz'；parquet/arrow 的表结构来自第一块数据，没有帧时不写出文件。
+    """
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"未知的列式输出格式: {fmt} (可选 {', '.join(COLUMNAR_FORMATS)})")
+    pa = None
+    if fmt != 'npz':
+        pa = _import_pyarrow()
+        if pa is None:
+            print(f"警告: 未安装 pyarrow，无法写出 {fmt}，改为写出 npz。")
+            fmt = 'npz'
+
+    frame_times = np.asarray(frame_timestamps_relative, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    event_indices = np.asarray(event_indices, dtype=np.int64)
+    event_times = event_timestamps(events_absolute) - video_start_ns
+    source = None if source_frame_indices is None else np.asarray(source_frame_indices, dtype=np.int64)
+
+    chunks = _iter_chunks(frame_times, offsets, event_indices, event_times, events_absolute, source, chunk_frames)
+
+    paths = columnar_output_paths(output_base, fmt)
+    print(f"正在将分析结果按列写入 {', '.join(paths)}...")
+    text_columns = ('event_type',) + EVENT_PARAM_COLUMNS
+
+    if fmt == 'npz':
+        frame_dtypes = {'frame_index': np.int64, 'timestamp_ns': np.int64, 'timestamp_sec': np.float64, 'duration_ms': np.float64}
+        if source is not None:
+            frame_dtypes['source_frame_index'] = np.int64
+        event_dtypes = {'frame_index': np.int64, 'timestamp_ns': np.int64}
+        event_dtypes.update(dict.fromkeys(text_columns, np.dtype(str)))
+        writer = _NpzWriter(paths[0], frame_dtypes, event_dtypes, len(frame_times), len(event_indices))
+        for frames, events in chunks:
+            writer.write_batch(frames, events)
+        writer.close()
+    else:
+        import pyarrow.compute  # noqa: F401  (_to_arrow_batch 通过 pa.compute 使用)
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            open_writer = pq.ParquetWriter
+        else:
+            open_writer = pa.ipc.new_file
+
+        frame_writer = event_writer = None
+        try:
+            for frames, events in chunks:
+                frame_batch = _to_arrow_batch(pa, frames, ())
+                event_batch = _to_arrow_batch(pa, events, text_columns)
+                if frame_writer is None:
+                    frame_writer = open_writer(paths[0], frame_batch.schema)
+                    event_writer = open_writer(paths[1], event_batch.schema)
+                frame_writer.write_batch(frame_batch)
+                event_writer.write_batch(event_batch)
+        finally:
+            for writer in (frame_writer, event_writer):
+                if writer is not None:
+                    writer.close()
+        if frame_writer is None:
+            print("没有帧，未写出列式文件。")
+            return []
+
+    print("写入完成！")
+    return paths
@@ -0,0 +1,104 @@
+// event_ring.h
+// 与平台无关的单生产者/单消费者无锁事件环形缓冲区。
+// 生产者 (原始输入消息循环线程或合成事件线程) 写入定长事件记录时不需要持有 GIL，
+// 消费者 (Python 调用 drain) 一次性批量取出。
+#pragma once
+
+#include <atomic>
+#include <cstddef>
+#include <cstdint>
+#include <vector>
+
+// --- 事件类型编码 (与 native_events.py 中的 EVENT_TYPE_CODES 保持一致) ---
+enum EventType : int32_t {
+    EVENT_MOUSE_MOVE = 1,
+    EVENT_MOUSE_DOWN = 2,
+    EVENT_MOUSE_UP = 3,
+    EVENT_MOUSE_WHEEL = 4,
+    EVENT_KEY_DOWN = 5,
+    EVENT_KEY_UP = 6,
+};
+
+// --- 鼠标按键编码 ---
+enum MouseButton : int32_t {
+    BUTTON_NONE = 0,
+    BUTTON_LEFT = 1,
+    BUTTON_RIGHT = 2,
+    BUTTON_MIDDLE = 3,
+};
+
+// 定长事件记录，drain() 返回的 NumPy 结构化数组与其内存布局一致
+struct EventRecord {
+    int64_t timestamp_ns;        // 合并后的鼠标移动记录为最后一个样本的时间戳
+    int32_t type;
+    int32_t dx;
+    int32_t dy;
+    int32_t abs_x;
+    int32_t abs_y;
+    int32_t button;              // 鼠标按键编码，键盘事件时为虚拟键码
+    int32_t wheel;
+    int32_t samples;             // 合并进这条记录的原始样本数，未合并的记录为 1
+    int64_t first_timestamp_ns;  // 第一个样本的时间戳，未合并的记录与 timestamp_ns 相同
+};
+
+class EventRing {
+public:
+    explicit EventRing(size_t capacity) {
+        // 容量向上取整到 2 的幂，用掩码代替取模
+        size_t cap = 1;
+        while (cap < capacity) cap <<= 1;
+        buffer_.resize(cap);
+        mask_ = cap - 1;
+    }
+
+    // 生产者调用。环满时丢弃这条记录并计入 dropped，返回 false。
+    bool push(const EventRecord& record) noexcept {
+        const uint64_t head = head_.load(std::memory_order_relaxed);
+        const uint64_t tail = tail_.load(std::memory_order_acquire);
+        if (head - tail > mask_) {
+            dropped_.fetch_add(1, std::memory_order_relaxed);
+            return false;
+        }
+        buffer_[head & mask_] = record;
+        head_.store(head + 1, std::memory_order_release);
+        pushed_.fetch_add(1, std::memory_order_relaxed);
+
+        const uint64_t used = head + 1 - tail;
+        uint64_t peak = peak_.load(std::memory_order_relaxed);
+        while (used > peak && !peak_.compare_exchange_weak(peak, used, std::memory_order_relaxed)) {
+        }
+        return true;
+    }
+
+    // 消费者调用。最多取出 max_count 条记录写入 out，返回实际取出的数量。
+    size_t pop_into(EventRecord* out, size_t max_count) noexcept {
+        const uint64_t tail = tail_.load(std::memory_order_relaxed);
+        const uint64_t head = head_.load(std::memory_order_acquire);
+        size_t count = static_cast<size_t>(head - tail);
+        if (count > max_count) count = max_count;
+        for (size_t i = 0; i < count; ++i) {
+            out[i] = buffer_[(tail + i) & mask_];
+        }
+        tail_.store(tail + count, std::memory_order_release);
+        return count;
+    }
+
+    size_t size() const noexcept {
+        return static_cast<size_t>(head_.load(std::memory_order_acquire) - tail_.load(std::memory_order_acquire));
+    }
+
+    size_t capacity() const noexcept { return mask_ + 1; }
+    uint64_t pushed() const noexcept { return pushed_.load(std::memory_order_relaxed); }
+    uint64_t dropped() const noexcept { return dropped_.load(std::memory_order_relaxed); }
+    uint64_t drained() const noexcept { return tail_.load(std::memory_order_acquire); }
+    uint64_t peak() const noexcept { return peak_.load(std::memory_order_relaxed); }
+
+private:
+    std::vector<EventRecord> buffer_;
+    size_t mask_ = 0;
+    alignas(64) std::atomic<uint64_t> head_{0};
+    alignas(64) std::atomic<uint64_t> tail_{0};
+    alignas(64) std::atomic<uint64_t> pushed_{0};
+    std::atomic<uint64_t> dropped_{0};
+    std::atomic<uint64_t> peak_{0};
+};
@@ -1,18 +1,38 @@
 // input_module.cpp
 #include <pybind11/pybind11.h>
 #include <pybind11/functional.h>
+#include <pybind11/numpy.h>
+#ifdef _WIN32
 #include <Windows.h>
+#endif
+#include <atomic>
+#include <chrono>
+#include <memory>
+#include <mutex>
 #include <thread>
 #include <functional>
 #include <vector>
 
+#include "event_ring.h"
+#include "motion_coalescer.h"
+
 namespace py = pybind11;
 
 // --- 全局变量 ---
 std::function<void(py::tuple)> g_callback;
-LARGE_INTEGER g_perf_frequency;
+std::unique_ptr<EventRing> g_ring;            // 批量模式下的事件环
+std::atomic<bool> g_buffered{false};          // true: 事件写入 g_ring；false: 逐条回调 g_callback
+std::atomic<bool> g_producer_active{false};   // 已有后台生产者线程 (消息循环或合成事件线程)
+std::atomic<bool> g_synthetic_stop{false};
+std::thread g_synthetic_thread;
+std::mutex g_drain_mutex;                     // 只串行化消费者，生产者路径保持无锁
+MotionCoalescer g_coalescer;                  // 鼠标移动合并，只由当前生产者线程访问
+std::atomic<uint64_t> g_motion_samples{0};    // 进入合并器的原始移动样本数
 
 // --- C++核心逻辑 ---
+#ifdef _WIN32
+LARGE_INTEGER g_perf_frequency;
+
 uint64_t get_timestamp_ns() {
     LARGE_INTEGER count;
     QueryPerformanceCounter(&count);
@@ -21,7 +41,100 @@ uint64_t get_timestamp_ns() {
     uint64_t nano_part = (remainder * 1000000000) / g_perf_frequency.QuadPart;
     return (seconds * 1000000000) + nano_part;
 }
+#else
+// 非 Windows 平台只用于合成事件测试，使用与 time.perf_counter_ns() 相同的单调时钟
+uint64_t get_timestamp_ns() {
+    return static_cast<uint64_t>(std::chrono::duration_cast<std::chrono::nanoseconds>(
+        std::chrono::steady_clock::now().time_since_epoch()).count());
+}
+#endif
+
+EventRecord make_record(uint64_t timestamp, int32_t type, int32_t dx, int32_t dy,
+                        int32_t abs_x, int32_t abs_y, int32_t button, int32_t wheel) {
+    EventRecord record;
+    record.timestamp_ns = static_cast<int64_t>(timestamp);
+    record.type = type;
+    record.dx = dx;
+    record.dy = dy;
+    record.abs_x = abs_x;
+    record.abs_y = abs_y;
+    record.button = button;
+    record.wheel = wheel;
+    record.samples = 1;
+    record.first_timestamp_ns = record.timestamp_ns;
+    return record;
+}
+
+const char* button_name(int32_t button) {
+    switch (button) {
+        case BUTTON_LEFT: return "left";
+        case BUTTON_RIGHT: return "right";
+        case BUTTON_MIDDLE: return "middle";
+        default: return "unknown";
+    }
+}
+
+// 把一条事件交给 Python：批量模式下只写入无锁环，不触碰 GIL；回调模式下保持原有的元组格式。
+// 返回 false 表示事件环已满、记录被丢弃。
+bool emit_record(const EventRecord& r) {
+    if (g_buffered.load(std::memory_order_relaxed)) {
+        return g_ring->push(r);
+    }
+    if (!g_callback) return true;
+
+    py::gil_scoped_acquire acquire;
+    uint64_t timestamp = static_cast<uint64_t>(r.timestamp_ns);
+    switch (r.type) {
+        case EVENT_MOUSE_MOVE:
+            g_callback(py::make_tuple(timestamp, "mouse_move", r.dx, r.dy, r.abs_x, r.abs_y));
+            break;
+        case EVENT_MOUSE_DOWN:
+            g_callback(py::make_tuple(timestamp, "mouse_down", button_name(r.button), r.abs_x, r.abs_y));
+            break;
+        case EVENT_MOUSE_UP:
+            g_callback(py::make_tuple(timestamp, "mouse_up", button_name(r.button), r.abs_x, r.abs_y));
+            break;
+        case EVENT_MOUSE_WHEEL:
+            g_callback(py::make_tuple(timestamp, "mouse_wheel", r.wheel, r.abs_x, r.abs_y));
+            break;
+        case EVENT_KEY_DOWN:
+            g_callback(py::make_tuple(timestamp, "key_down", r.button));
+            break;
+        case EVENT_KEY_UP:
+            g_callback(py::make_tuple(timestamp, "key_up", r.button));
+            break;
+        default:
+            break;
+    }
+    return true;
+}
+
+// 输出合并器中尚未写出的移动记录
+bool flush_pending_motion() {
+    EventRecord summary;
+    return g_coalescer.flush(&summary) ? emit_record(summary) : true;
+}
+
+// 所有生产者都通过这里提交事件：开启合并时移动样本先进入合并器，
+// 按键/滚轮/键盘事件之前先输出累积的移动，保证事件按时间顺序写出
+bool submit_record(const EventRecord& r) {
+    if (!g_coalescer.enabled()) return emit_record(r);
+    if (r.type == EVENT_MOUSE_MOVE) {
+        g_motion_samples.fetch_add(1, std::memory_order_relaxed);
+        EventRecord summary;
+        return g_coalescer.add(r, &summary) ? emit_record(summary) : true;
+    }
+    bool flushed = flush_pending_motion();
+    return emit_record(r) && flushed;
+}
+
+// 鼠标停下来后合并窗口到期，由生产者线程定期调用
+void flush_stale_motion() {
+    EventRecord summary;
+    if (g_coalescer.flush_if_due(static_cast<int64_t>(get_timestamp_ns()), &summary)) emit_record(summary);
+}
 
+#ifdef _WIN32
 LRESULT CALLBACK WndProc(HWND hwnd, UINT msg, WPARAM wParam, LPARAM lParam) {
     switch (msg) {
         case WM_INPUT: {
@@ -37,8 +150,6 @@ LRESULT CALLBACK WndProc(HWND hwnd, UINT msg, WPARAM wParam, LPARAM lParam) {
             auto* raw = (RAWINPUT*)buffer.data();
             uint64_t timestamp = get_timestamp_ns();
 
-            py::gil_scoped_acquire acquire;
-
             if (raw->header.dwType == RIM_TYPEMOUSE) {
                 // === 新增: 获取鼠标绝对坐标 ===
                 POINT cursor_pos;
@@ -49,37 +160,37 @@ LRESULT CALLBACK WndProc(HWND hwnd, UINT msg, WPARAM wParam, LPARAM lParam) {
 
                 // 1. 处理鼠标移动 (数据包中加入绝对坐标)
                 if (mouse.lLastX != 0 || mouse.lLastY != 0) {
-                    // === 修改: 新增 cursor_pos.x 和 cursor_pos.y ===
-                    g_callback(py::make_tuple(timestamp, "mouse_move", mouse.lLastX, mouse.lLastY, cursor_pos.x, cursor_pos.y));
+                    submit_record(make_record(timestamp, EVENT_MOUSE_MOVE, mouse.lLastX, mouse.lLastY, cursor_pos.x, cursor_pos.y, BUTTON_NONE, 0));
                 }
 
                 // 2. 处理鼠标按键 (数据包中加入绝对坐标)
                 USHORT flags = mouse.usButtonFlags;
-                // === 修改: 为所有按键事件新增 cursor_pos.x 和 cursor_pos.y ===
-                if (flags & RI_MOUSE_LEFT_BUTTON_DOWN)   g_callback(py::make_tuple(timestamp, "mouse_down", "left", cursor_pos.x, cursor_pos.y));
-                if (flags & RI_MOUSE_LEFT_BUTTON_UP)     g_callback(py::make_tuple(timestamp, "mouse_up", "left", cursor_pos.x, cursor_pos.y));
-                if (flags & RI_MOUSE_RIGHT_BUTTON_DOWN)  g_callback(py::make_tuple(timestamp, "mouse_down", "right", cursor_pos.x, cursor_pos.y));
-                if (flags & RI_MOUSE_RIGHT_BUTTON_UP)    g_callback(py::make_tuple(timestamp, "mouse_up", "right", cursor_pos.x, cursor_pos.y));
-                if (flags & RI_MOUSE_MIDDLE_BUTTON_DOWN) g_callback(py::make_tuple(timestamp, "mouse_down", "middle", cursor_pos.x, cursor_pos.y));
-                if (flags & RI_MOUSE_MIDDLE_BUTTON_UP)   g_callback(py::make_tuple(timestamp, "mouse_up", "middle", cursor_pos.x, cursor_pos.y));
+                if (flags & RI_MOUSE_LEFT_BUTTON_DOWN)   submit_record(make_record(timestamp, EVENT_MOUSE_DOWN, 0, 0, cursor_pos.x, cursor_pos.y, BUTTON_LEFT, 0));
+                if (flags & RI_MOUSE_LEFT_BUTTON_UP)     submit_record(make_record(timestamp, EVENT_MOUSE_UP, 0, 0, cursor_pos.x, cursor_pos.y, BUTTON_LEFT, 0));
+                if (flags & RI_MOUSE_RIGHT_BUTTON_DOWN)  submit_record(make_record(timestamp, EVENT_MOUSE_DOWN, 0, 0, cursor_pos.x, cursor_pos.y, BUTTON_RIGHT, 0));
+                if (flags & RI_MOUSE_RIGHT_BUTTON_UP)    submit_record(make_record(timestamp, EVENT_MOUSE_UP, 0, 0, cursor_pos.x, cursor_pos.y, BUTTON_RIGHT, 0));
+                if (flags & RI_MOUSE_MIDDLE_BUTTON_DOWN) submit_record(make_record(timestamp, EVENT_MOUSE_DOWN, 0, 0, cursor_pos.x, cursor_pos.y, BUTTON_MIDDLE, 0));
+                if (flags & RI_MOUSE_MIDDLE_BUTTON_UP)   submit_record(make_record(timestamp, EVENT_MOUSE_UP, 0, 0, cursor_pos.x, cursor_pos.y, BUTTON_MIDDLE, 0));
 
                 // 3. 处理滚轮事件 (数据包中加入绝对坐标)
                 if (flags & RI_MOUSE_WHEEL) {
                     short wheel_delta = (short)mouse.usButtonData;
-                    // === 修改: 新增 cursor_pos.x 和 cursor_pos.y ===
-                    g_callback(py::make_tuple(timestamp, "mouse_wheel", wheel_delta, cursor_pos.x, cursor_pos.y));
+                    submit_record(make_record(timestamp, EVENT_MOUSE_WHEEL, 0, 0, cursor_pos.x, cursor_pos.y, BUTTON_NONE, wheel_delta));
                 }
 
             } else if (raw->header.dwType == RIM_TYPEKEYBOARD) {
                 const auto& kbd = raw->data.keyboard;
                 if (kbd.Flags == RI_KEY_MAKE) {
-                    g_callback(py::make_tuple(timestamp, "key_down", kbd.VKey));
+                    submit_record(make_record(timestamp, EVENT_KEY_DOWN, 0, 0, 0, 0, kbd.VKey, 0));
                 } else if (kbd.Flags == RI_KEY_BREAK) {
-                    g_callback(py::make_tuple(timestamp, "key_up", kbd.VKey));
+                    submit_record(make_record(timestamp, EVENT_KEY_UP, 0, 0, 0, 0, kbd.VKey, 0));
                 }
             }
             return 0;
         }
+        case WM_TIMER:
+            flush_stale_motion();
+            return 0;
         case WM_DESTROY:
             PostQuitMessage(0);
             break;
@@ -114,25 +225,214 @@ void run_message_loop() {
 
     if (!RegisterRawInputDevices(rids, 2, sizeof(RAWINPUTDEVICE))) { return; }
 
+    // 开启鼠标移动合并时，用定时器在鼠标停止移动后把最后一个窗口按时写出
+    if (g_coalescer.enabled()) {
+        UINT period_ms = static_cast<UINT>(g_coalescer.interval_ns() / 1000000);
+        SetTimer(hwnd, 1, period_ms > 0 ? period_ms : 1, NULL);
+    }
+
     MSG msg;
     while (GetMessage(&msg, NULL, 0, 0) > 0) {
         TranslateMessage(&msg);
         DispatchMessage(&msg);
     }
 }
+#endif
 
 void start_listener(std::function<void(py::tuple)> callback) {
-    if (g_callback) return;
+#ifdef _WIN32
+    if (g_callback || g_producer_active.exchange(true)) return;
     g_callback = callback;
     std::thread listener_thread(run_message_loop);
     listener_thread.detach();
+#else
+    throw std::runtime_error("The raw input listener is only supported on Windows.");
+#endif
+}
+
+// --- 批量模式 ---
+void init_ring(size_t capacity) {
+    if (g_producer_active.load()) {
+        throw std::runtime_error("Cannot replace the event ring while a producer is running.");
+    }
+    std::lock_guard<std::mutex> lock(g_drain_mutex);
+    g_ring.reset(new EventRing(capacity));
+    g_buffered.store(true);
+}
+
+void start_buffered_listener(size_t capacity) {
+#ifdef _WIN32
+    if (g_callback || g_producer_active.load()) return;
+    init_ring(capacity);
+    g_producer_active.store(true);
+    std::thread listener_thread(run_message_loop);
+    listener_thread.detach();
+#else
+    (void)capacity;
+    throw std::runtime_error("The raw input listener is only supported on Windows; use init_ring() and the inject_* functions for testing.");
+#endif
+}
+
+py::array_t<EventRecord> drain(size_t max_events) {
+    std::lock_guard<std::mutex> lock(g_drain_mutex);
+    if (!g_ring) return py::array_t<EventRecord>(0);
+
+    size_t count = g_ring->size();
+    if (max_events > 0 && count > max_events) count = max_events;
+    py::array_t<EventRecord> out(static_cast<py::ssize_t>(count));
+    EventRecord* data = out.mutable_data();
+    {
+        py::gil_scoped_release release;
+        g_ring->pop_into(data, count);
+    }
+    return out;
+}
+
+py::dict ring_stats() {
+    py::dict stats;
+    if (!g_ring) return stats;
+    stats["capacity"] = g_ring->capacity();
+    stats["size"] = g_ring->size();
+    stats["pushed"] = g_ring->pushed();
+    stats["dropped"] = g_ring->dropped();
+    stats["drained"] = g_ring->drained();
+    stats["peak"] = g_ring->peak();
+    stats["coalesced_samples"] = g_motion_samples.load(std::memory_order_relaxed);
+    stats["coalesced_records"] = g_coalescer.records();
+    return stats;
+}
+
+// --- 合成事件注入 (用于在任意平台上测试批量与溢出统计) ---
+void require_injectable() {
+    if (!g_ring) throw std::runtime_error("Call init_ring() before injecting events.");
+    if (g_producer_active.load()) throw std::runtime_error("Another producer is running; the ring only supports one producer.");
+}
+
+bool inject_event(int32_t type, int32_t dx, int32_t dy, int32_t abs_x, int32_t abs_y,
+                  int32_t button, int32_t wheel, int64_t timestamp_ns) {
+    require_injectable();
+    uint64_t timestamp = timestamp_ns >= 0 ? static_cast<uint64_t>(timestamp_ns) : get_timestamp_ns();
+    return submit_record(make_record(timestamp, type, dx, dy, abs_x, abs_y, button, wheel));
+}
+
+size_t inject_mouse_moves(size_t count, int64_t interval_ns, int32_t dx, int32_t dy) {
+    require_injectable();
+    py::gil_scoped_release release;
+    uint64_t timestamp = get_timestamp_ns();
+    int32_t x = 0, y = 0;
+    size_t accepted = 0;
+    for (size_t i = 0; i < count; ++i) {
+        x += dx;
+        y += dy;
+        if (submit_record(make_record(timestamp, EVENT_MOUSE_MOVE, dx, dy, x, y, BUTTON_NONE, 0))) ++accepted;
+        timestamp += static_cast<uint64_t>(interval_ns);
+    }
+    return accepted;
+}
+
+void synthetic_mouse_loop(double rate_hz, int64_t duration_ms) {
+    auto interval = std::chrono::nanoseconds(static_cast<int64_t>(1e9 / rate_hz));
+    auto next = std::chrono::steady_clock::now();
+    auto end = duration_ms > 0 ? next + std::chrono::milliseconds(duration_ms) : std::chrono::steady_clock::time_point::max();
+    int32_t x = 0;
+    while (!g_synthetic_stop.load(std::memory_order_relaxed) && next < end) {
+        std::this_thread::sleep_until(next);
+        x += 1;
+        submit_record(make_record(get_timestamp_ns(), EVENT_MOUSE_MOVE, 1, 0, x, 0, BUTTON_NONE, 0));
+        flush_stale_motion();
+        next += interval;
+    }
+    flush_pending_motion();
+}
+
+void start_synthetic_mouse(double rate_hz, int64_t duration_ms) {
+    require_injectable();
+    if (rate_hz <= 0) throw std::invalid_argument("rate_hz must be positive.");
+    g_synthetic_stop.store(false);
+    g_producer_active.store(true);
+    g_synthetic_thread = std::thread(synthetic_mouse_loop, rate_hz, duration_ms);
+}
+
+void stop_synthetic_mouse() {
+    if (!g_synthetic_thread.joinable()) return;
+    g_synthetic_stop.store(true);
+    {
+        py::gil_scoped_release release;
+        g_synthetic_thread.join();
+    }
+    g_producer_active.store(false);
+}
+
+// --- 鼠标移动合并 ---
+void set_mouse_coalescing(double rate_hz) {
+    if (g_producer_active.load()) {
+        throw std::runtime_error("Cannot change mouse coalescing while a producer is running.");
+    }
+    if (rate_hz < 0) throw std::invalid_argument("rate_hz must be >= 0 (0 disables coalescing).");
+    flush_pending_motion();
+    g_coalescer.set_interval_ns(rate_hz > 0 ? static_cast<int64_t>(1e9 / rate_hz) : 0);
+}
+
+double mouse_coalescing_hz() {
+    return g_coalescer.enabled() ? 1e9 / static_cast<double>(g_coalescer.interval_ns()) : 0.0;
+}
+
+// 注入测试结束时手动输出最后一个窗口 (后台生产者自己负责在退出前输出)
+bool flush_motion() {
+    if (g_producer_active.load()) {
+        throw std::runtime_error("Pending motion is flushed by the running producer.");
+    }
+    return flush_pending_motion();
+}
+
+// 模块卸载时停止合成事件线程，避免 std::thread 在未 join 的状态下析构
+void cleanup_module() {
+    g_synthetic_stop.store(true);
+    if (g_synthetic_thread.joinable()) g_synthetic_thread.join();
 }
 
 PYBIND11_MODULE(input_module_all_inf, m) {
     m.doc() = "A high-performance keyboard and mouse listener module.";
+#ifdef _WIN32
     if (!QueryPerformanceFrequency(&g_perf_frequency)) {
         throw std::runtime_error("High-resolution performance counter not available.");
     }
+#endif
+    PYBIND11_NUMPY_DTYPE(EventRecord, timestamp_ns, type, dx, dy, abs_x, abs_y, button, wheel, samples, first_timestamp_ns);
+
     m.def("start_listener", &start_listener, "Starts the input listener in a background thread.",
           py::arg("callback"));
-}
\ No newline at end of file
+
+    m.def("start_buffered_listener", &start_buffered_listener,
+          "Starts the input listener in a background thread, writing events into a lock-free ring without taking the GIL.",
+          py::arg("capacity") = 65536);
+    m.def("init_ring", &init_ring, "Creates (or replaces) the event ring and switches to batched delivery.",
+          py::arg("capacity") = 65536);
+    m.def("drain", &drain, "Removes up to max_events events (0 = all) and returns them as a NumPy structured array.",
+          py::arg("max_events") = 0);
+    m.def("stats", &ring_stats, "Returns ring counters: capacity, size, pushed, dropped, drained, peak, coalesced_samples, coalesced_records.");
+
+    m.def("set_mouse_coalescing", &set_mouse_coalescing,
+          "Coalesces raw mouse moves into one summary record per 1/rate_hz seconds (0 disables). Call before starting a producer.",
+          py::arg("rate_hz"));
+    m.def("mouse_coalescing_hz", &mouse_coalescing_hz, "Returns the current coalescing rate (0 = disabled).");
+    m.def("flush_motion", &flush_motion, "Emits the pending coalesced mouse move, if any (only when no producer is running).");
+
+    m.def("inject_event", &inject_event, "Pushes one synthetic event record into the ring.",
+          py::arg("type"), py::arg("dx") = 0, py::arg("dy") = 0, py::arg("abs_x") = 0, py::arg("abs_y") = 0,
+          py::arg("button") = 0, py::arg("wheel") = 0, py::arg("timestamp_ns") = -1);
+    m.def("inject_mouse_moves", &inject_mouse_moves, "Pushes count synthetic mouse moves spaced interval_ns apart; returns how many were accepted.",
+          py::arg("count"), py::arg("interval_ns") = 1000000, py::arg("dx") = 1, py::arg("dy") = 0);
+    m.def("start_synthetic_mouse", &start_synthetic_mouse, "Starts a background thread producing mouse moves at rate_hz.",
+          py::arg("rate_hz") = 1000.0, py::arg("duration_ms") = 0);
+    m.def("stop_synthetic_mouse", &stop_synthetic_mouse, "Stops the synthetic mouse thread.");
+
+    m.attr("EVENT_MOUSE_MOVE") = static_cast<int>(EVENT_MOUSE_MOVE);
+    m.attr("EVENT_MOUSE_DOWN") = static_cast<int>(EVENT_MOUSE_DOWN);
+    m.attr("EVENT_MOUSE_UP") = static_cast<int>(EVENT_MOUSE_UP);
+    m.attr("EVENT_MOUSE_WHEEL") = static_cast<int>(EVENT_MOUSE_WHEEL);
+    m.attr("EVENT_KEY_DOWN") = static_cast<int>(EVENT_KEY_DOWN);
+    m.attr("EVENT_KEY_UP") = static_cast<int>(EVENT_KEY_UP);
+
+    m.add_object("_cleanup", py::capsule(cleanup_module));
+}
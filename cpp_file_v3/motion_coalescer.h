@@ -0,0 +1,73 @@
+// motion_coalescer.h
+// 鼠标移动合并: 把一个时间窗口内的原始 mouse_move 样本合并为一条记录
+// (相对位移求和、保留最后的绝对坐标、样本数以及首末样本时间戳)。
+// 只由生产者线程 (原始输入消息循环或合成事件线程) 调用，不需要加锁。
+#pragma once
+
+#include <atomic>
+#include <cstdint>
+
+#include "event_ring.h"
+
+class MotionCoalescer {
+public:
+    // interval_ns <= 0 表示关闭合并，每个样本原样输出
+    void set_interval_ns(int64_t interval_ns) noexcept {
+        interval_ns_ = interval_ns;
+        pending_ = false;
+    }
+
+    bool enabled() const noexcept { return interval_ns_ > 0; }
+    bool pending() const noexcept { return pending_; }
+    int64_t interval_ns() const noexcept { return interval_ns_; }
+
+    // 加入一个移动样本。样本超出当前窗口时，先把已累积的窗口写入 out 并返回 true，
+    // 再以这个样本开启新窗口。
+    bool add(const EventRecord& sample, EventRecord* out) noexcept {
+        bool emitted = false;
+        if (pending_ && sample.timestamp_ns - window_start_ns_ >= interval_ns_) {
+            emitted = flush(out);
+        }
+        if (!pending_) {
+            pending_ = true;
+            window_start_ns_ = sample.timestamp_ns;
+            summary_ = sample;
+            summary_.samples = 0;
+            summary_.dx = 0;
+            summary_.dy = 0;
+            summary_.first_timestamp_ns = sample.timestamp_ns;
+        }
+        summary_.timestamp_ns = sample.timestamp_ns;
+        summary_.dx += sample.dx;
+        summary_.dy += sample.dy;
+        summary_.abs_x = sample.abs_x;
+        summary_.abs_y = sample.abs_y;
+        summary_.samples += sample.samples > 0 ? sample.samples : 1;
+        return emitted;
+    }
+
+    // 输出尚未写出的窗口 (按键/滚轮/键盘事件之前调用，保证时间顺序)
+    bool flush(EventRecord* out) noexcept {
+        if (!pending_) return false;
+        *out = summary_;
+        pending_ = false;
+        records_.fetch_add(1, std::memory_order_relaxed);
+        return true;
+    }
+
+    // 鼠标停止移动后，由定时器在窗口到期时调用，避免最后一段移动一直滞留
+    bool flush_if_due(int64_t now_ns, EventRecord* out) noexcept {
+        if (!pending_ || now_ns - window_start_ns_ < interval_ns_) return false;
+        return flush(out);
+    }
+
+    // 已输出的合并记录数 (stats() 在其它线程读取)
+    uint64_t records() const noexcept { return records_.load(std::memory_order_relaxed); }
+
+private:
+    int64_t interval_ns_ = 0;
+    bool pending_ = false;
+    int64_t window_start_ns_ = 0;
+    EventRecord summary_{};
+    std::atomic<uint64_t> records_{0};
+};
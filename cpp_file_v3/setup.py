@@ -3,9 +3,16 @@ import sys
 from setuptools import setup, Extension
 import pybind11
 
-# 检查操作系统，此模块仅适用于Windows
-if sys.platform != "win32":
-    raise RuntimeError("This module is only supported on Windows.")
+# 原始输入监听只适用于 Windows；其它平台上只编译与平台无关的事件环与合成事件注入接口，
+# 便于在 Linux 上构建并测试批量投递和溢出统计
+if sys.platform == "win32":
+    # MSVC编译器的额外参数
+    extra_compile_args = ['/std:c++17', '/EHsc']
+    # 需要链接的Windows库 (setuptools通常会自动处理，但显式指定更可靠)
+    libraries = ['user32']
+else:
+    extra_compile_args = ['-std=c++17', '-O2']
+    libraries = []
 
 # 定义C++扩展模块
 ext_modules = [
@@ -20,17 +27,16 @@ ext_modules = [
         ],
         # 语言
         language='c++',
-        # MSVC编译器的额外参数
-        extra_compile_args=['/std:c++17', '/EHsc'],
-        # 需要链接的Windows库 (setuptools通常会自动处理，但显式指定更可靠)
-        libraries=['user32'],
+        extra_compile_args=extra_compile_args,
+        libraries=libraries,
+        depends=['event_ring.h', 'motion_coalescer.h'],
     ),
 ]
 
 setup(
     name='input_module_all_inf',
-    version='1.0',
+    version='1.2',
     author='Your Name',
     description='A high-performance keyboard and mouse listener',
     ext_modules=ext_modules,
-)
\ No newline at end of file
+)
@@ -0,0 +1,339 @@
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from binary_event_log import take_rows
+from frame_index import build_frame_index, load_frame_index
+from input_state import INPUT_STATE_ARRAYS, compute_input_state, held_keys
+from session_layout import session_paths
+from videoandevents_decoder import load_aligned_session
+
+# --- 默认导出参数 ---
+DEFAULT_SHARD_FRAMES = 1024  # 每个分片的目标帧数，实际边界对齐到离它最近的关键帧
+EXPORT_FORMATS = ('npy', 'tar')
+DATASET_MANIFEST = "dataset.json"
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+def shard_name(shard_index: int, fmt: str) -> str:
+    """'npy' 分片是一个目录，'tar' 分片是一个 WebDataset 风格的 tar 包。"""
+    return f"shard_{shard_index:06d}" + ('.tar' if fmt == 'tar' else '')
+
+
+def shard_options_path(shard_path: str) -> str:
+    """分片旁的 JSON，记录导出该分片时的帧区间、格式和尺寸；分片写完之后才写它，它存在即表示分片完整。"""
+    return shard_path + '.json'
+
+
+def plan_shards(n_frames: int, shard_frames: int, boundaries: Optional[np.ndarray] = None) -> List[Tuple[int, int, int]]:
+    """
+    把帧序号切成区间，返回 [(分片号, 起始帧, 结束帧)]，结束帧不包含在内。
+    不给 boundaries 时每个分片固定 shard_frames 帧；给出时 (升序的候选起始帧，通常是关键帧所在的帧)，
+    每个分片的结束帧取离 起始帧 + shard_frames 最近的候选，相邻分片不会重复解码同一段 GOP。
+    """
+    if boundaries is None:
+        return [(i, start, min(start + shard_frames, n_frames))
+                for i, start in enumerate(range(0, n_frames, shard_frames))]
+    boundaries = np.asarray(boundaries, dtype=np.int64)
+    shards = []
+    start = 0
+    while start < n_frames:
+        target = start + shard_frames
+        end = n_frames
+        if target < n_frames:
+            j = int(np.searchsorted(boundaries, target))
+            candidates = [int(b) for b in boundaries[max(j - 1, 0):j + 1] if start < b < n_frames]
+            if candidates:
+                end = min(candidates, key=lambda b: abs(b - target))
+        shards.append((len(shards), start, end))
+        start = end
+    return shards
+
+
+# ==============================================================================
+# 工作进程: 从分片首帧之前最近的关键帧开始解码，只保留分片需要的帧，边解码边写出
+# ==============================================================================
+def export_shard(task: dict) -> dict:
+    t0 = time.perf_counter()
+    import av
+
+    source_pts = np.asarray(task['source_pts'], dtype=np.int64)  # 分片内每一帧对应的视频帧 pts (静止帧会重复)
+    n_frames = len(source_pts)
+    width, height = task['size']
+    final_path = task['shard_path']
+    temp_path = final_path + '.tmp'
+    if os.path.isdir(temp_path):
+        shutil.rmtree(temp_path)
+    elif os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    if task['format'] == 'npy':
+        os.makedirs(temp_path)
+        frames_out = np.lib.format.open_memmap(os.path.join(temp_path, 'frames.npy'), mode='w+', dtype=np.uint8,
+                                               shape=(n_frames, height, width, 3))
+        tar = None
+    else:
+        frames_out = None
+        tar = tarfile.open(temp_path, 'w')
+
+    # 视频帧 pts -> 分片内的位置区间 (同一个视频帧可能被还原的静止帧重复引用，位置是连续的)
+    first_position = {}
+    for position, pts in enumerate(source_pts.tolist()):
+        first_position.setdefault(pts, position)
+    last_pts = int(source_pts[-1])
+
+    written = 0
+    decoded = 0
+    try:
+        with av.open(task['video_path'], 'r') as container:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            stream.codec_context.thread_count = task['decode_threads']
+            container.seek(task['seek_pts'], stream=stream, backward=True, any_frame=False)
+
+            for frame in container.decode(stream):
+                decoded += 1
+                if frame.pts is None or frame.pts not in first_position:
+                    if frame.pts is not None and frame.pts > last_pts:
+                        break
+                    continue
+                image = frame.reformat(width=width, height=height, format='rgb24').to_ndarray()
+                position = first_position.pop(frame.pts)
+                while position < n_frames and source_pts[position] == frame.pts:
+                    if frames_out is not None:
+                        frames_out[position] = image
+                    else:
+                        _add_tar_sample(tar, task, position, image)
+                    written += 1
+                    position += 1
+                if frame.pts >= last_pts:
+                    break
+
+        if written != n_frames:
+            raise RuntimeError(f"只解码出 {written}/{n_frames} 帧 (关键帧 pts={task['seek_pts']})")
+
+        if frames_out is not None:
+            frames_out.flush()
+            del frames_out
+            _write_npy_sidecars(temp_path, task)
+        else:
+            tar.close()
+            tar = None
+    except Exception:
+        if tar is not None:
+            tar.close()
+        raise
+
+    os.replace(temp_path, final_path)
+    with open(shard_options_path(final_path), 'w', encoding='utf-8') as f:
+        json.dump(task['options'], f)
+    return {'shard': os.path.basename(final_path), 'frames': n_frames, 'decoded': decoded,
+            'seconds': time.perf_counter() - t0}
+
+
+def _add_tar_sample(tar: tarfile.TarFile, task: dict, position: int, image: np.ndarray):
+    """WebDataset 约定: 同一个键 (全局帧序号) 的 .npy 画面和 .json 元数据放在一起。"""
+    frame_index = task['frame_start'] + position
+    state = task['input_state']
+    metadata = {
+        'frame_index': frame_index,
+        'timestamp_ns': task['timestamps_ns'][position],
+        'source_frame_index': task['source_frame_indices'][position],
+        'events': task['events'][position],
+        'keys': held_keys(state['key_bitmap'][position]),
+        'buttons': int(state['button_mask'][position]),
+        'rel': [int(state['rel_x'][position]), int(state['rel_y'][position])],
+        'abs': [int(state['abs_x'][position]), int(state['abs_y'][position])],
+        'wheel': int(state['wheel'][position]),
+    }
+    buffer = io.BytesIO()
+    np.save(buffer, image)
+    for suffix, payload in (('npy', buffer.getvalue()), ('json', json.dumps(metadata).encode('utf-8'))):
+        info = tarfile.TarInfo(f"{frame_index:09d}.{suffix}")
+        info.size = len(payload)
+        tar.addfile(info, io.BytesIO(payload))
+
+
+def _write_npy_sidecars(shard_dir: str, task: dict):
+    np.save(os.path.join(shard_dir, 'frame_index.npy'),
+            np.arange(task['frame_start'], task['frame_start'] + len(task['timestamps_ns']), dtype=np.int64))
+    np.save(os.path.join(shard_dir, 'timestamps_ns.npy'), np.asarray(task['timestamps_ns'], dtype=np.int64))
+    np.save(os.path.join(shard_dir, 'source_frame_index.npy'), np.asarray(task['source_frame_indices'], dtype=np.int64))
+    for name in INPUT_STATE_ARRAYS:
+        np.save(os.path.join(shard_dir, f"{name}.npy"), task['input_state'][name])
+    with open(os.path.join(shard_dir, 'events.json'), 'w', encoding='utf-8') as f:
+        json.dump(task['events'], f)
+
+
+def _read_shard_options(shard_path: str) -> Optional[dict]:
+    try:
+        with open(shard_options_path(shard_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _remove_shard(shard_path: str):
+    """删除不完整或导出参数不同的旧分片及其参数文件。"""
+    if os.path.isdir(shard_path):
+        shutil.rmtree(shard_path)
+    elif os.path.exists(shard_path):
+        os.remove(shard_path)
+    if os.path.exists(shard_options_path(shard_path)):
+        os.remove(shard_options_path(shard_path))
+
+
+# ==============================================================================
+# 主流程: 对齐事件 → 规划分片 → 进程池并行解码写出
+# ==============================================================================
+def export_session(session_dir: str, output_dir: str, shard_frames: int = DEFAULT_SHARD_FRAMES, fmt: str = 'npy',
+                   workers: Optional[int] = None, resize: Optional[Tuple[int, int]] = None,
+                   decode_threads: Optional[int] = None) -> dict:
+    """
+    把一次录制导出为训练用的分片数据集，返回导出摘要 (同时写入 output_dir/dataset.json)。
+    分片边界对齐到关键帧，每个分片从自己的关键帧开始解码。
+    已经完成且导出参数 (帧区间、格式、尺寸) 相同的分片会被跳过，中断后重新运行只补齐缺失的分片；参数不同的旧分片会被重新导出。
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"未知的导出格式: {fmt} (可选 {', '.join(EXPORT_FORMATS)})")
+    workers = workers or os.cpu_count() or 1
+    # 每个工作进程内部的解码线程数，合计大致等于核数
+    decode_threads = decode_threads if decode_threads is not None else max(1, (os.cpu_count() or 1) // workers)
+
+    paths = session_paths(session_dir)
+    session = load_aligned_session(paths.video, paths.events, paths.sync_time, paths.skipped_frames, paths.frame_index)
+    n_frames = len(session.frame_timestamps)
+
+    packet_index = load_frame_index(paths.frame_index)
+    if packet_index is None:
+        packet_index = build_frame_index(paths.video)
+    video_pts = np.sort(packet_index['pts'])
+    keyframe_pts = np.sort(packet_index['pts'][packet_index['keyframe'].astype(bool)])
+    source_indices = (np.asarray(session.source_frame_indices, dtype=np.int64)
+                      if session.source_frame_indices is not None else np.arange(n_frames, dtype=np.int64))
+    # 候选分片起点: 第一次显示某个关键帧的帧 (还原的静止帧会重复引用同一个视频帧)
+    first_use = np.ones(n_frames, dtype=bool)
+    first_use[1:] = source_indices[1:] != source_indices[:-1]
+    boundaries = np.flatnonzero(first_use & np.isin(video_pts[source_indices], keyframe_pts))
+
+    if resize is None:
+        import av
+        with av.open(paths.video, 'r') as container:
+            stream = container.streams.video[0]
+            resize = (stream.codec_context.width, stream.codec_context.height)
+
+    input_state = compute_input_state(n_frames, session.offsets, session.event_indices, session.events)
+    os.makedirs(output_dir, exist_ok=True)
+
+    shards = []
+    tasks = []
+    for shard_index, start, end in plan_shards(n_frames, shard_frames, boundaries):
+        name = shard_name(shard_index, fmt)
+        shards.append({'name': name, 'frame_start': start, 'frame_end': end})
+        shard_path = os.path.join(output_dir, name)
+        options = {'format': fmt, 'frame_start': start, 'frame_end': end, 'size': list(resize)}
+        if os.path.exists(shard_path) and _read_shard_options(shard_path) == options:
+            continue
+        _remove_shard(shard_path)
+
+        shard_source_pts = video_pts[source_indices[start:end]]
+        # 分片首帧之前 (含) 最近的关键帧，从这里开始解码
+        k = np.searchsorted(keyframe_pts, shard_source_pts[0], side='right') - 1
+        seek_pts = int(keyframe_pts[k]) if k >= 0 else int(video_pts[0])
+
+        events = []
+        first = int(session.offsets[start])
+        rows = take_rows(session.events, session.event_indices[first:session.offsets[end]])
+        for i in range(start, end):
+            frame_rows = rows[session.offsets[i] - first:session.offsets[i + 1] - first]
+            events.append([[row[0] - session.video_start_ns] + list(row[1:]) for row in frame_rows])
+
+        tasks.append({
+            'video_path': paths.video,
+            'shard_path': shard_path,
+            'format': fmt,
+            'frame_start': start,
+            'options': options,
+            'size': resize,
+            'decode_threads': decode_threads,
+            'seek_pts': seek_pts,
+            'source_pts': shard_source_pts,
+            'source_frame_indices': source_indices[start:end].tolist(),
+            'timestamps_ns': [int(t) for t in session.frame_timestamps[start:end]],
+            'events': events,
+            'input_state': {name: values[start:end] for name, values in input_state.items()},
+        })
+
+    print(f"[导出] {len(shards)} 个分片，其中 {len(shards) - len(tasks)} 个已完成，"
+          f"{len(tasks)} 个待导出 ({workers} 个进程 x {decode_threads} 个解码线程，输出 {resize[0]}x{resize[1]})")
+
+    t0 = time.perf_counter()
+    exported_frames = 0
+    failures = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(export_shard, task): task for task in tasks}
+            for future in as_completed(futures):
+                name = os.path.basename(futures[future]['shard_path'])
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failures.append({'name': name, 'error': str(e)})
+                    print(f"[导出] 分片 {name} 失败: {e}")
+                    continue
+                exported_frames += result['frames']
+                print(f"[导出] {result['shard']}: {result['frames']} 帧 (解码 {result['decoded']} 帧)，"
+                      f"{result['seconds']:.2f} 秒")
+    elapsed = time.perf_counter() - t0
+
+    summary = {
+        'session': os.path.abspath(session_dir),
+        'format': fmt,
+        'frame_size': list(resize),
+        'shard_frames': shard_frames,
+        'frames': n_frames,
+        'shards': shards,
+        'failed': failures,
+        'input_state_arrays': list(INPUT_STATE_ARRAYS),
+    }
+    with open(os.path.join(output_dir, DATASET_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    if exported_frames:
+        print(f"[导出] 本次导出 {exported_frames} 帧，耗时 {elapsed:.2f} 秒 ({exported_frames / elapsed:.1f} 帧/秒)")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把一次录制导出为分片的训练数据集 (画面 + 对齐的事件和输入状态)")
+    parser.add_argument('session_dir', help="录制目录，例如 Y:\\jist_dataset\\simple\\50")
+    parser.add_argument('output_dir', help="分片输出目录")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='npy',
+                        help="npy: 每个分片一个目录 (frames.npy 可内存映射)；tar: WebDataset 风格的 tar 包")
+    parser.add_argument('--shard-frames', type=int, default=DEFAULT_SHARD_FRAMES)
+    parser.add_argument('--workers', type=int, default=None, help="解码进程数，默认等于核数")
+    parser.add_argument('--decode-threads', type=int, default=None, help="每个进程的解码线程数，默认 核数 / 进程数")
+    parser.add_argument('--resize', type=parse_size, default=None, help="输出尺寸，例如 640x360 (默认保持原尺寸)")
+    args = parser.parse_args()
+
+    summary = export_session(args.session_dir, args.output_dir, args.shard_frames, args.format, args.workers,
+                             args.resize, args.decode_threads)
+    if summary['failed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+from fractions import Fraction
+from typing import Optional
+
+
+def add_encoder_stream(container, width: int, height: int, encoder_options: Optional[dict] = None):
+    """
+    在 av 容器中添加编码进程共用的 libx264 视频流: 输出 yuv420p，时间基准为 1 纳秒，帧的 pts 直接用纳秒时间差。
+    """
+    stream = container.add_stream('libx264', rate=None)
+    stream.width = width
+    stream.height = height
+    stream.pix_fmt = 'yuv420p'
+    if encoder_options:
+        stream.options = dict(encoder_options)
+    stream.time_base = Fraction(1, 1_000_000_000)
+    # 编码器的时间基准也必须是纳秒，否则新版 PyAV 会按帧序号重写 pts
+    stream.codec_context.time_base = stream.time_base
+    return stream
@@ -0,0 +1,290 @@
+import argparse
+import json
+import math
+import os
+import platform
+import socket
+import time
+from fractions import Fraction
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from frame_sources import create_frame_source, region_size
+from frame_transform import CAPTURE_PIX_FMTS, FrameTransform, output_frame_size
+
+# 编码器自动调优: 在录制区域尺寸上用一小段帧试编码 preset × crf × 线程数 × 线程方式 的组合，
+# 选出在目标帧率之上仍有余量的设置，按分辨率/像素格式/帧率存入本机的配置档，下次录制时自动加载。
+# 调优结果就是 encoder_options (threads、thread_type 与 preset、crf 一样作为编码器参数传给 libx264)，各编码进程无需改动。
+
+# --- 默认参数 ---
+DEFAULT_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster')
+DEFAULT_CRFS = ('18', '23')
+DEFAULT_THREAD_TYPES = ('slice', 'frame')  # slice: 不增加延迟；frame: 吞吐更高，但编码器会先缓存若干帧
+DEFAULT_FRAMES = 120        # 每个组合试编码的帧数
+DEFAULT_TARGET_FPS = 120
+DEFAULT_HEADROOM = 0.25     # 选中的设置的编码帧率至少为目标帧率的 1 + headroom 倍
+PROFILE_ENV = 'RECORDER_ENCODER_PROFILE'  # 覆盖配置档路径的环境变量
+
+
+def default_thread_counts() -> List[int]:
+    """0 表示由 libx264 自动决定；另外试 1 和不超过核数的 2 的幂。"""
+    cpus = os.cpu_count() or 1
+    return [0, 1] + [n for n in (2, 4, 8, 16) if n <= cpus]
+
+
+def machine_info() -> dict:
+    return {'hostname': socket.gethostname(), 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+def default_profile_path() -> str:
+    return os.environ.get(PROFILE_ENV) or os.path.join(os.path.expanduser('~'), '.recorder', 'encoder_profile.json')
+
+
+def profile_key(width: int, height: int, pix_fmt: str, target_fps: float) -> str:
+    return f"{width}x{height}_{pix_fmt}_{target_fps:g}fps"
+
+
+def recording_target_fps(config) -> float:
+    """录制的目标帧率: 捕获调度器的 capture_fps，未启用时为帧源参数中的帧率。"""
+    if config.capture_fps > 0:
+        return config.capture_fps
+    options = config.frame_source_options or {}
+    return float(options.get('target_fps') or options.get('fps') or DEFAULT_TARGET_FPS)
+
+
+# ==============================================================================
+# 配置档: {"machine": {...}, "entries": {"1920x1080_bgr24_120fps": {...}}}
+# ==============================================================================
+def load_profile(path: str) -> Optional[dict]:
+    """读取配置档；文件不存在，或是在另一台机器 (主机名或核数不同) 上生成的，返回 None。"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        profile = json.load(f)
+    machine, current = profile.get('machine', {}), machine_info()
+    if machine.get('hostname') != current['hostname'] or machine.get('cpu_count') != current['cpu_count']:
+        print(f"[编码调优] {path} 不是在本机生成的 ({machine.get('hostname')})，已忽略。")
+        return None
+    return profile
+
+
+def save_profile_entry(path: str, key: str, entry: dict):
+    profile = load_profile(path) or {}
+    profile['machine'] = machine_info()
+    profile.setdefault('entries', {})[key] = entry
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+
+
+def apply_encoder_profile(config, width: int, height: int):
+    """
+    录制开始前调用: config.encoder_profile 为 'auto' (本机默认路径) 或配置档路径时，查找与本次录制的
+    输出尺寸、像素格式和目标帧率对应的条目，用其中的 encoder_options 替换配置；
+    条目是在降低帧率后才找到可行设置的，同时把 capture_fps 设为降低后的帧率。没有对应条目时原样返回。
+    """
+    if not config.encoder_profile:
+        return config
+    path = default_profile_path() if config.encoder_profile == 'auto' else config.encoder_profile
+    profile = load_profile(path)
+    target_fps = recording_target_fps(config)
+    entry = (profile or {}).get('entries', {}).get(profile_key(width, height, config.capture_pix_fmt, target_fps))
+    if entry is None:
+        return config
+    config = config._replace(encoder_options=dict(entry['encoder_options']))
+    print(f"[编码调优] 使用本机配置档 {path}: {format_options(entry['encoder_options'])} "
+          f"(调优时 {entry['encode_fps']:.0f} fps)")
+    if entry.get('capture_fps', target_fps) < target_fps:
+        config = config._replace(capture_fps=entry['capture_fps'])
+        print(f"[编码调优] 本机编码跟不上 {target_fps:g} fps，捕获帧率降为 {entry['capture_fps']:g} fps")
+    return config
+
+
+def format_options(options: dict) -> str:
+    return " ".join(f"{k}={v}" for k, v in options.items())
+
+
+# ==============================================================================
+# 试编码
+# ==============================================================================
+def calibration_frames(source_kind: str, source_options: dict, region: tuple, transform: FrameTransform,
+                       count: int) -> Iterator[np.ndarray]:
+    """按录制时的路径 (帧源 -> 捕获阶段缩放/转换) 生成 count 帧；帧源结束时从头循环。"""
+    out = np.empty(transform.shape, dtype=np.uint8)
+    produced = 0
+    while produced < count:
+        source = create_frame_source(source_kind, region, **source_options)
+        source.start()
+        try:
+            while produced < count and not source.finished:
+                frame = source.read()
+                if frame is None:
+                    continue
+                if transform.identity:
+                    out[...] = frame
+                else:
+                    transform.apply(frame, out)
+                produced += 1
+                yield out
+        finally:
+            source.stop()
+
+
+def benchmark_encoder(frames: Iterator[np.ndarray], width: int, height: int, pix_fmt: str, encoder_options: dict,
+                      target_fps: float) -> dict:
+    """
+    只对 from_ndarray + 编码计时 (与编码进程每帧做的事相同)，帧的生成不计入。
+    码率按目标帧率折算；first_packet_frames 是第一个数据包出来之前送入的帧数 (帧级多线程会增加它)。
+    """
+    import av
+
+    codec = av.CodecContext.create('libx264', 'w')
+    codec.width = width
+    codec.height = height
+    codec.pix_fmt = 'yuv420p'
+    codec.time_base = Fraction(1, 1_000_000_000)
+    codec.options = dict(encoder_options)
+    codec.open()
+
+    period_ns = int(1e9 / target_fps)
+    encode_ns = 0
+    total_bytes = 0
+    count = 0
+    first_packet_frames = None
+    for i, data in enumerate(frames):
+        t0 = time.perf_counter_ns()
+        frame = av.VideoFrame.from_ndarray(data, format=pix_fmt)
+        frame.pts = i * period_ns
+        packets = codec.encode(frame)
+        encode_ns += time.perf_counter_ns() - t0
+        if packets and first_packet_frames is None:
+            first_packet_frames = i + 1
+        total_bytes += sum(packet.size for packet in packets)
+        count += 1
+    t0 = time.perf_counter_ns()
+    total_bytes += sum(packet.size for packet in codec.encode())
+    encode_ns += time.perf_counter_ns() - t0
+
+    return {
+        'encoder_options': dict(encoder_options),
+        'frames': count,
+        'encode_fps': count / (encode_ns / 1e9) if encode_ns else 0.0,
+        'bitrate_mbps': total_bytes * 8 / (count / target_fps) / 1e6 if count else 0.0,
+        'first_packet_frames': first_packet_frames,
+    }
+
+
+def grid(presets, crfs, thread_counts, thread_types) -> List[dict]:
+    options = []
+    for preset in presets:
+        for crf in crfs:
+            for threads in thread_counts:
+                # 单线程时线程方式没有区别，只试一次
+                for thread_type in (thread_types if threads != 1 else thread_types[:1]):
+                    options.append({'preset': preset, 'crf': str(crf), 'threads': str(threads),
+                                    'thread_type': thread_type})
+    return options
+
+
+def choose_setting(results: List[dict], target_fps: float, headroom: float, allow_lower_fps: bool) -> Optional[dict]:
+    """
+    可行的设置 (编码帧率 >= 目标帧率 × (1 + headroom)) 中，优先 crf 最低 (画质最好)，其次码率最低 (更慢的 preset 压缩更好)，
+    最后编码帧率最高。都不可行时: allow_lower_fps 为真则取最快的设置并把捕获帧率降到它能留出余量的帧率，否则返回 None。
+    """
+    required = target_fps * (1 + headroom)
+    feasible = [r for r in results if r['encode_fps'] >= required]
+    if feasible:
+        best = min(feasible, key=lambda r: (float(r['encoder_options']['crf']), r['bitrate_mbps'], -r['encode_fps']))
+        return {**best, 'target_fps': target_fps, 'capture_fps': target_fps}
+    if not allow_lower_fps or not results:
+        return None
+    fastest = max(results, key=lambda r: r['encode_fps'])
+    lowered = max(1, math.floor(fastest['encode_fps'] / (1 + headroom)))
+    return {**fastest, 'target_fps': target_fps, 'capture_fps': lowered}
+
+
+def print_results(results: List[dict], required_fps: float, chosen: Optional[dict]):
+    print(f"\n{'preset':<12}{'crf':>5}{'线程':>6}{'方式':>8}{'编码fps':>10}{'码率(Mbps)':>12}{'首包帧数':>10}")
+    for r in results:
+        options = r['encoder_options']
+        mark = " *" if chosen is not None and options == chosen['encoder_options'] else (
+            "" if r['encode_fps'] >= required_fps else "  (不足)")
+        print(f"{options['preset']:<12}{options['crf']:>5}{options['threads']:>6}{options['thread_type']:>8}"
+              f"{r['encode_fps']:>10.1f}{r['bitrate_mbps']:>12.1f}{str(r['first_packet_frames']):>10}{mark}")
+
+
+def main():
+    from recorder.config import RecorderConfig, load_config_file
+
+    parser = argparse.ArgumentParser(description="试编码一组 libx264 设置，把能以余量维持目标帧率的最佳设置存入本机配置档")
+    parser.add_argument('--config', help="录制配置文件 (RecorderConfig JSON)，从中读取区域、输出尺寸、像素格式和目标帧率")
+    parser.add_argument('--region', type=int, nargs=4, metavar=('LEFT', 'TOP', 'RIGHT', 'BOTTOM'))
+    parser.add_argument('--pix-fmt', choices=CAPTURE_PIX_FMTS, help="捕获阶段输出的像素格式")
+    parser.add_argument('--target-fps', type=float)
+    parser.add_argument('--headroom', type=float, default=DEFAULT_HEADROOM)
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES, help="每个组合试编码的帧数")
+    parser.add_argument('--source', choices=['synthetic', 'replay'], default='synthetic')
+    parser.add_argument('--pattern', default='box', help="synthetic 帧源的运动模式: static/scroll/box/noise")
+    parser.add_argument('--replay-path', help="用真实录像 (例如 final_output.mp4) 作为试编码的帧")
+    parser.add_argument('--presets', nargs='+', default=list(DEFAULT_PRESETS))
+    parser.add_argument('--crfs', nargs='+', default=list(DEFAULT_CRFS))
+    parser.add_argument('--threads', nargs='+', type=int, default=default_thread_counts(), help="0 表示自动")
+    parser.add_argument('--thread-types', nargs='+', choices=('slice', 'frame'), default=list(DEFAULT_THREAD_TYPES))
+    parser.add_argument('--allow-lower-fps', action='store_true',
+                        help="没有设置能维持目标帧率时，降低捕获帧率并保存最快的设置")
+    parser.add_argument('--profile', default=None, help=f"配置档路径，默认 {default_profile_path()}")
+    parser.add_argument('--no-save', action='store_true', help="只打印结果，不写配置档")
+    parser.add_argument('--output', help="把全部结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    config = RecorderConfig(**load_config_file(args.config)) if args.config else RecorderConfig()
+    region = tuple(args.region or config.region)
+    pix_fmt = args.pix_fmt or config.capture_pix_fmt
+    target_fps = args.target_fps or recording_target_fps(config)
+    src_w, src_h = region_size(region)
+    if args.source == 'replay':
+        if not args.replay_path:
+            parser.error("--source replay 需要同时指定 --replay-path")
+        source_options = {'path': args.replay_path, 'width': src_w, 'height': src_h, 'realtime': False}
+    else:
+        source_options = {'fps': 0, 'pattern': args.pattern}
+    width, height = output_frame_size(src_w, src_h, config.output_size)
+    transform = FrameTransform(src_w, src_h, width, height, pix_fmt, config.capture_transform)
+
+    settings = grid(args.presets, args.crfs, args.threads, args.thread_types)
+    required = target_fps * (1 + args.headroom)
+    print(f"[编码调优] {width}x{height} {pix_fmt}，目标 {target_fps:g} fps (需 >= {required:.0f} fps)，"
+          f"{len(settings)} 个组合 × {args.frames} 帧")
+    results = []
+    for options in settings:
+        frames = calibration_frames(args.source, dict(source_options), region, transform, args.frames)
+        result = benchmark_encoder(frames, width, height, pix_fmt, options, target_fps)
+        print(f"[编码调优] {format_options(options)}: {result['encode_fps']:.1f} fps, {result['bitrate_mbps']:.1f} Mbps")
+        results.append(result)
+
+    chosen = choose_setting(results, target_fps, args.headroom, args.allow_lower_fps)
+    print_results(results, required, chosen)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'results': results, 'chosen': chosen}, f, ensure_ascii=False, indent=2)
+
+    if chosen is None:
+        print(f"\n[编码调优] 没有设置能以 {args.headroom:.0%} 的余量维持 {target_fps:g} fps。"
+              f"可以缩小录制区域 / 使用 yuv420p 捕获，或加 --allow-lower-fps 降低捕获帧率。")
+        return
+    if chosen['capture_fps'] < target_fps:
+        print(f"\n[编码调优] 没有设置能维持 {target_fps:g} fps，捕获帧率将降为 {chosen['capture_fps']:g} fps")
+    print(f"\n[编码调优] 选中: {format_options(chosen['encoder_options'])} "
+          f"({chosen['encode_fps']:.1f} fps, {chosen['bitrate_mbps']:.1f} Mbps)")
+    if not args.no_save:
+        path = args.profile or default_profile_path()
+        entry = {**chosen, 'headroom': args.headroom, 'source': args.replay_path or f"synthetic:{args.pattern}",
+                 'calibrated_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+        save_profile_entry(path, profile_key(width, height, pix_fmt, target_fps), entry)
+        print(f"[编码调优] 已写入 {path}；之后的录制 (encoder_profile='auto') 会自动使用它")
+
+
+if __name__ == "__main__":
+    main()
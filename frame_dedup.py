@@ -0,0 +1,81 @@
+from typing import Optional
+
+import numpy as np
+
+# --- 默认参数 ---
+DEFAULT_STRIDE = 2         # 比较时在行/列方向上的采样步长，1 表示逐像素比较
+DEFAULT_HEARTBEAT_FPS = 5  # 画面静止时仍保留的最低帧率，0 表示不保留心跳帧
+
+
+class StaticFrameDetector:
+    """
+    廉价的静止帧检测器: 只比较帧的跨步采样视图 frame[::stride, ::stride]，
+    与上一个保留帧完全相同就视为重复帧。步长越大越省 CPU，但越可能漏掉很小的变化 (例如 1 像素宽的光标)。
+    heartbeat_fps > 0 时，即使画面不变，也至少按该帧率保留一帧。
+    """
+
+    def __init__(self, stride: int = DEFAULT_STRIDE, heartbeat_fps: float = DEFAULT_HEARTBEAT_FPS):
+        self.stride = max(1, int(stride))
+        self.heartbeat_ns = int(1_000_000_000 / heartbeat_fps) if heartbeat_fps > 0 else None
+        self._reference = None
+        self._last_kept_ns = None
+        self.kept = 0
+        self.skipped = 0
+
+    def should_keep(self, frame: np.ndarray, capture_time_ns: int) -> bool:
+        """
+        检查步骤: 返回 True 表示该帧需要送去编码，False 表示与上一保留帧相同，可以跳过。
+        不修改参考帧；帧确实进入帧环之后再调用 mark_kept，被帧环丢弃的帧不能成为后续重复帧的参考。
+        """
+        sample = frame[::self.stride, ::self.stride]
+        if self._reference is not None and np.array_equal(sample, self._reference):
+            if self.heartbeat_ns is None or capture_time_ns - self._last_kept_ns < self.heartbeat_ns:
+                self.skipped += 1
+                return False
+        return True
+
+    def mark_kept(self, frame: np.ndarray, capture_time_ns: int):
+        """提交步骤: 该帧已进入帧环，把它作为新的参考帧。"""
+        sample = frame[::self.stride, ::self.stride]
+        if self._reference is None or self._reference.shape != sample.shape:
+            self._reference = np.empty_like(sample)
+        np.copyto(self._reference, sample)
+        self._last_kept_ns = capture_time_ns
+        self.kept += 1
+
+
+class SkippedFrameLog:
+    """
+    被跳过的重复帧的时间戳旁路文件: 每行一个绝对的 capture_time_ns (与 video_start_time.txt 同一时钟)。
+    解码端据此把被跳过的时刻还原为 "保持上一帧画面" 的帧，从而把事件归属到正确的帧上。
+    """
+
+    def __init__(self, path: str, flush_every: int = 1024):
+        self.path = path
+        self.flush_every = flush_every
+        self._pending = []
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def append(self, capture_time_ns: int):
+        self._pending.append(capture_time_ns)
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._file.write(''.join(f"{t}\n" for t in self._pending))
+            self._pending.clear()
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def read_skipped_frames(path: str) -> Optional[np.ndarray]:
+    """读取旁路文件，返回绝对时间戳的 int64 数组；文件不存在时返回 None。"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return np.array([int(line) for line in f if line.strip()], dtype=np.int64)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,259 @@
+import os
+import struct
+import sys
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# 帧索引旁路文件 (与 video_start_time.txt 放在一起): 每个数据包一条记录，按数据包在文件中的存储 (解码) 顺序排列。
+#   pts:      显示时间戳 (与视频流同一时间基准，录制脚本中为纳秒)
+#   pos:      数据包在视频文件中的字节偏移，未知时为 -1
+#   size:     数据包在视频文件中的字节数，未知时为 -1
+#   keyframe: 是否为关键帧
+FRAME_INDEX_DTYPE = np.dtype([('pts', '<i8'), ('pos', '<i8'), ('size', '<i4'), ('keyframe', 'u1')])
+
+
+class FrameIndexWriter:
+    """
+    编码时记录每个写入容器的数据包，结束后生成帧索引旁路文件，解码端据此无需解码即可得到所有帧的时间戳。
+    编码器输出的 H.264 数据包在封装时会被改写 (Annex B 起始码转为长度前缀)，大小会变化，
+    因此字节偏移和大小在视频文件关闭后从 MP4 的样本表 (moov 中的 stsz/stco/stsc) 读出，只读取文件末尾的 moov，不读取媒体数据。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pts = []
+        self._keyframe = []
+
+    def add_packet(self, packet):
+        """在 container.mux(packet) 之前调用 (mux 之后数据包可能已被清空)。"""
+        if packet.pts is None or packet.size == 0:
+            return
+        self._pts.append(packet.pts)
+        self._keyframe.append(packet.is_keyframe)
+
+    def __len__(self):
+        return len(self._pts)
+
+    def close(self, video_path: str) -> np.ndarray:
+        """视频文件关闭后调用，写出帧索引并返回它。"""
+        index = np.zeros(len(self._pts), dtype=FRAME_INDEX_DTYPE)
+        index['pts'] = self._pts
+        index['keyframe'] = self._keyframe
+        index['pos'] = -1
+        index['size'] = -1
+
+        try:
+            table = read_mp4_sample_table(video_path)
+        except (OSError, ValueError) as e:
+            print(f"[帧索引] 读取样本表失败，字节偏移留空: {e}")
+            table = None
+        if table is not None:
+            offsets, sizes = table
+            if len(offsets) == len(index):
+                index['pos'] = offsets
+                index['size'] = sizes
+            else:
+                print(f"[帧索引] 警告: 样本表有 {len(offsets)} 个样本，而写入了 {len(index)} 个数据包，字节偏移留空。")
+
+        save_frame_index(self.path, index)
+        return index
+
+
+def save_frame_index(path: str, index: np.ndarray):
+    """先写临时文件再替换，避免中途中断留下半个索引。"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(index, dtype=FRAME_INDEX_DTYPE))
+    os.replace(temp_path, path)
+
+
+def load_frame_index(path: str) -> Optional[np.ndarray]:
+    """读取帧索引旁路文件，不存在或格式不对时返回 None。"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        index = np.load(path, allow_pickle=False)
+    except (OSError, ValueError) as e:
+        print(f"警告: 无法读取帧索引 '{path}': {e}")
+        return None
+    if index.dtype != FRAME_INDEX_DTYPE:
+        print(f"警告: 帧索引 '{path}' 的格式不符 ({index.dtype})，忽略。")
+        return None
+    return index
+
+
+def build_frame_index(video_path: str) -> np.ndarray:
+    """只解封装 (container.demux) 不解码，从视频文件本身构建帧索引。"""
+    import av
+
+    pts, pos, size, keyframe = [], [], [], []
+    with av.open(video_path, 'r') as container:
+        stream = container.streams.video[0]
+        for packet in container.demux(stream):
+            # 解封装结束时会产生一个空的刷新包
+            if packet.pts is None or packet.size == 0:
+                continue
+            pts.append(packet.pts)
+            pos.append(packet.pos if packet.pos is not None else -1)
+            size.append(packet.size)
+            keyframe.append(packet.is_keyframe)
+
+    index = np.zeros(len(pts), dtype=FRAME_INDEX_DTYPE)
+    index['pts'] = pts
+    index['pos'] = pos
+    index['size'] = size
+    index['keyframe'] = keyframe
+    return index
+
+
+def frame_timestamps(index: np.ndarray) -> np.ndarray:
+    """索引按存储顺序排列 (有 B 帧时 pts 不单调)，解码输出的帧按显示顺序，即 pts 升序。"""
+    return np.sort(index['pts'])
+
+
+def compare_frame_indexes(expected: np.ndarray, actual: np.ndarray, max_reports: int = 5) -> List[str]:
+    """逐字段比较两个帧索引，返回不一致之处的描述 (空列表表示一致)。pos/size 为 -1 的字段视为未知，不参与比较。"""
+    if len(expected) != len(actual):
+        return [f"数据包数量不同: {len(expected)} != {len(actual)}"]
+
+    problems = []
+    for field in FRAME_INDEX_DTYPE.names:
+        a, b = expected[field], actual[field]
+        mismatch = a != b
+        if field in ('pos', 'size'):
+            mismatch &= (a >= 0) & (b >= 0)
+        bad = np.flatnonzero(mismatch)
+        if len(bad):
+            first = ", ".join(f"#{i}: {a[i]} != {b[i]}" for i in bad[:max_reports])
+            problems.append(f"{field} 有 {len(bad)} 处不同 ({first})")
+    return problems
+
+
+# ==============================================================================
+# MP4 样本表解析 (ISO/IEC 14496-12)
+# ==============================================================================
+def _iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None):
+    """遍历 data[start:end] 中的同级 box，产出 (类型, 内容起点, 内容终点)。"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ValueError(f"损坏的 box '{box_type!r}' (大小 {size})")
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _find_box(data: bytes, start: int, end: int, box_type: bytes) -> Optional[Tuple[int, int]]:
+    for found_type, body_start, body_end in _iter_boxes(data, start, end):
+        if found_type == box_type:
+            return body_start, body_end
+    return None
+
+
+def _read_moov(video_path: str) -> Optional[bytes]:
+    """跳过 mdat 等大块数据，只读出顶层的 moov box。"""
+    with open(video_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            header = f.read(16)
+            size, box_type = struct.unpack_from('>I4s', header, 0)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', header, 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - offset
+            if size < header_size:
+                raise ValueError(f"损坏的顶层 box '{box_type!r}'")
+            if box_type == b'moov':
+                f.seek(offset + header_size)
+                return f.read(size - header_size)
+            offset += size
+    return None
+
+
+def read_mp4_sample_table(video_path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    读取 MP4 中第一条视频轨的样本表，返回 (每个样本的字节偏移, 每个样本的字节数)，按存储顺序排列。
+    不是 MP4 (没有 moov) 或没有视频轨时返回 None。
+    """
+    moov = _read_moov(video_path)
+    if moov is None:
+        return None
+
+    for box_type, trak_start, trak_end in _iter_boxes(moov):
+        if box_type != b'trak':
+            continue
+        mdia = _find_box(moov, trak_start, trak_end, b'mdia')
+        if mdia is None:
+            continue
+        hdlr = _find_box(moov, mdia[0], mdia[1], b'hdlr')
+        # hdlr: version/flags(4) + pre_defined(4) + handler_type(4)
+        if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+            continue
+        minf = _find_box(moov, mdia[0], mdia[1], b'minf')
+        stbl = _find_box(moov, minf[0], minf[1], b'stbl') if minf else None
+        if stbl is None:
+            raise ValueError("视频轨缺少 stbl")
+        return _parse_sample_table(moov, stbl[0], stbl[1])
+    return None
+
+
+def _parse_sample_table(data: bytes, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+    boxes = {box_type: (s, e) for box_type, s, e in _iter_boxes(data, start, end)}
+
+    # stsz: version/flags(4) + sample_size(4) + sample_count(4) + [entry_size(4) ...]
+    s, _ = boxes[b'stsz']
+    uniform_size, sample_count = struct.unpack_from('>II', data, s + 4)
+    if uniform_size:
+        sizes = np.full(sample_count, uniform_size, dtype=np.int64)
+    else:
+        sizes = np.frombuffer(data, dtype='>u4', count=sample_count, offset=s + 12).astype(np.int64)
+
+    # stco / co64: version/flags(4) + entry_count(4) + [chunk_offset ...]
+    if b'co64' in boxes:
+        s, _ = boxes[b'co64']
+        chunk_count = struct.unpack_from('>I', data, s + 4)[0]
+        chunk_offsets = np.frombuffer(data, dtype='>u8', count=chunk_count, offset=s + 8).astype(np.int64)
+    else:
+        s, _ = boxes[b'stco']
+        chunk_count = struct.unpack_from('>I', data, s + 4)[0]
+        chunk_offsets = np.frombuffer(data, dtype='>u4', count=chunk_count, offset=s + 8).astype(np.int64)
+
+    # stsc: version/flags(4) + entry_count(4) + [first_chunk(4), samples_per_chunk(4), sample_description_index(4) ...]
+    s, _ = boxes[b'stsc']
+    entry_count = struct.unpack_from('>I', data, s + 4)[0]
+    stsc = np.frombuffer(data, dtype='>u4', count=entry_count * 3, offset=s + 8).reshape(-1, 3).astype(np.int64)
+    first_chunks = np.append(stsc[:, 0] - 1, chunk_count)
+    samples_per_chunk = np.repeat(stsc[:, 1], np.diff(first_chunks))
+    if samples_per_chunk.sum() != sample_count:
+        raise ValueError("stsc 与 stsz 的样本数不一致")
+
+    # 同一 chunk 内的样本紧挨着存放: 偏移 = chunk 起点 + 本 chunk 内之前样本的大小之和
+    chunk_of_sample = np.repeat(np.arange(chunk_count), samples_per_chunk)
+    size_before = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    chunk_first_sample = np.concatenate(([0], np.cumsum(samples_per_chunk)[:-1]))
+    offsets = chunk_offsets[chunk_of_sample] + size_before - size_before[chunk_first_sample][chunk_of_sample]
+    return offsets, sizes
+
+
+if __name__ == "__main__":
+    # 为没有帧索引的旧录制补建索引: python frame_index.py final_output.mp4 [frame_index.npy]
+    if len(sys.argv) < 2:
+        print("用法: python frame_index.py <视频文件> [输出的帧索引 .npy]")
+        sys.exit(1)
+    video = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(video), "frame_index.npy")
+    built = build_frame_index(video)
+    save_frame_index(target, built)
+    print(f"已写入 {len(built)} 条帧索引到 {target}")
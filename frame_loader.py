@@ -0,0 +1,269 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from frame_index import build_frame_index, load_frame_index
+
+# --- 默认参数 ---
+DEFAULT_CACHE_BYTES = 1 << 30  # 解码后 GOP 缓存的内存上限 (1 GiB)
+
+
+class FrameLoader:
+    """
+    按帧序号随机读取录制视频的帧。帧序号与 videoandevents_decoder.read_video_timestamps 返回的时间戳列表一一对应 (pts 升序)。
+    利用帧索引旁路文件 (没有时解封装视频构建) 把帧序号映射到所属 GOP 的关键帧，直接 seek 到关键帧，只解码这一个 GOP；
+    解码好的 GOP 放进按字节数限制的 LRU 缓存，后台线程可以提前解码即将访问的 GOP。
+
+    统计 (stats()): hits / misses 为按帧请求计数的缓存命中和未命中，prefetch_waits 为等待后台线程解码中的 GOP 的次数，
+    prefetch_dropped 为预取队列已满时丢弃的预取请求数，
+    decode_ms_total / decode_ms_per_gop 为解码耗时，可用于调整 encode_process 的 GOP 大小 (编码参数 'g')。
+    """
+
+    def __init__(self, video_path: str, frame_index_path: Optional[str] = None, cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 size: Optional[Tuple[int, int]] = None, pix_fmt: str = 'rgb24', prefetch_gops: int = 0,
+                 decode_threads: int = 0):
+        """
+        size: 输出尺寸 (宽, 高)，默认保持原尺寸；pix_fmt: 输出像素格式 ('rgb24' / 'bgr24' / 'gray' ...)。
+        prefetch_gops > 0 时，每次读取帧后在后台解码其后的若干个 GOP。decode_threads 为 0 时由 FFmpeg 自动决定。
+        """
+        self.video_path = video_path
+        self.cache_bytes = cache_bytes
+        self.size = size
+        self.pix_fmt = pix_fmt
+        self.prefetch_gops = prefetch_gops
+        self.decode_threads = decode_threads
+
+        index = load_frame_index(frame_index_path) if frame_index_path else None
+        if index is None:
+            index = build_frame_index(video_path)
+        self.frame_pts = np.sort(index['pts'])
+        keyframe_pts = np.sort(index['pts'][index['keyframe'].astype(bool)])
+        if len(keyframe_pts) == 0 or keyframe_pts[0] != self.frame_pts[0]:
+            # 第一帧总是关键帧；索引里没有标记时把它补上
+            keyframe_pts = np.concatenate(([self.frame_pts[0]], keyframe_pts[keyframe_pts > self.frame_pts[0]]))
+        self.keyframe_pts = keyframe_pts
+        # 每个 GOP 的第一帧序号，最后补一个总帧数作为结束
+        self.gop_starts = np.append(np.searchsorted(self.frame_pts, keyframe_pts), len(self.frame_pts))
+
+        self._cache: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._pending: Dict[int, threading.Event] = {}
+        self._local = threading.local()
+        self._containers = []
+        self._counters = {'hits': 0, 'misses': 0, 'prefetch_waits': 0, 'evictions': 0,
+                          'decoded_gops': 0, 'decoded_frames': 0, 'decode_ns': 0, 'prefetched_gops': 0,
+                          'prefetch_dropped': 0}
+
+        # 预取队列最多排缓存预算大约能放下的 GOP 数: 排得更多的 GOP 解码出来也会马上被淘汰，队列满时丢弃新的预取请求
+        self.prefetch_queue_size = max(1, self.cache_bytes // max(1, self._estimated_gop_bytes()))
+        self._prefetch_queue: "queue.Queue[Optional[int]]" = queue.Queue(maxsize=self.prefetch_queue_size)
+        self._prefetch_thread = threading.Thread(target=self._prefetch_loop, name='FrameLoaderPrefetch', daemon=True)
+        self._prefetch_thread.start()
+
+    # --- 索引 ---
+    def __len__(self) -> int:
+        return len(self.frame_pts)
+
+    @property
+    def gop_count(self) -> int:
+        return len(self.keyframe_pts)
+
+    def gop_of(self, frame_index: int) -> int:
+        return int(np.searchsorted(self.gop_starts, frame_index, side='right') - 1)
+
+    def index_of_timestamp(self, timestamp_ns: int) -> int:
+        """相对视频开始的纳秒时间戳 -> 正在显示的帧序号 (与事件对齐的半开区间规则相同)，早于第一帧时返回 -1。"""
+        return int(np.searchsorted(self.frame_pts, timestamp_ns, side='right') - 1)
+
+    # --- 读取 ---
+    def __getitem__(self, frame_index: int) -> np.ndarray:
+        return self.get_frame(frame_index)
+
+    def get_frame(self, frame_index: int) -> np.ndarray:
+        n = len(self.frame_pts)
+        if frame_index < 0:
+            frame_index += n
+        if not 0 <= frame_index < n:
+            raise IndexError(f"帧序号 {frame_index} 超出范围 (共 {n} 帧)")
+        gop = self.gop_of(frame_index)
+        frames = self._get_gop(gop, count_access=True)
+        if self.prefetch_gops:
+            self.prefetch_gop_range(gop + 1, gop + 1 + self.prefetch_gops)
+        return frames[frame_index - self.gop_starts[gop]]
+
+    def get_frames(self, frame_indices: Iterable[int]) -> List[np.ndarray]:
+        return [self.get_frame(i) for i in frame_indices]
+
+    def prefetch(self, frame_indices: Iterable[int]):
+        """在后台解码这些帧所在的 GOP (已缓存或正在解码的会被跳过)。"""
+        for gop in sorted({self.gop_of(i) for i in frame_indices}):
+            self._enqueue_prefetch(gop)
+
+    def prefetch_gop_range(self, first_gop: int, end_gop: int):
+        for gop in range(max(0, first_gop), min(end_gop, self.gop_count)):
+            self._enqueue_prefetch(gop)
+
+    # --- 统计 ---
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            cached_gops = len(self._cache)
+            cached_bytes = self._cached_bytes
+        requests = counters['hits'] + counters['misses']
+        decode_ms_total = counters.pop('decode_ns') / 1e6
+        return {
+            **counters,
+            'hit_rate': counters['hits'] / requests if requests else 0.0,
+            'decode_ms_total': decode_ms_total,
+            'decode_ms_per_gop': decode_ms_total / counters['decoded_gops'] if counters['decoded_gops'] else 0.0,
+            'cached_gops': cached_gops,
+            'cached_bytes': cached_bytes,
+            'cache_budget_bytes': self.cache_bytes,
+            'frames': len(self.frame_pts),
+            'gops': self.gop_count,
+            'mean_gop_frames': len(self.frame_pts) / self.gop_count if self.gop_count else 0.0,
+        }
+
+    def close(self):
+        self._prefetch_queue.put(None)
+        self._prefetch_thread.join()
+        for container in self._containers:
+            container.close()
+        self._containers.clear()
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- 内部实现 ---
+    def _get_gop(self, gop: int, count_access: bool) -> np.ndarray:
+        while True:
+            with self._lock:
+                frames = self._cache.get(gop)
+                if frames is not None:
+                    self._cache.move_to_end(gop)
+                    if count_access:
+                        self._counters['hits'] += 1
+                    return frames
+                pending = self._pending.get(gop)
+                if pending is None:
+                    # 由当前线程负责解码这个 GOP
+                    pending = self._pending[gop] = threading.Event()
+                    if count_access:
+                        self._counters['misses'] += 1
+                    break
+                if count_access:
+                    self._counters['prefetch_waits'] += 1
+            # 另一个线程正在解码这个 GOP，等它完成后再查缓存
+            pending.wait()
+            count_access = False
+
+        try:
+            frames = self._decode_gop(gop)
+            with self._lock:
+                self._insert(gop, frames)
+        finally:
+            with self._lock:
+                del self._pending[gop]
+            pending.set()
+        return frames
+
+    def _insert(self, gop: int, frames: np.ndarray):
+        self._cache[gop] = frames
+        self._cached_bytes += frames.nbytes
+        # 按最近最少使用淘汰，刚放进来的这个 GOP 即使单独超出预算也保留
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted.nbytes
+            self._counters['evictions'] += 1
+
+    def _container(self):
+        """PyAV 的容器不能跨线程共用，每个线程各自打开一个。"""
+        container = getattr(self._local, 'container', None)
+        if container is None:
+            import av
+            container = av.open(self.video_path, 'r')
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            stream.codec_context.thread_count = self.decode_threads
+            self._local.container = container
+            with self._lock:
+                self._containers.append(container)
+        return container
+
+    def _decode_gop(self, gop: int) -> np.ndarray:
+        t0 = time.perf_counter_ns()
+        container = self._container()
+        stream = container.streams.video[0]
+        first, end = int(self.gop_starts[gop]), int(self.gop_starts[gop + 1])
+        first_pts = int(self.frame_pts[first])
+        end_pts = int(self.frame_pts[end]) if end < len(self.frame_pts) else None
+
+        container.seek(first_pts, stream=stream, backward=True, any_frame=False)
+        images = []
+        for frame in container.decode(stream):
+            if frame.pts is None or frame.pts < first_pts:
+                continue
+            if end_pts is not None and frame.pts >= end_pts:
+                break
+            if self.size is not None:
+                frame = frame.reformat(width=self.size[0], height=self.size[1], format=self.pix_fmt)
+            images.append(frame.to_ndarray(format=self.pix_fmt))
+            if len(images) == end - first:
+                break
+        if len(images) != end - first:
+            raise RuntimeError(f"GOP {gop} 只解码出 {len(images)}/{end - first} 帧")
+
+        frames = np.stack(images)
+        frames.flags.writeable = False  # 缓存中的数组会被多次返回，禁止调用方原地修改
+        elapsed = time.perf_counter_ns() - t0
+        with self._lock:
+            self._counters['decoded_gops'] += 1
+            self._counters['decoded_frames'] += len(images)
+            self._counters['decode_ns'] += elapsed
+        return frames
+
+    def _estimated_gop_bytes(self) -> int:
+        """按输出尺寸、像素格式和平均 GOP 帧数估计一个解码后 GOP 占用的字节数。"""
+        from av.video.format import VideoFormat
+
+        if self.size is not None:
+            width, height = self.size
+        else:
+            codec_context = self._container().streams.video[0].codec_context
+            width, height = codec_context.width, codec_context.height
+        components = VideoFormat(self.pix_fmt, width, height).components
+        frame_bytes = sum(c.bits * c.width * c.height for c in components) // 8
+        return int(frame_bytes * len(self.frame_pts) / max(1, self.gop_count))
+
+    def _enqueue_prefetch(self, gop: int):
+        try:
+            self._prefetch_queue.put_nowait(gop)
+        except queue.Full:
+            with self._lock:
+                self._counters['prefetch_dropped'] += 1
+
+    def _prefetch_loop(self):
+        while True:
+            gop = self._prefetch_queue.get()
+            if gop is None:
+                break
+            with self._lock:
+                if gop in self._cache or gop in self._pending:
+                    continue
+            try:
+                self._get_gop(gop, count_access=False)
+                with self._lock:
+                    self._counters['prefetched_gops'] += 1
+            except Exception as e:
+                print(f"[帧加载] 预取 GOP {gop} 失败: {e}")
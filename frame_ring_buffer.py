@@ -0,0 +1,262 @@
+import os
+import queue
+import sys
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+# --- 头部字段在 int64 头部数组中的下标 ---
+_HDR_WRITE_SEQ = 0      # 已提交的帧总数 (生产者独占写)
+_HDR_READ_SEQ = 1       # 已消费的帧总数 (消费者独占写)
+_HDR_DROPPED = 2        # 环满时被丢弃的新帧数 (policy='drop' 或阻塞超时)
+_HDR_OVERWRITTEN = 3    # 未被读取就被覆盖的旧帧数 (policy='overwrite')
+_HDR_CLOSED = 4         # 生产者已结束写入
+_HDR_PEAK = 5           # 观察到的最大槽位占用
+_HDR_FIELDS = 8
+
+_DATA_ALIGN = 64
+_POLICIES = ('drop', 'block', 'overwrite')
+
+
+def _align(n: int, alignment: int = _DATA_ALIGN) -> int:
+    return (n + alignment - 1) // alignment * alignment
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    在子进程中按名称挂载另一个进程创建的共享内存 (各共享内存对象的 __setstate__ 使用)。
+    回收由创建方负责: Python 3.13+ 直接以 track=False 挂载；更早的版本挂载时总会登记到 resource_tracker，
+    而 multiprocessing 的子进程 (fork/spawn/forkserver) 与父进程共用同一个 tracker，登记按名称去重，
+    此时不能注销，否则会把创建方的登记一并删掉，创建方 unlink() 时 tracker 会打印 KeyError。
+    只有与创建方无关的独立进程才需要注销自己的登记。
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # spawn/forkserver 的子进程在反序列化进程参数时 parent_process() 尚未设置，以 _inheriting 标记识别 (与标准库一致)
+    inherited = mp.parent_process() is not None or getattr(mp.current_process(), '_inheriting', False)
+    if os.name != 'nt' and not inherited:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class SharedFrameRing:
+    """
+    基于 multiprocessing.shared_memory 的预分配帧环形缓冲区 (单生产者/单消费者)。
+
+    内存布局: [int64 头部][每个槽位的时间戳][每个槽位的序号][每个槽位的入环时间][对齐后的帧数据 × slots]。
+    生产者把帧直接拷贝进空闲槽位，消费者拿到的是共享内存上的 NumPy 视图，全程不经过 pickle。
+    对象本身可以作为 mp.Process 的参数传递，子进程中会自动按名称重新挂载共享内存。
+
+    policy:
+      'drop'      环满时丢弃新帧 (等价于 put(block=False) 遇到 Full)
+      'block'     环满时等待消费者腾出槽位，超时后丢弃
+      'overwrite' 环满时覆盖最旧的未读帧，消费者读到被覆盖的槽位时会跳过
+    """
+
+    def __init__(self, frame_shape: Tuple[int, ...], slots: int = 120, dtype=np.uint8, policy: str = 'drop'):
+        if policy not in _POLICIES:
+            raise ValueError(f"未知的环形缓冲策略: {policy}")
+        if slots < 2:
+            raise ValueError("槽位数量至少为 2")
+
+        self.frame_shape = tuple(int(d) for d in frame_shape)
+        self.slots = int(slots)
+        self.dtype = np.dtype(dtype)
+        self.policy = policy
+        self.frame_nbytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+
+        self._shm = shared_memory.SharedMemory(create=True, size=self._total_size())
+        self._owner = True
+        self._ready = mp.Semaphore(0)
+        self._map_views()
+        self._header[:] = 0
+        self._slot_seq[:] = -1
+
+    # --------------------------------------------------------------------------
+    # 共享内存布局 / 跨进程传递
+    # --------------------------------------------------------------------------
+    def _meta_size(self) -> int:
+        return _align((_HDR_FIELDS + 3 * self.slots) * 8)
+
+    def _slot_stride(self) -> int:
+        return _align(self.frame_nbytes)
+
+    def _total_size(self) -> int:
+        return self._meta_size() + self._slot_stride() * self.slots
+
+    def _map_views(self):
+        buf = self._shm.buf
+        self._header = np.ndarray((_HDR_FIELDS,), dtype=np.int64, buffer=buf, offset=0)
+        self._slot_ts = np.ndarray((self.slots,), dtype=np.int64, buffer=buf, offset=_HDR_FIELDS * 8)
+        self._slot_seq = np.ndarray((self.slots,), dtype=np.int64, buffer=buf, offset=(_HDR_FIELDS + self.slots) * 8)
+        self._slot_put_ns = np.ndarray((self.slots,), dtype=np.int64, buffer=buf, offset=(_HDR_FIELDS + 2 * self.slots) * 8)
+        stride = self._slot_stride()
+        # 每个槽位起始地址按 64 字节对齐，预先为每个槽位建好 frame_shape 形状的视图
+        base = np.ndarray((self.slots, stride), dtype=np.uint8, buffer=buf, offset=self._meta_size())
+        self._frames = [base[i, :self.frame_nbytes].view(self.dtype).reshape(self.frame_shape) for i in range(self.slots)]
+
+    def __getstate__(self):
+        return {
+            'name': self._shm.name,
+            'frame_shape': self.frame_shape,
+            'slots': self.slots,
+            'dtype': self.dtype.str,
+            'policy': self.policy,
+            'ready': self._ready,
+        }
+
+    def __setstate__(self, state):
+        self.frame_shape = state['frame_shape']
+        self.slots = state['slots']
+        self.dtype = np.dtype(state['dtype'])
+        self.policy = state['policy']
+        self.frame_nbytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self._ready = state['ready']
+        self._shm = attach_shared_memory(state['name'])
+        self._owner = False
+        self._map_views()
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    # --------------------------------------------------------------------------
+    # 生产者接口
+    # --------------------------------------------------------------------------
+    def _claim_slot(self, block: bool, timeout: Optional[float]) -> Optional[int]:
+        """为下一帧找一个可写的槽位，返回其序号；环满且不允许覆盖时返回 None 并计入丢帧。"""
+        seq = int(self._header[_HDR_WRITE_SEQ])
+        occupancy = seq - int(self._header[_HDR_READ_SEQ])
+        if occupancy >= self.slots:
+            if self.policy == 'overwrite':
+                self._header[_HDR_OVERWRITTEN] += 1
+            elif self.policy == 'block' or block:
+                deadline = None if timeout is None else time.perf_counter() + timeout
+                while seq - int(self._header[_HDR_READ_SEQ]) >= self.slots:
+                    if deadline is not None and time.perf_counter() >= deadline:
+                        self._header[_HDR_DROPPED] += 1
+                        return None
+                    time.sleep(0.0005)
+            else:
+                self._header[_HDR_DROPPED] += 1
+                return None
+        # 先把槽位序号置为 -1，消费者看到 -1 或不匹配的序号就知道这个槽位正在被改写
+        self._slot_seq[seq % self.slots] = -1
+        return seq
+
+    def _commit(self, seq: int, capture_time_ns: int):
+        slot = seq % self.slots
+        self._slot_ts[slot] = capture_time_ns
+        self._slot_put_ns[slot] = time.perf_counter_ns()
+        self._slot_seq[slot] = seq
+        self._header[_HDR_WRITE_SEQ] = seq + 1
+        occupancy = seq + 1 - int(self._header[_HDR_READ_SEQ])
+        if occupancy > self._header[_HDR_PEAK]:
+            self._header[_HDR_PEAK] = min(occupancy, self.slots)
+        self._ready.release()
+
+    def put(self, frame: np.ndarray, capture_time_ns: int, block: bool = False, timeout: Optional[float] = None) -> bool:
+        """把一帧拷贝进下一个空闲槽位。返回 False 表示该帧被丢弃。"""
+        seq = self._claim_slot(block, timeout)
+        if seq is None:
+            return False
+        np.copyto(self._frames[seq % self.slots], frame, casting='unsafe')
+        self._commit(seq, capture_time_ns)
+        return True
+
+    def reserve(self, block: bool = False, timeout: Optional[float] = None) -> Optional[Tuple[np.ndarray, int]]:
+        """
+        预留一个槽位供调用方原地写入，返回 (槽位视图, 序号)；写完后调用 commit(序号, 时间戳)。
+        适用于可以直接把像素生成到目标内存中的帧源，省掉一次拷贝。
+        """
+        seq = self._claim_slot(block, timeout)
+        if seq is None:
+            return None
+        return self._frames[seq % self.slots], seq
+
+    def commit(self, seq: int, capture_time_ns: int):
+        self._commit(seq, capture_time_ns)
+
+    def close_writer(self):
+        """生产者结束写入，替代原先放入队列的 None 结束信号。"""
+        self._header[_HDR_CLOSED] = 1
+        self._ready.release()
+
+    # --------------------------------------------------------------------------
+    # 消费者接口
+    # --------------------------------------------------------------------------
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[np.ndarray, int, int]]:
+        """
+        取出最旧的未读帧，返回 (帧视图, capture_time_ns, 序号)。
+        视图直接指向共享内存，用完后必须调用 release(序号) 归还槽位。
+        生产者已结束且所有帧都已读完时返回 None；超时抛出 queue.Empty。
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            read_seq = int(self._header[_HDR_READ_SEQ])
+            write_seq = int(self._header[_HDR_WRITE_SEQ])
+            if write_seq > read_seq:
+                if write_seq - read_seq > self.slots:
+                    # 被生产者套圈 (overwrite 策略)，跳到仍然有效的最旧一帧
+                    read_seq = write_seq - self.slots
+                    self._header[_HDR_READ_SEQ] = read_seq
+                slot = read_seq % self.slots
+                if int(self._slot_seq[slot]) != read_seq:
+                    # 槽位正在被覆盖写入，跳过这一帧
+                    self._header[_HDR_READ_SEQ] = read_seq + 1
+                    continue
+                return self._frames[slot], int(self._slot_ts[slot]), read_seq
+
+            if self._header[_HDR_CLOSED]:
+                return None
+
+            remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            if not self._ready.acquire(timeout=remaining) and deadline is not None and time.perf_counter() >= deadline:
+                raise queue.Empty
+
+    def enqueue_time_ns(self, seq: int) -> int:
+        """get() 取出的帧被提交进帧环的时间 (perf_counter_ns)，用于统计排队延迟；须在 release 之前调用。"""
+        return int(self._slot_put_ns[seq % self.slots])
+
+    def release(self, seq: int) -> bool:
+        """
+        归还 get() 取出的槽位。返回 False 表示读取期间槽位已被生产者覆盖，
+        此时调用方已经拿到的数据可能不完整，应当丢弃。
+        """
+        intact = int(self._slot_seq[seq % self.slots]) == seq
+        if int(self._header[_HDR_READ_SEQ]) <= seq:
+            self._header[_HDR_READ_SEQ] = seq + 1
+        return intact
+
+    # --------------------------------------------------------------------------
+    # 统计 / 清理
+    # --------------------------------------------------------------------------
+    def occupancy(self) -> int:
+        return min(self.slots, int(self._header[_HDR_WRITE_SEQ]) - int(self._header[_HDR_READ_SEQ]))
+
+    def stats(self) -> dict:
+        return {
+            'slots': self.slots,
+            'occupancy': self.occupancy(),
+            'peak_occupancy': int(self._header[_HDR_PEAK]),
+            'written': int(self._header[_HDR_WRITE_SEQ]),
+            'consumed': int(self._header[_HDR_READ_SEQ]),
+            'dropped': int(self._header[_HDR_DROPPED]),
+            'overwritten': int(self._header[_HDR_OVERWRITTEN]),
+        }
+
+    def close(self):
+        """释放本进程对共享内存的映射。"""
+        self._header = self._slot_ts = self._slot_seq = self._slot_put_ns = None
+        self._frames = []
+        self._shm.close()
+
+    def unlink(self):
+        """由创建方在所有进程结束后调用，销毁共享内存。"""
+        if self._owner:
+            self._shm.unlink()
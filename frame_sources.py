@@ -0,0 +1,261 @@
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+# 可用的帧源类型，capture_process 通过名称 + 参数字典在子进程内创建帧源，
+# 避免在主进程中创建 dxcam 等无法跨进程传递的对象。
+FRAME_SOURCE_KINDS = ('dxcam', 'synthetic', 'replay')
+MOTION_PATTERNS = ('static', 'scroll', 'box', 'noise')
+DXCAM_MODES = ('thread', 'grab')
+
+
+def region_size(region: tuple) -> Tuple[int, int]:
+    """把 (left, top, right, bottom) 区域转换为 (宽, 高)。"""
+    left, top, right, bottom = region
+    return right - left, bottom - top
+
+
+class FrameSource:
+    """
+    帧源接口。read() 返回一帧 HxWx3 的 BGR uint8 数组，暂时没有新帧时返回 None；
+    帧源自然结束 (例如回放到文件末尾) 后 finished 变为 True。
+    """
+
+    width = 0
+    height = 0
+    finished = False
+
+    def start(self):
+        pass
+
+    def read(self) -> Optional[np.ndarray]:
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+
+class DxcamFrameSource(FrameSource):
+    """
+    基于 dxcam 的桌面捕获，仅在 Windows 上可用。
+    mode='thread': dxcam 自己的捕获线程按 target_fps 抓帧，read() 取最新一帧；
+    mode='grab': 不启动捕获线程，每次 read() 同步抓取一次，节拍完全由调用方 (捕获调度器) 控制。
+    """
+
+    def __init__(self, region: tuple, target_fps: int = 120, video_mode: bool = True, mode: str = 'thread'):
+        import dxcam
+
+        if mode not in DXCAM_MODES:
+            raise ValueError(f"未知的 dxcam 模式: {mode}")
+        self.region = region
+        self.target_fps = target_fps
+        self.video_mode = video_mode
+        self.mode = mode
+        self.width, self.height = region_size(region)
+        self._last = None
+        self._camera = dxcam.create(output_color="BGR")
+        if self._camera is None:
+            raise RuntimeError("DXCam 创建失败")
+
+    def start(self):
+        if self.mode == 'thread':
+            self._camera.start(region=self.region, video_mode=self.video_mode, target_fps=self.target_fps)
+
+    def read(self) -> Optional[np.ndarray]:
+        if self.mode == 'thread':
+            return self._camera.get_latest_frame()
+        frame = self._camera.grab(region=self.region)
+        if frame is not None:
+            self._last = frame
+        elif self.video_mode:
+            # 画面没有变化时 grab() 返回 None；与线程模式的 video_mode 一样重复上一帧，保持固定帧率
+            frame = self._last
+        return frame
+
+    def stop(self):
+        if self.mode == 'thread':
+            self._camera.stop()
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    合成帧源，用于在没有桌面的环境 (例如 Linux 服务器) 中测量采集→队列→编码的吞吐。
+    fps > 0 时按目标帧率节拍输出，fps <= 0 时尽可能快地输出。
+    """
+
+    def __init__(self, width: int, height: int, fps: float = 120, pattern: str = 'box',
+                 max_frames: Optional[int] = None, seed: int = 0):
+        if pattern not in MOTION_PATTERNS:
+            raise ValueError(f"未知的运动模式: {pattern}")
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.pattern = pattern
+        self.max_frames = max_frames
+        self._rng = np.random.default_rng(seed)
+        self._index = 0
+        self._next_deadline = None
+
+        # 背景是一张水平 + 垂直渐变，近似普通桌面内容的可压缩性
+        ys = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        xs = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+        self._background = np.empty((height, width, 3), dtype=np.uint8)
+        self._background[..., 0] = xs.astype(np.uint8)
+        self._background[..., 1] = ys.astype(np.uint8)
+        self._background[..., 2] = ((xs + ys) / 2).astype(np.uint8)
+        self._frame = self._background.copy()
+        if pattern == 'noise':
+            # 预先生成少量噪声帧循环使用，避免随机数生成本身成为瓶颈
+            self._noise = [self._rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+
+    def start(self):
+        self._next_deadline = time.perf_counter()
+
+    def _render(self, index: int) -> np.ndarray:
+        if self.pattern == 'static':
+            return self._frame
+        if self.pattern == 'noise':
+            return self._noise[index % len(self._noise)]
+        if self.pattern == 'scroll':
+            shift = (index * 4) % self.height
+            self._frame[:self.height - shift] = self._background[shift:]
+            self._frame[self.height - shift:] = self._background[:shift]
+            return self._frame
+        # 'box': 静态背景上移动的方块，模拟光标/窗口拖动
+        size = max(8, min(self.width, self.height) // 8)
+        span_x = max(1, self.width - size)
+        span_y = max(1, self.height - size)
+        x = (index * 7) % span_x
+        y = (index * 5) % span_y
+        prev_x = ((index - 1) * 7) % span_x
+        prev_y = ((index - 1) * 5) % span_y
+        self._frame[prev_y:prev_y + size, prev_x:prev_x + size] = self._background[prev_y:prev_y + size, prev_x:prev_x + size]
+        self._frame[y:y + size, x:x + size] = (255 - (index % 256), index % 256, 128)
+        return self._frame
+
+    def read(self) -> Optional[np.ndarray]:
+        if self.max_frames is not None and self._index >= self.max_frames:
+            self.finished = True
+            return None
+        if self.fps > 0:
+            if self._next_deadline is None:
+                self._next_deadline = time.perf_counter()
+            delay = self._next_deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_deadline += 1.0 / self.fps
+        frame = self._render(self._index)
+        self._index += 1
+        return frame
+
+
+class ReplayFrameSource(FrameSource):
+    """
+    回放已有录像 (例如 final_output.mp4) 作为帧源。
+    默认按文件中记录的纳秒 pts 间隔回放；realtime=False 时尽可能快地输出。
+    指定 width/height 时把帧缩放到该尺寸。
+    """
+
+    def __init__(self, path: str, width: Optional[int] = None, height: Optional[int] = None,
+                 realtime: bool = True, loop: bool = False, max_frames: Optional[int] = None):
+        import av
+
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.max_frames = max_frames
+        self._av = av
+        self._container = None
+        self._frames = None
+        self._index = 0
+        self._clock_origin = None
+        self._pts_origin = None
+
+        with av.open(path, 'r') as container:
+            stream = container.streams.video[0]
+            self.width = width or stream.codec_context.width
+            self.height = height or stream.codec_context.height
+
+    def _open(self):
+        self._container = self._av.open(self.path, 'r')
+        stream = self._container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        self._time_base = stream.time_base
+        self._frames = self._container.decode(stream)
+        self._clock_origin = None
+
+    def start(self):
+        self._open()
+
+    def read(self) -> Optional[np.ndarray]:
+        if self.max_frames is not None and self._index >= self.max_frames:
+            self.finished = True
+            return None
+        try:
+            frame = next(self._frames)
+        except StopIteration:
+            self._container.close()
+            if not self.loop:
+                self.finished = True
+                return None
+            self._open()
+            return None
+
+        if self.realtime and frame.pts is not None:
+            pts_sec = float(frame.pts * self._time_base)
+            now = time.perf_counter()
+            if self._clock_origin is None:
+                self._clock_origin, self._pts_origin = now, pts_sec
+            delay = self._clock_origin + (pts_sec - self._pts_origin) - now
+            if delay > 0:
+                time.sleep(delay)
+
+        self._index += 1
+        if frame.width != self.width or frame.height != self.height:
+            frame = frame.reformat(width=self.width, height=self.height)
+        return frame.to_ndarray(format='bgr24')
+
+    def stop(self):
+        if self._container is not None:
+            self._container.close()
+            self._container = None
+
+
+def create_frame_source(kind: str, region: tuple, **options) -> FrameSource:
+    """
+    按名称创建帧源。region 为录制区域 (left, top, right, bottom)，
+    合成帧源在未指定 width/height 时使用 region 的尺寸。
+    """
+    if kind == 'dxcam':
+        return DxcamFrameSource(region, **options)
+    if kind == 'synthetic':
+        width, height = region_size(region)
+        options.setdefault('width', width)
+        options.setdefault('height', height)
+        return SyntheticFrameSource(**options)
+    if kind == 'replay':
+        return ReplayFrameSource(**options)
+    raise ValueError(f"未知的帧源类型: {kind}")
+
+
+def probe_frame_size(kind: str, region: tuple, **options) -> Tuple[int, int]:
+    """
+    预先获取帧源输出的 (宽, 高)，供主进程分配帧环和配置编码器。
+    dxcam 会临时抓取一帧以确认屏幕可用。
+    """
+    if kind == 'dxcam':
+        import dxcam
+
+        temp_cam = dxcam.create(region=region)
+        if temp_cam is None:
+            raise RuntimeError("DXCam 创建失败")
+        frame_sample = temp_cam.grab()
+        temp_cam.release()
+        if frame_sample is None:
+            raise RuntimeError("无法捕获样本帧。")
+        h, w, _ = frame_sample.shape
+        return w, h
+
+    source = create_frame_source(kind, region, **options)
+    return source.width, source.height
@@ -0,0 +1,358 @@
+import argparse
+import mmap
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import struct
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from encoder_stream import add_encoder_stream
+from frame_transform import pix_fmt_of_shape
+from session_layout import FRAME_INDEX_FILENAME, SPOOL_FILENAME, SYNC_TIME_FILENAME, VIDEO_FILENAME
+
+# 原始帧暂存文件 (先录后编): 录制时只把帧原样追加进预分配的内存映射文件，录制结束后再离线并行转码为 final_output.mp4。
+#
+# 文件布局: [4 KiB 文件头][记录 0][记录 1]...，每条记录按 4 KiB 对齐:
+#   记录头 (64 字节): capture_time_ns (int64)、帧序号 (int64)，其余保留
+#   帧数据: 与帧环槽位相同的原始像素 (bgr24 为 HxWx3，yuv420p 为 I420 平面)
+SPOOL_MAGIC = b'RAWSPOOL'
+SPOOL_VERSION = 1
+_FILE_HEADER = struct.Struct('<8sIIIIQQII3I16s')  # magic, version, 文件头大小, 记录头大小, 对齐, 单帧字节数, 帧数, ...
+FILE_HEADER_SIZE = 4096
+RECORD_HEADER_SIZE = 64
+RECORD_ALIGN = 4096
+
+# --- 默认参数 ---
+PREALLOC_BYTES = 4 << 30        # 预分配的暂存文件大小，写满后按同样大小继续扩展
+PROFILE_FPS_SAMPLES = 1000      # 估计录制帧率 (查找编码配置档) 时使用的前若干帧的时间戳
+FLUSH_INTERVAL = 0.5            # 每隔多少秒把新写入的记录同步到磁盘 (同时测量磁盘写入带宽)
+BANDWIDTH_WARN_INTERVAL = 5.0   # 磁盘跟不上的警告最多每隔多少秒打印一次
+TRANSCODE_SEGMENT_FRAMES = 240  # 离线转码时每个工作进程一次编码的帧数 (每段从关键帧开始)
+
+
+def _align(n: int, alignment: int = RECORD_ALIGN) -> int:
+    return (n + alignment - 1) // alignment * alignment
+
+
+def _pack_header(frame_shape: Tuple[int, ...], pix_fmt: str, frame_count: int) -> bytes:
+    shape = tuple(frame_shape) + (0,) * (3 - len(frame_shape))
+    frame_nbytes = int(np.prod(frame_shape))
+    return _FILE_HEADER.pack(SPOOL_MAGIC, SPOOL_VERSION, FILE_HEADER_SIZE, RECORD_HEADER_SIZE, RECORD_ALIGN,
+                             frame_nbytes, frame_count, 0, len(frame_shape), *shape, pix_fmt.encode('ascii'))
+
+
+class SpoolWriter:
+    """
+    把帧追加进预分配的内存映射暂存文件。帧数据只经过一次 memcpy (帧环槽位 -> 映射页)，由操作系统异步写回；
+    sync() 把上次同步之后写入的记录刷到磁盘并返回耗时，调用方据此判断磁盘是否跟得上。
+    文件头中的帧数在每次 sync() 时更新，进程意外退出时已同步的帧仍然可以转码。
+    """
+
+    def __init__(self, path: str, frame_shape: Tuple[int, ...], prealloc_bytes: int = PREALLOC_BYTES):
+        self.path = path
+        self.frame_shape = tuple(int(d) for d in frame_shape)
+        self.pix_fmt = pix_fmt_of_shape(self.frame_shape)
+        self.frame_nbytes = int(np.prod(self.frame_shape))
+        self.stride = _align(RECORD_HEADER_SIZE + self.frame_nbytes)
+        self.grow_frames = max(1, prealloc_bytes // self.stride)
+        self.frames = 0
+        self.synced_frames = 0
+        self.bytes_synced = 0
+        self.sync_seconds = 0.0
+
+        self._file = open(path, 'w+b')
+        self._capacity = 0
+        self._mm = None
+        self._grow()
+
+    def _file_size(self, capacity: int) -> int:
+        return FILE_HEADER_SIZE + capacity * self.stride
+
+    def _grow(self):
+        if self._mm is not None:
+            self.sync()
+            self._mm.close()
+        self._capacity += self.grow_frames
+        # 只扩展文件长度 (不写零)，NTFS/ext4 上都很快；映射页第一次被写入时才真正分配
+        self._file.truncate(self._file_size(self._capacity))
+        self._mm = mmap.mmap(self._file.fileno(), self._file_size(self._capacity))
+        self._mm[:_FILE_HEADER.size] = _pack_header(self.frame_shape, self.pix_fmt, self.synced_frames)
+
+    def append(self, frame: np.ndarray, capture_time_ns: int):
+        if self.frames == self._capacity:
+            self._grow()
+        offset = FILE_HEADER_SIZE + self.frames * self.stride
+        struct.pack_into('<qq', self._mm, offset, capture_time_ns, self.frames)
+        target = np.ndarray(self.frame_shape, dtype=np.uint8, buffer=self._mm, offset=offset + RECORD_HEADER_SIZE)
+        target[...] = frame
+        del target  # 映射仍被引用时无法扩展或关闭
+        self.frames += 1
+
+    def sync(self) -> float:
+        """把尚未同步的记录刷到磁盘并更新文件头中的帧数，返回耗时 (秒)。"""
+        if self.frames == self.synced_frames:
+            return 0.0
+        start = FILE_HEADER_SIZE + self.synced_frames * self.stride
+        end = FILE_HEADER_SIZE + self.frames * self.stride
+        # flush 的起始偏移必须按分配粒度对齐 (Windows 为 64 KiB)
+        aligned = start // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+        t0 = time.perf_counter()
+        self._mm.flush(aligned, end - aligned)
+        self._mm[:_FILE_HEADER.size] = _pack_header(self.frame_shape, self.pix_fmt, self.frames)
+        self._mm.flush(0, FILE_HEADER_SIZE)
+        elapsed = time.perf_counter() - t0
+        self.bytes_synced += end - start
+        self.sync_seconds += elapsed
+        self.synced_frames = self.frames
+        return elapsed
+
+    def close(self):
+        """同步剩余记录，截掉预分配但未使用的部分。"""
+        self.sync()
+        self._mm.close()
+        self._file.truncate(self._file_size(self.frames))
+        self._file.close()
+
+
+class SpoolReader:
+    """只读打开暂存文件；timestamps 是所有记录头中 capture_time_ns 的跨步视图，不拷贝。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, header_size, record_header_size, record_align, frame_nbytes, frame_count, _, ndim,
+         *shape, pix_fmt) = _FILE_HEADER.unpack_from(self._mm, 0)
+        if magic != SPOOL_MAGIC:
+            raise ValueError(f"{path} 不是原始帧暂存文件")
+        if version != SPOOL_VERSION:
+            raise ValueError(f"不支持的暂存文件版本: {version}")
+        self.frame_shape = tuple(shape[:ndim])
+        self.pix_fmt = pix_fmt.rstrip(b'\0').decode('ascii')
+        self.frame_nbytes = frame_nbytes
+        self.stride = _align(record_header_size + frame_nbytes, record_align)
+        self._header_size = header_size
+        self._record_header_size = record_header_size
+        # 文件被截断 (例如磁盘写满) 时只使用完整的记录
+        self.frames = min(frame_count, (len(self._mm) - header_size) // self.stride)
+        self.timestamps = np.ndarray((self.frames,), dtype='<i8', buffer=self._mm, offset=header_size,
+                                     strides=(self.stride,))
+
+    @property
+    def width(self) -> int:
+        return self.frame_shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.frame_shape[0] if self.pix_fmt == 'bgr24' else self.frame_shape[0] * 2 // 3
+
+    def __len__(self):
+        return self.frames
+
+    def frame(self, index: int) -> np.ndarray:
+        offset = self._header_size + index * self.stride + self._record_header_size
+        return np.ndarray(self.frame_shape, dtype=np.uint8, buffer=self._mm, offset=offset)
+
+    def close(self):
+        self.timestamps = None
+        self._mm.close()
+        self._file.close()
+
+
+# ==============================================================================
+# 录制时的暂存进程: 代替编码进程，从帧环取帧追加到暂存文件，不做任何编码
+# ==============================================================================
+def spool_process(frame_ring, spool_path: str, sync_time_path: str, prealloc_bytes: int = PREALLOC_BYTES,
+                  telemetry=None):
+    """
+    与 encode_process 的输入约定相同: 从帧环取帧，第一帧的 capture_time_ns 写入 sync_time_path。
+    每 FLUSH_INTERVAL 秒同步一次磁盘并计算写入带宽；同步耗时超过这段时间本身 (磁盘写入慢于帧的到达速度) 时打印警告，
+    此时积压会先体现为帧环占用上升，最终按帧环策略丢帧。
+    """
+    from recorder.startup_profile import mark_ready
+
+    writer = SpoolWriter(spool_path, frame_ring.frame_shape, prealloc_bytes)
+    print(f"[暂存进程] 暂存文件 {spool_path} 已预分配 {writer.grow_frames * writer.stride / 2**30:.1f} GB，"
+          f"每帧 {writer.stride / 2**20:.2f} MB")
+    mark_ready()
+
+    start_ns = None
+    window_start = time.perf_counter()
+    window_frames = 0
+    last_warning = 0.0
+    try:
+        while True:
+            try:
+                item = frame_ring.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                print("\n[暂存进程] 收到结束信号。")
+                break
+            if item:
+                frame_data, capture_time_ns, seq = item
+                if start_ns is None:
+                    start_ns = capture_time_ns
+                    with open(sync_time_path, 'w') as f:
+                        f.write(str(start_ns))
+                    print(f"[暂存进程] 收到第一帧，已将同步时间点写入 {sync_time_path}")
+                writer.append(frame_data, capture_time_ns)
+                frame_ring.release(seq)
+                window_frames += 1
+                if telemetry is not None:
+                    telemetry.add('spooled_frames')
+
+            now = time.perf_counter()
+            window = now - window_start
+            if window < FLUSH_INTERVAL:
+                continue
+            sync_sec = writer.sync()
+            if window_frames:
+                incoming = window_frames * writer.stride / window / 2**20
+                disk = window_frames * writer.stride / max(sync_sec, 1e-9) / 2**20
+                if sync_sec > window and now - last_warning >= BANDWIDTH_WARN_INTERVAL:
+                    print(f"\n[暂存进程] 警告: 磁盘写入跟不上，帧数据 {incoming:.0f} MB/s，磁盘仅 {disk:.0f} MB/s "
+                          f"(帧环占用 {frame_ring.occupancy()}/{frame_ring.slots})")
+                    last_warning = now
+            window_start, window_frames = time.perf_counter(), 0
+    except Exception as e:
+        print(f"\n[暂存进程] 写入出错: {e}")
+    finally:
+        writer.close()
+        frame_ring.close()
+
+    if writer.frames and writer.sync_seconds > 0:
+        print(f"[暂存进程] --- 共暂存 {writer.frames} 帧 ({writer.bytes_synced / 2**30:.2f} GB)，"
+              f"磁盘同步带宽 {writer.bytes_synced / writer.sync_seconds / 2**20:.0f} MB/s ---")
+    print(f"[暂存进程] 转码: python frame_spool.py {os.path.dirname(sync_time_path) or '.'} --spool {spool_path}")
+
+
+# ==============================================================================
+# 离线转码: 暂存文件按帧数切成若干段，由多个工作进程并行编码，再无损拼接为 final_output.mp4
+# ==============================================================================
+def _transcode_segment(task) -> int:
+    """工作进程: 编码暂存文件中 [first, last) 这些帧，pts 从该段第一帧开始计 (纳秒)，拼接时再加回偏移。"""
+    spool_path, first, last, output_path, encoder_options = task
+    import av
+
+    reader = SpoolReader(spool_path)
+    try:
+        with av.open(output_path, mode='w') as container:
+            stream = add_encoder_stream(container, reader.width, reader.height, encoder_options)
+            segment_start_ns = int(reader.timestamps[first])
+            for i in range(first, last):
+                frame = av.VideoFrame.from_ndarray(reader.frame(i), format=reader.pix_fmt)
+                frame.pts = int(reader.timestamps[i]) - segment_start_ns
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+            for packet in stream.encode():
+                container.mux(packet)
+    finally:
+        reader.close()
+    return last - first
+
+
+def spool_encoder_options(reader: SpoolReader, encoder_profile: Optional[str] = 'auto') -> dict:
+    """
+    转码用的编码参数: 录制配置的默认值；encoder_profile 给出时 ('auto' 为本机默认路径)，按暂存帧的尺寸、像素格式
+    和由时间戳估计的帧率在本机编码配置档 (encoder_tuning.py) 中查找，与直接编码的录制使用同一条目。
+    """
+    from encoder_tuning import apply_encoder_profile
+    from recorder.config import RecorderConfig
+
+    config = RecorderConfig(encoder_profile=encoder_profile, capture_pix_fmt=reader.pix_fmt)
+    if len(reader) > 1:
+        interval_ns = float(np.median(np.diff(reader.timestamps[:PROFILE_FPS_SAMPLES])))
+        if interval_ns > 0:
+            config = config._replace(capture_fps=round(1e9 / interval_ns))
+    return apply_encoder_profile(config, reader.width, reader.height).encoder_options
+
+
+def transcode_spool(spool_path: str, session_dir: str, workers: Optional[int] = None,
+                    segment_frames: int = TRANSCODE_SEGMENT_FRAMES, encoder_options: dict = None,
+                    keep_spool: bool = False, encoder_profile: Optional[str] = 'auto') -> int:
+    """
+    把暂存文件转码为 session_dir 下的 final_output.mp4、video_start_time.txt 和 frame_index.npy，
+    结果与录制时直接编码相同 (pts = capture_time_ns - 第一帧时间，纳秒)。
+    未给出 encoder_options 时使用 spool_encoder_options (本机编码配置档或录制配置的默认值)。
+    输出的数据包数与暂存的帧数一致时才删除暂存文件 (keep_spool=False)。返回转码的帧数。
+    """
+    from encoder_tuning import format_options
+    from segmented_encoder import concat_segments, segment_path
+
+    reader = SpoolReader(spool_path)
+    frame_count = len(reader)
+    firsts = list(range(0, frame_count, segment_frames))
+    timestamps = reader.timestamps[firsts].tolist()
+    if frame_count and not encoder_options:
+        encoder_options = spool_encoder_options(reader, encoder_profile)
+    reader.close()
+    if not frame_count:
+        print(f"[转码] {spool_path} 中没有帧。")
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    video_path = os.path.join(session_dir, VIDEO_FILENAME)
+    segment_dir = os.path.join(session_dir, "spool_segments")
+    shutil.rmtree(segment_dir, ignore_errors=True)
+    os.makedirs(segment_dir)
+    start_time_ns = timestamps[0]
+    tasks = [(spool_path, first, min(first + segment_frames, frame_count), segment_path(segment_dir, i), encoder_options)
+             for i, first in enumerate(firsts)]
+    print(f"[转码] {frame_count} 帧，{len(tasks)} 段，{workers} 个工作进程，编码参数 {format_options(encoder_options)}...")
+
+    t0 = time.perf_counter()
+    with mp.Pool(min(workers, len(tasks))) as pool:
+        encoded = sum(pool.imap_unordered(_transcode_segment, tasks))
+    encode_sec = time.perf_counter() - t0
+    packet_count = concat_segments([task[3] for task in tasks], video_path,
+                                    os.path.join(session_dir, FRAME_INDEX_FILENAME),
+                                    [ts - start_time_ns for ts in timestamps])
+    with open(os.path.join(session_dir, SYNC_TIME_FILENAME), 'w') as f:
+        f.write(str(start_time_ns))
+    shutil.rmtree(segment_dir, ignore_errors=True)
+    print(f"[转码] --- {encoded} 帧 -> {video_path}，编码 {encode_sec:.1f} 秒 "
+          f"({encoded / max(encode_sec, 1e-9):.0f} fps)，共 {time.perf_counter() - t0:.1f} 秒 ---")
+
+    if packet_count != frame_count:
+        print(f"[转码] 警告: 输出 {packet_count} 个数据包，暂存了 {frame_count} 帧，暂存文件保留在 {spool_path}")
+    elif not keep_spool:
+        os.remove(spool_path)
+        print(f"[转码] 已删除暂存文件 {spool_path}")
+    return encoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把先录后编模式的原始帧暂存文件转码为 final_output.mp4")
+    parser.add_argument('session_dir', help="录制输出目录 (写入 final_output.mp4 等)")
+    parser.add_argument('--spool', help=f"暂存文件路径，默认 <session_dir>/{SPOOL_FILENAME}")
+    parser.add_argument('--workers', type=int, default=None, help="编码工作进程数，默认为 CPU 核数")
+    parser.add_argument('--segment-frames', type=int, default=TRANSCODE_SEGMENT_FRAMES)
+    parser.add_argument('--preset', default=None, help="libx264 preset，默认与录制时相同 (本机配置档或 ultrafast)")
+    parser.add_argument('--crf', default=None)
+    parser.add_argument('--no-encoder-profile', dest='encoder_profile', action='store_const', const='', default='auto',
+                        help="不加载本机编码配置档，使用录制配置的默认编码参数")
+    parser.add_argument('--keep-spool', action='store_true', help="转码成功后保留暂存文件")
+    args = parser.parse_args()
+
+    spool_path = args.spool or os.path.join(args.session_dir, SPOOL_FILENAME)
+    encoder_options = None
+    if args.preset or args.crf:
+        reader = SpoolReader(spool_path)
+        encoder_options = dict(spool_encoder_options(reader, args.encoder_profile))
+        reader.close()
+        if args.preset:
+            encoder_options['preset'] = args.preset
+        if args.crf:
+            encoder_options['crf'] = args.crf
+    transcode_spool(spool_path, args.session_dir, args.workers, args.segment_frames, encoder_options, args.keep_spool,
+                    args.encoder_profile)
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    main()
@@ -0,0 +1,147 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+# 捕获进程可以直接输出的像素格式。yuv420p 以 I420 平面格式 (Y 平面后接 U、V 平面，形状 (h*3/2, w)) 放进帧环，
+# 与 av.VideoFrame.from_ndarray(format='yuv420p') 的输入约定相同，编码器不再需要 swscale 转换
+CAPTURE_PIX_FMTS = ('bgr24', 'yuv420p')
+TRANSFORM_METHODS = ('swscale', 'numpy')
+SWSCALE_INTERPOLATION = 'FAST_BILINEAR'  # 1080p -> 720p 约 3.5 ms；需要更好的缩小质量时可改为 'AREA'
+
+
+def output_frame_size(width: int, height: int, output_size: Optional[Tuple[int, int]] = None) -> Tuple[int, int]:
+    """捕获输出的 (宽, 高)。output_size 只给出一个维度 (另一个为 0/None) 时按比例计算并取偶数。"""
+    if not output_size:
+        return width, height
+    out_w, out_h = output_size
+    if not out_w and not out_h:
+        return width, height
+    if not out_w:
+        out_w = round(width * out_h / height / 2) * 2
+    if not out_h:
+        out_h = round(height * out_w / width / 2) * 2
+    return int(out_w), int(out_h)
+
+
+def frame_shape(width: int, height: int, pix_fmt: str = 'bgr24') -> Tuple[int, ...]:
+    """帧环中一帧的数组形状。"""
+    if pix_fmt == 'bgr24':
+        return height, width, 3
+    if pix_fmt == 'yuv420p':
+        if width % 2 or height % 2:
+            raise ValueError(f"yuv420p 要求宽高为偶数: {width}x{height}")
+        return height * 3 // 2, width
+    raise ValueError(f"不支持的捕获像素格式: {pix_fmt}")
+
+
+def _resize(image: np.ndarray, width: int, height: int) -> np.ndarray:
+    """整数倍缩小用块平均，其它比例用最近邻取样 (都是纯向量化操作)。"""
+    in_h, in_w = image.shape[:2]
+    if (in_w, in_h) == (width, height):
+        return image
+    if in_w % width == 0 and in_h % height == 0 and in_w // width == in_h // height:
+        k = in_w // width
+        # k*k 个 uint8 之和在 k <= 16 时放得进 uint16，更大的缩小倍数改用 uint32 累加
+        acc_dtype = np.uint16 if k * k * 255 <= np.iinfo(np.uint16).max else np.uint32
+        acc = np.zeros((height, width) + image.shape[2:], dtype=acc_dtype)
+        for dy in range(k):
+            for dx in range(k):
+                acc += image[dy::k, dx::k]
+        return (acc // (k * k)).astype(np.uint8)
+    rows = np.take(image, np.arange(height) * in_h // height, axis=0)
+    return np.take(rows, np.arange(width) * in_w // width, axis=1)
+
+
+def pix_fmt_of_shape(shape: Tuple[int, ...]) -> str:
+    """由帧环的帧形状反推像素格式，编码进程据此调用 from_ndarray，不必另外传参。"""
+    return 'bgr24' if len(shape) == 3 else 'yuv420p'
+
+
+def _luma(bgr: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """BT.601 有限范围亮度；系数之和不超过 uint16 范围，整幅图用 16 位运算。与 swscale 一样截断取整。"""
+    # 乘法本身要在 uint16 中进行: NumPy 1.x 按值推断标量类型，uint8 数组乘以标量的结果仍是 uint8，会在移位前溢出
+    y = np.multiply(bgr[..., 2], 66, dtype=np.uint16)
+    y += np.multiply(bgr[..., 1], 129, dtype=np.uint16)
+    y += np.multiply(bgr[..., 0], 25, dtype=np.uint16)
+    y >>= 8
+    y += 16
+    out[:] = y
+    return out
+
+
+def bgr_to_i420(bgr: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    BGR -> I420 (BT.601 有限范围)。色度由 2x2 块的平均 RGB 计算，亮度和色度都与 swscale 一样截断取整，
+    与 swscale 对 bgr24 -> yuv420p 的默认转换相比，Y/U/V 各平面的差异都不超过 1 (8 位系数的误差)。
+    """
+    h, w = bgr.shape[:2]
+    if out is None:
+        out = np.empty((h * 3 // 2, w), dtype=np.uint8)
+    _luma(bgr, out[:h])
+
+    def pooled(c):
+        # 色度在 int32 中计算，系数乘积不会溢出；2x2 块只求和，除以 4 并入最后的移位，不提前取整
+        c = bgr[..., c].astype(np.int32)
+        return c[0::2, 0::2] + c[0::2, 1::2] + c[1::2, 0::2] + c[1::2, 1::2]
+
+    b4, g4, r4 = pooled(0), pooled(1), pooled(2)
+    quarter = (h // 2) * (w // 2)
+    chroma = out[h:].reshape(-1)
+    chroma[:quarter] = (((-38 * r4 - 74 * g4 + 112 * b4) >> 10) + 128).reshape(-1)
+    chroma[quarter:] = (((112 * r4 - 94 * g4 - 18 * b4) >> 10) + 128).reshape(-1)
+    return out
+
+
+class FrameTransform:
+    """
+    在捕获进程中把帧源输出的 BGR 帧缩放并转换为目标像素格式，结果直接写进帧环槽位 (SharedFrameRing.reserve)。
+    method='swscale' 使用 PyAV 的 libswscale (一次调用完成缩放和颜色转换)，'numpy' 为纯 NumPy 实现，不依赖 PyAV。
+    """
+
+    def __init__(self, in_width: int, in_height: int, out_width: int, out_height: int,
+                 pix_fmt: str = 'bgr24', method: str = 'swscale'):
+        if method not in TRANSFORM_METHODS:
+            raise ValueError(f"未知的转换方式: {method}")
+        self.in_width, self.in_height = in_width, in_height
+        self.width, self.height = out_width, out_height
+        self.pix_fmt = pix_fmt
+        self.method = method
+        self.shape = frame_shape(out_width, out_height, pix_fmt)
+
+    @property
+    def identity(self) -> bool:
+        """不需要任何转换，捕获进程可以沿用 frame_ring.put 的直接拷贝。"""
+        return (self.in_width, self.in_height) == (self.width, self.height) and self.pix_fmt == 'bgr24'
+
+    def apply(self, bgr: np.ndarray, out: np.ndarray) -> np.ndarray:
+        if self.method == 'swscale':
+            import av
+            frame = av.VideoFrame.from_ndarray(bgr, format='bgr24')
+            frame = frame.reformat(width=self.width, height=self.height, format=self.pix_fmt,
+                                   interpolation=SWSCALE_INTERPOLATION)
+            np.copyto(out, frame.to_ndarray())
+            return out
+
+        resized = _resize(bgr, self.width, self.height)
+        if self.pix_fmt == 'bgr24':
+            np.copyto(out, resized)
+        else:
+            bgr_to_i420(resized, out)
+        return out
+
+
+def put_frame(frame_ring, transform: Optional[FrameTransform], frame: np.ndarray, capture_time_ns: int,
+              block: bool = False, timeout: Optional[float] = None) -> bool:
+    """
+    把一帧放进帧环。需要转换时先预留槽位，缩放/转换的结果直接写进共享内存，省掉中间缓冲和一次拷贝。
+    返回 False 表示帧环已满、该帧被丢弃 (与 SharedFrameRing.put 相同)。
+    """
+    if transform is None or transform.identity:
+        return frame_ring.put(frame, capture_time_ns, block=block, timeout=timeout)
+    reserved = frame_ring.reserve(block=block, timeout=timeout)
+    if reserved is None:
+        return False
+    slot, seq = reserved
+    transform.apply(frame, slot)
+    frame_ring.commit(seq, capture_time_ns)
+    return True
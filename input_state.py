@@ -0,0 +1,242 @@
+import ast
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from binary_event_log import take_rows
+
+# 逐帧输入状态张量: 每个数组的第 0 维与帧序号对齐，分别保存为 <输出目录>/<名称>.npy，可用 np.load(mmap_mode='r') 按需读取。
+#   key_bitmap    (N, 32) uint8  256 位按键位图，第 vk 位 (字节 vk // 8 的第 vk % 8 位) 表示 Windows 虚拟键码 vk 在本帧内处于按下状态
+#   button_mask   (N,)    uint8  鼠标按键位掩码，位定义见 BUTTON_BITS
+#   rel_x, rel_y  (N,)    int32  本帧内 mouse_move 相对位移之和
+#   abs_x, abs_y  (N,)    int32  截至本帧结束时最后一次已知的光标绝对位置，此前没有位置信息时为 -1
+#   wheel         (N,)    int32  本帧内滚轮增量之和
+# 按键/鼠标按键的 "按下" 指本帧内任意时刻按下: 帧开始时已按住、帧结束时仍按住，或在帧内按下 (包括帧内按下又松开的短按)。
+INPUT_STATE_ARRAYS = ('key_bitmap', 'button_mask', 'rel_x', 'rel_y', 'abs_x', 'abs_y', 'wheel')
+KEY_BITMAP_BYTES = 32
+
+BUTTON_BITS = {'left': 1, 'right': 2, 'middle': 4, 'x1': 8, 'x2': 16}
+
+_KEY_EVENTS = {'key_down': 1, 'key_press': 1, 'key_up': 0, 'key_release': 0}
+_NATIVE_BUTTON_EVENTS = {'mouse_down': 1, 'mouse_up': 0}
+_PYNPUT_BUTTON_EVENTS = {'mouse_press': 1, 'mouse_release': 0}
+
+# pynput 的特殊键 (str(key) 形如 'Key.shift') 到 Windows 虚拟键码
+_PYNPUT_SPECIAL_KEYS = {
+    'alt': 0x12, 'alt_l': 0xA4, 'alt_r': 0xA5, 'alt_gr': 0xA5, 'backspace': 0x08, 'caps_lock': 0x14,
+    'cmd': 0x5B, 'cmd_l': 0x5B, 'cmd_r': 0x5C, 'ctrl': 0x11, 'ctrl_l': 0xA2, 'ctrl_r': 0xA3,
+    'delete': 0x2E, 'down': 0x28, 'end': 0x23, 'enter': 0x0D, 'esc': 0x1B, 'home': 0x24, 'left': 0x25,
+    'page_down': 0x22, 'page_up': 0x21, 'right': 0x27, 'shift': 0x10, 'shift_l': 0xA0, 'shift_r': 0xA1,
+    'space': 0x20, 'tab': 0x09, 'up': 0x26, 'insert': 0x2D, 'menu': 0x5D, 'num_lock': 0x90, 'pause': 0x13,
+    'print_screen': 0x2C, 'scroll_lock': 0x91, 'media_play_pause': 0xB3, 'media_volume_mute': 0xAD,
+    'media_volume_down': 0xAE, 'media_volume_up': 0xAF, 'media_previous': 0xB1, 'media_next': 0xB0,
+}
+_PYNPUT_SPECIAL_KEYS.update({f'f{n}': 0x6F + n for n in range(1, 25)})
+
+# 美式键盘布局下字符到虚拟键码 (上档字符与下档字符是同一个键)
+_CHAR_KEYS = {}
+for _chars, _vk in ((';:', 0xBA), ('=+', 0xBB), (',<', 0xBC), ('-_', 0xBD), ('.>', 0xBE), ('/?', 0xBF),
+                    ('`~', 0xC0), ('[{', 0xDB), ('\\|', 0xDC), (']}', 0xDD), ('\'"', 0xDE), (' ', 0x20)):
+    for _char in _chars:
+        _CHAR_KEYS[_char] = _vk
+for _digit, _shifted in zip('1234567890', '!@#$%^&*()'):
+    _CHAR_KEYS[_digit] = _CHAR_KEYS[_shifted] = ord(_digit)
+
+
+def key_code(key: str) -> int:
+    """
+    把事件中记录的按键转换为 Windows 虚拟键码，无法识别时返回 -1。支持:
+      原生模块的十进制虚拟键码 '65'；pynput 的 "'a'"、'Key.shift'、'<65>' (只有虚拟键码的 KeyCode)。
+    """
+    key = str(key)
+    if key.isdigit():
+        return int(key)
+    if key.startswith('Key.'):
+        return _PYNPUT_SPECIAL_KEYS.get(key[4:], -1)
+    if key.startswith('<') and key.endswith('>') and key[1:-1].isdigit():
+        return int(key[1:-1])
+    if len(key) >= 3 and key[0] == key[-1] and key[0] in '\'"':
+        try:
+            char = ast.literal_eval(key)  # str(KeyCode) 是字符的 repr，例如 "'\\x01'"
+        except (ValueError, SyntaxError):
+            return -1
+        if len(char) != 1:
+            return -1
+        if char.isalpha() and char.isascii():
+            return ord(char.upper())
+        if '\x01' <= char <= '\x1a':
+            # 按住 Ctrl 时 pynput 给出的是控制字符，Ctrl+A -> '\x01'
+            return ord(char) + 0x40
+        return _CHAR_KEYS.get(char, -1)
+    return -1
+
+
+def button_bit(button: str) -> int:
+    """'left' (原生模块) 或 'Button.left' (pynput) -> BUTTON_BITS 中的位，无法识别时返回 0。"""
+    button = str(button)
+    if button.startswith('Button.'):
+        button = button[7:]
+    return BUTTON_BITS.get(button, 0)
+
+
+def _to_int(value) -> Optional[int]:
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _held_bitmap(event_frames: np.ndarray, codes: np.ndarray, is_down: np.ndarray, n_frames: int, n_codes: int,
+                 chunk_frames: int = 65536) -> np.ndarray:
+    """
+    根据按时间排列的按下/松开事件计算每帧内按下过的代码集合，返回打包的位图 (n_frames, n_codes // 8)，按小端位序。
+    按帧分块处理，每块只展开一个 (chunk_frames, n_codes) 的稠密数组，峰值内存与帧数无关。
+    """
+    packed = np.zeros((n_frames, n_codes // 8), dtype=np.uint8)
+    if n_frames == 0:
+        return packed
+
+    # 每个 (帧, 代码) 只有最后一个事件决定帧结束时的状态
+    order = np.lexsort((np.arange(len(codes)), event_frames, codes))
+    codes, event_frames, is_down = codes[order], event_frames[order], is_down[order]
+    last_in_frame = np.ones(len(codes), dtype=bool)
+    last_in_frame[:-1] = (codes[1:] != codes[:-1]) | (event_frames[1:] != event_frames[:-1])
+    # 帧结束时的状态相对上一次发生变化的位置: +1 按下，-1 松开 (重复的按下事件由键盘自动重复产生，不改变状态)
+    end_codes, end_frames, end_state = codes[last_in_frame], event_frames[last_in_frame], is_down[last_in_frame].astype(np.int8)
+    previous = np.zeros(len(end_state), dtype=np.int8)
+    same_code = np.zeros(len(end_state), dtype=bool)
+    same_code[1:] = end_codes[1:] == end_codes[:-1]
+    previous[1:][same_code[1:]] = end_state[:-1][same_code[1:]]
+    changed = end_state != previous
+    change_codes, change_frames, change_delta = end_codes[changed], end_frames[changed], (end_state - previous)[changed]
+
+    pressed_codes, pressed_frames = codes[is_down], event_frames[is_down]
+
+    state = np.zeros(n_codes, dtype=np.int8)
+    for chunk_start in range(0, n_frames, chunk_frames):
+        chunk_end = min(chunk_start + chunk_frames, n_frames)
+        delta = np.zeros((chunk_end - chunk_start, n_codes), dtype=np.int8)
+        sel = (change_frames >= chunk_start) & (change_frames < chunk_end)
+        delta[change_frames[sel] - chunk_start, change_codes[sel]] = change_delta[sel]
+        end_of_frame = np.cumsum(delta, axis=0, dtype=np.int8)
+        end_of_frame += state
+
+        end_held = end_of_frame.astype(bool)
+        held = end_held.copy()
+        held[1:] |= end_held[:-1]             # 帧开始时的状态 = 上一帧结束时的状态
+        held[0] |= state.astype(bool)
+        sel = (pressed_frames >= chunk_start) & (pressed_frames < chunk_end)
+        held[pressed_frames[sel] - chunk_start, pressed_codes[sel]] = True  # 帧内按下又松开的短按
+
+        packed[chunk_start:chunk_end] = np.packbits(held, axis=1, bitorder='little')
+        state = end_of_frame[-1]
+    return packed
+
+
+def compute_input_state(n_frames: int, offsets: np.ndarray, event_indices: np.ndarray,
+                        events: Sequence[list]) -> Dict[str, np.ndarray]:
+    """
+    由对齐结果 (videoandevents_decoder.align_events_to_frames 返回的 CSR) 计算逐帧输入状态张量。
+    events 为 read_input_events 读出的事件行，原生模块 (key_down / mouse_down / mouse_move / mouse_wheel ...)
+    和 pynput (key_press / mouse_press ...) 两种记录格式都支持。
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    event_indices = np.asarray(event_indices, dtype=np.int64)
+    frame_of = np.repeat(np.arange(n_frames, dtype=np.int64), np.diff(offsets))
+
+    # 按事件类型把字符串字段解析为定长数组，之后的计算都是向量化的
+    key_frames, key_codes, key_down = [], [], []
+    button_frames, button_codes, button_down = [], [], []
+    move_frames, move_dx, move_dy = [], [], []
+    wheel_frames, wheel_delta = [], []
+    pos_frames, pos_x, pos_y = [], [], []
+    key_cache = {}
+
+    for frame, row in zip(frame_of.tolist(), take_rows(events, event_indices)):
+        event_type = row[1]
+        if event_type in _KEY_EVENTS:
+            key = row[2]
+            code = key_cache.get(key)
+            if code is None:
+                code = key_cache[key] = key_code(key)
+            if 0 <= code < 256:
+                key_frames.append(frame)
+                key_codes.append(code)
+                key_down.append(_KEY_EVENTS[event_type])
+            continue
+
+        x = y = None
+        if event_type == 'mouse_move':
+            dx, dy = _to_int(row[2]), _to_int(row[3])
+            if dx is not None and dy is not None:
+                move_frames.append(frame)
+                move_dx.append(dx)
+                move_dy.append(dy)
+            x, y = _to_int(row[4]), _to_int(row[5])
+        elif event_type in _NATIVE_BUTTON_EVENTS or event_type in _PYNPUT_BUTTON_EVENTS:
+            if event_type in _NATIVE_BUTTON_EVENTS:
+                # [ts, mouse_down, button, abs_x, abs_y]
+                bit, pressed, x, y = button_bit(row[2]), _NATIVE_BUTTON_EVENTS[event_type], _to_int(row[3]), _to_int(row[4])
+            else:
+                # [ts, mouse_press, x, y, Button.left]
+                bit, pressed, x, y = button_bit(row[4]), _PYNPUT_BUTTON_EVENTS[event_type], _to_int(row[2]), _to_int(row[3])
+            if bit:
+                button_frames.append(frame)
+                button_codes.append(bit.bit_length() - 1)
+                button_down.append(pressed)
+        elif event_type == 'mouse_wheel':
+            delta = _to_int(row[2])
+            if delta is not None:
+                wheel_frames.append(frame)
+                wheel_delta.append(delta)
+            x, y = _to_int(row[3]), _to_int(row[4])
+        if x is not None and y is not None:
+            pos_frames.append(frame)
+            pos_x.append(x)
+            pos_y.append(y)
+
+    def as_int64(values):
+        return np.asarray(values, dtype=np.int64)
+
+    state = {
+        'key_bitmap': _held_bitmap(as_int64(key_frames), as_int64(key_codes), np.asarray(key_down, dtype=bool),
+                                   n_frames, KEY_BITMAP_BYTES * 8),
+        'button_mask': _held_bitmap(as_int64(button_frames), as_int64(button_codes), np.asarray(button_down, dtype=bool),
+                                    n_frames, 8).reshape(n_frames),
+    }
+
+    move_frames = as_int64(move_frames)
+    state['rel_x'] = np.bincount(move_frames, weights=move_dx, minlength=n_frames).astype(np.int32)
+    state['rel_y'] = np.bincount(move_frames, weights=move_dy, minlength=n_frames).astype(np.int32)
+
+    # 事件按帧升序排列，每帧最后一个带位置的事件即 "截至该帧结束" 的光标位置，没有位置事件的帧沿用之前的值
+    pos_frames = as_int64(pos_frames)
+    last_pos = np.searchsorted(pos_frames, np.arange(n_frames), side='right') - 1
+    known = last_pos >= 0
+    for name, values in (('abs_x', pos_x), ('abs_y', pos_y)):
+        values = np.append(np.asarray(values, dtype=np.int32), np.int32(-1))
+        state[name] = np.where(known, values[last_pos], -1).astype(np.int32)
+
+    state['wheel'] = np.bincount(as_int64(wheel_frames), weights=wheel_delta, minlength=n_frames).astype(np.int32)
+    return state
+
+
+def write_input_state(output_dir: str, state: Dict[str, np.ndarray]):
+    """每个数组写成一个 .npy 文件。"""
+    os.makedirs(output_dir, exist_ok=True)
+    for name in INPUT_STATE_ARRAYS:
+        np.save(os.path.join(output_dir, f"{name}.npy"), state[name])
+
+
+def load_input_state(output_dir: str, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """读取 write_input_state 写出的数组，默认以只读内存映射方式打开。"""
+    mode = 'r' if mmap else None
+    return {name: np.load(os.path.join(output_dir, f"{name}.npy"), mmap_mode=mode) for name in INPUT_STATE_ARRAYS}
+
+
+def held_keys(key_bitmap_row: np.ndarray) -> List[int]:
+    """把一帧的按键位图还原为按下的虚拟键码列表。"""
+    return np.flatnonzero(np.unpackbits(np.asarray(key_bitmap_row, dtype=np.uint8), bitorder='little')).tolist()
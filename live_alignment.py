@@ -0,0 +1,278 @@
+import argparse
+import bisect
+import collections
+import csv
+import queue
+import threading
+import time
+from typing import List, Optional
+
+from session_layout import session_paths
+
+# 录制时在线对齐: 编码进程送来每个已编码帧的 capture_time_ns，输入监听进程送来写入事件日志的事件行，
+# 主进程中的 LiveAligner 线程边录边把事件分配到帧，并追加写出与 videoandevents_decoder 的 CSV 输出
+# (frame_by_frame_analysis_final.csv) 逐字节相同的分析文件。录制结束时分析文件已经完整，不再需要离线对齐。
+#
+# 与离线的 align_events_to_frames 规则完全一致: 事件按写入日志的顺序处理，所在帧 = 时间戳不晚于它的最后一帧，
+# 早于第一帧或早于之前事件所在帧 (轻微乱序) 的事件丢弃。
+
+# --- 默认参数 ---
+WATERMARK_SLACK_NS = 200_000_000  # 事件日志刷新时，认为此后写入的事件时间戳不会早于 刷新时刻 - 该值
+FEED_BATCH = 512                  # 监听进程累积这么多事件行时即使没有刷新也送出一批
+POLL_INTERVAL = 0.02              # 对齐线程轮询两个队列的间隔（秒）
+FILE_FLUSH_INTERVAL = 1.0         # 分析文件刷新到磁盘的间隔（秒）
+ANALYSIS_HEADER = ['frame_index', 'timestamp_sec', 'frame_duration_ms', 'events_in_frame']
+
+
+def event_log_values(row) -> list:
+    """事件行写入事件日志再由 read_input_events 读回后的形式: 时间戳为整数，其余参数为字符串，None 为空串。"""
+    return [row[0]] + ['' if v is None else str(v) for v in row[1:]]
+
+
+def format_event(values: list) -> str:
+    # 与 write_output_csv 相同: 去掉时间戳，只保留事件内容
+    return f"({', '.join(values[1:])})"
+
+
+class EventFeedWriter:
+    """
+    套在事件写入器外面: 写入的每一行照常写入事件日志，同时在每次 flush() 时把这一批行 (与日志读回的形式相同)
+    连同水位 (刷新时刻 - WATERMARK_SLACK_NS) 送入对齐队列。close() 时送出剩余的行和结束标记 None。
+    """
+
+    def __init__(self, writer, feed, slack_ns: int = WATERMARK_SLACK_NS):
+        self.writer = writer
+        self.feed = feed
+        self.slack_ns = slack_ns
+        self._pending = []
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_row(self, row):
+        self.writer.write_row(row)
+        self._pending.append(event_log_values(row))
+        if len(self._pending) >= FEED_BATCH:
+            self._send(None)
+
+    def write_records(self, records):
+        from native_events import records_to_rows
+
+        self.writer.write_records(records)
+        self._pending.extend(event_log_values(row) for row in records_to_rows(records))
+
+    def flush(self):
+        self.writer.flush()
+        self._send(time.perf_counter_ns() - self.slack_ns)
+
+    def _send(self, watermark_ns: Optional[int]):
+        if self._pending or watermark_ns is not None:
+            self.feed.put((self._pending, watermark_ns))
+            self._pending = []
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.writer.close()
+        self._send(None)
+        self.feed.put(None)
+
+
+class LiveAligner:
+    """
+    主进程中的对齐线程。frame_feed 中是每个已编码帧的 capture_time_ns (按编码顺序，结束时为 None)，
+    event_feed 中是 EventFeedWriter 送来的 (事件行列表, 水位)。
+
+    一个事件只有在出现时间戳晚于它的帧 (或编码已结束) 后才能确定所属帧，在此之前留在待定队列中；
+    第 i 帧在第 i + 1 帧已到达、且之后不可能再有事件落入它时写出: 已处理事件的最大帧号超过 i
+    (之后落在 i 的事件按乱序规则会被丢弃)，或事件水位已越过第 i + 1 帧。
+    如果水位之后仍出现了应落入已写出帧的事件 (late_events > 0)，分析文件不再可信，录制结束后用离线对齐重写。
+    """
+
+    def __init__(self, output_path: str, frame_feed, event_feed):
+        self.output_path = output_path
+        self.frame_feed = frame_feed
+        self.event_feed = event_feed
+        self.frames: List[int] = []
+        self.start_ns = None
+        self.emitted = 0
+        self.events = 0
+        self.assigned = 0
+        self.late_events = 0
+        self.max_pending = 0
+        self._pending = collections.deque()
+        self._frame_events = {}
+        self._max_frame = -1
+        self._watermark_ns = None
+        self._frames_done = False
+        self._events_done = False
+        self._stop = threading.Event()
+        self._file = open(output_path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(ANALYSIS_HEADER)
+        self._thread = threading.Thread(target=self._run, name='live-aligner', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    # --- 对齐 ---
+    def _resolve(self):
+        frames = self.frames
+        while self._pending:
+            values = self._pending[0]
+            timestamp_ns = values[0]
+            if not self._frames_done and (not frames or frames[-1] <= timestamp_ns):
+                break  # 之后可能还有不晚于它的帧
+            self._pending.popleft()
+            frame = bisect.bisect_right(frames, timestamp_ns) - 1
+            if frame < 0 or frame < self._max_frame:
+                continue
+            self._max_frame = frame
+            if frame < self.emitted:
+                self.late_events += 1
+                continue
+            self._frame_events.setdefault(frame, []).append(format_event(values))
+            self.assigned += 1
+
+    def _emit(self):
+        frames = self.frames
+        finished = self._frames_done and self._events_done
+        while self.emitted < len(frames):
+            i = self.emitted
+            if i + 1 < len(frames):
+                complete = (finished or self._max_frame > i
+                            or (self._watermark_ns is not None and self._watermark_ns >= frames[i + 1]))
+                if not complete:
+                    return
+                duration_ms = (frames[i + 1] - frames[i]) / 1e6
+            elif finished:
+                duration_ms = 0
+            else:
+                return
+            events = self._frame_events.pop(i, ())
+            self._writer.writerow([i, f"{(frames[i] - self.start_ns) / 1e9:.6f}", f"{duration_ms:.3f}",
+                                   "\n".join(events)])
+            self.emitted += 1
+
+    # --- 队列 ---
+    def _poll(self) -> bool:
+        got = False
+        while not self._frames_done:
+            try:
+                item = self.frame_feed.get_nowait()
+            except queue.Empty:
+                break
+            got = True
+            if item is None:
+                self._frames_done = True
+            else:
+                if self.start_ns is None:
+                    self.start_ns = item
+                self.frames.append(item)
+        while not self._events_done:
+            try:
+                item = self.event_feed.get_nowait()
+            except queue.Empty:
+                break
+            got = True
+            if item is None:
+                self._events_done = True
+                continue
+            rows, watermark_ns = item
+            self._pending.extend(rows)
+            self.events += len(rows)
+            if watermark_ns is not None:
+                self._watermark_ns = watermark_ns
+        self.max_pending = max(self.max_pending, len(self._pending))
+        return got
+
+    def _run(self):
+        last_flush = time.perf_counter()
+        while True:
+            got = self._poll()
+            if not got and self._stop.is_set():
+                # 编码或监听进程没有送出结束标记 (异常退出)，以已收到的数据为准
+                self._frames_done = self._events_done = True
+            self._resolve()
+            self._emit()
+            if self._frames_done and self._events_done:
+                break
+            if time.perf_counter() - last_flush >= FILE_FLUSH_INTERVAL:
+                self._file.flush()
+                last_flush = time.perf_counter()
+            if not got:
+                time.sleep(POLL_INTERVAL)
+        self._file.close()
+
+    def finish(self):
+        """编码和监听进程都结束后调用: 处理完队列中剩余的数据，写出最后的帧并关闭分析文件。"""
+        self._stop.set()
+        self._thread.join()
+
+    def stats(self) -> dict:
+        return {'frames': self.emitted, 'events': self.events, 'assigned': self.assigned,
+                'late_events': self.late_events, 'max_pending': self.max_pending}
+
+
+def offline_analysis(session_dir: str) -> list:
+    """用离线解码端 (videoandevents_decoder) 对齐会话，返回逐帧结果。"""
+    from videoandevents_decoder import correlate_events_to_frames, read_input_events, read_sync_time, read_video_timestamps
+
+    paths = session_paths(session_dir)
+    return correlate_events_to_frames(read_video_timestamps(paths.video, paths.frame_index),
+                                      read_input_events(paths.events), read_sync_time(paths.sync_time))
+
+
+def realign_offline(session_dir: str, output_path: Optional[str] = None):
+    from videoandevents_decoder import write_output_csv
+
+    write_output_csv(output_path or session_paths(session_dir).analysis_csv, offline_analysis(session_dir))
+
+
+def verify_session(session_dir: str, analysis_path: Optional[str] = None) -> bool:
+    """把录制时写出的分析文件与离线对齐的结果逐字节比较。"""
+    import io
+    import os
+    import tempfile
+
+    analysis_path = analysis_path or session_paths(session_dir).analysis_csv
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        offline_path = os.path.join(tmp_dir, "offline.csv")
+        realign_offline(session_dir, offline_path)
+        with open(offline_path, 'rb') as f:
+            expected = f.read()
+    with open(analysis_path, 'rb') as f:
+        actual = f.read()
+    if actual == expected:
+        print(f"[在线对齐] {analysis_path} 与离线对齐结果一致 ({len(actual)} 字节)。")
+        return True
+    actual_rows = list(csv.reader(io.StringIO(actual.decode('utf-8'))))
+    expected_rows = list(csv.reader(io.StringIO(expected.decode('utf-8'))))
+    for i, (a, b) in enumerate(zip(actual_rows, expected_rows)):
+        if a != b:
+            print(f"[在线对齐] 第 {i} 行不一致:\n  在线: {a}\n  离线: {b}")
+            break
+    else:
+        print(f"[在线对齐] 行数不一致: 在线 {len(actual_rows)} 行，离线 {len(expected_rows)} 行")
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="校验录制时在线写出的逐帧分析文件与离线对齐结果是否一致")
+    parser.add_argument('session_dir', help="会话目录 (含视频、事件日志、同步时间和在线分析文件)")
+    parser.add_argument('--analysis', help="在线分析文件路径，默认为会话目录中的 frame_by_frame_analysis_final.csv")
+    parser.add_argument('--rewrite', action='store_true', help="不一致时用离线对齐结果重写分析文件")
+    args = parser.parse_args()
+
+    if not verify_session(args.session_dir, args.analysis) and args.rewrite:
+        realign_offline(args.session_dir, args.analysis)
+        print("[在线对齐] 已用离线对齐结果重写。")
+
+
+if __name__ == "__main__":
+    main()
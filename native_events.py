@@ -0,0 +1,60 @@
+from typing import List
+
+import numpy as np
+
+# --- 与 cpp_file_v3/event_ring.h 中的编码保持一致 ---
+EVENT_MOUSE_MOVE = 1
+EVENT_MOUSE_DOWN = 2
+EVENT_MOUSE_UP = 3
+EVENT_MOUSE_WHEEL = 4
+EVENT_KEY_DOWN = 5
+EVENT_KEY_UP = 6
+
+EVENT_TYPE_NAMES = {
+    EVENT_MOUSE_MOVE: 'mouse_move',
+    EVENT_MOUSE_DOWN: 'mouse_down',
+    EVENT_MOUSE_UP: 'mouse_up',
+    EVENT_MOUSE_WHEEL: 'mouse_wheel',
+    EVENT_KEY_DOWN: 'key_down',
+    EVENT_KEY_UP: 'key_up',
+}
+EVENT_TYPE_CODES = {name: code for code, name in EVENT_TYPE_NAMES.items()}
+
+BUTTON_NAMES = {0: 'unknown', 1: 'left', 2: 'right', 3: 'middle'}
+BUTTON_CODES = {name: code for code, name in BUTTON_NAMES.items()}
+
+# input_module_all_inf.drain() 返回的结构化数组的 dtype (与 C++ 的 EventRecord 内存布局相同)
+# samples / first_timestamp_ns: 开启鼠标移动合并 (set_mouse_coalescing) 时一条 mouse_move 记录合并的样本数和第一个样本的时间戳，
+# 其它记录分别为 1 和 timestamp_ns
+NATIVE_EVENT_DTYPE = np.dtype({
+    'names': ['timestamp_ns', 'type', 'dx', 'dy', 'abs_x', 'abs_y', 'button', 'wheel', 'samples', 'first_timestamp_ns'],
+    'formats': ['<i8', '<i4', '<i4', '<i4', '<i4', '<i4', '<i4', '<i4', '<i4', '<i8'],
+    'offsets': [0, 8, 12, 16, 20, 24, 28, 32, 36, 40],
+    'itemsize': 48,
+})
+
+
+def records_to_rows(records: np.ndarray) -> List[list]:
+    """
+    把一批原生事件记录转换为与回调模式完全相同的 CSV 行:
+      mouse_move:          [ts, 'mouse_move', rel_x, rel_y, abs_x, abs_y]
+      合并的 mouse_move:   [ts, 'mouse_move', rel_x, rel_y, abs_x, abs_y, samples, first_timestamp_ns]
+      mouse_down/mouse_up: [ts, type, button, abs_x, abs_y]
+      mouse_wheel:         [ts, 'mouse_wheel', delta, abs_x, abs_y]
+      key_down/key_up:     [ts, type, vkey]
+    合并后的移动记录同样输出一行，时间戳为窗口内最后一个样本，合并了多个样本时在末尾追加样本数和第一个样本的时间戳。
+    """
+    rows = []
+    for ts, code, dx, dy, abs_x, abs_y, button, wheel, samples, first_ts in records.tolist():
+        if code == EVENT_MOUSE_MOVE:
+            if samples > 1:
+                rows.append([ts, 'mouse_move', dx, dy, abs_x, abs_y, samples, first_ts])
+            else:
+                rows.append([ts, 'mouse_move', dx, dy, abs_x, abs_y])
+        elif code == EVENT_MOUSE_DOWN or code == EVENT_MOUSE_UP:
+            rows.append([ts, EVENT_TYPE_NAMES[code], BUTTON_NAMES.get(button, 'unknown'), abs_x, abs_y])
+        elif code == EVENT_MOUSE_WHEEL:
+            rows.append([ts, 'mouse_wheel', wheel, abs_x, abs_y])
+        elif code == EVENT_KEY_DOWN or code == EVENT_KEY_UP:
+            rows.append([ts, EVENT_TYPE_NAMES[code], button])
+    return rows
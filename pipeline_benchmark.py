@@ -0,0 +1,220 @@
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+import multiprocessing as mp
+from typing import List, Tuple
+
+import numpy as np
+
+from capture_pacing import DeadlineTimer, paced_source_options
+from frame_ring_buffer import SharedFrameRing
+from frame_sources import create_frame_source
+from frame_transform import CAPTURE_PIX_FMTS, TRANSFORM_METHODS, FrameTransform, frame_shape, put_frame
+from recorder.encode import encode_process
+
+# --- 默认基准参数 ---
+DEFAULT_RESOLUTIONS = ['1920x1080', '1280x720', '960x540']
+DEFAULT_PRESETS = ['ultrafast', 'superfast', 'veryfast']
+DEFAULT_DURATION = 5  # 每个组合的采集时长（秒）
+DEFAULT_FPS = 120
+DEFAULT_SLOTS = 120
+
+
+def parse_resolution(text: str) -> Tuple[int, int]:
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+def _percentiles_ms(samples_ns: List[int]) -> dict:
+    ms = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    return {
+        'p50': float(np.percentile(ms, 50)) if len(ms) else 0.0,
+        'p99': float(np.percentile(ms, 99)) if len(ms) else 0.0,
+    }
+
+
+def _quiet_encode_process(*args, **kwargs):
+    # 编码进程没有 telemetry 时逐帧打印进度，基准中丢弃它的标准输出，避免打印本身影响吞吐
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        encode_process(*args, **kwargs)
+
+
+# ==============================================================================
+# 基准用的采集进程: 与 capture_process 相同的帧源 → (缩放/转换) → 帧环路径，额外记录每帧的采集阶段耗时
+# ==============================================================================
+def bench_capture_process(frame_ring: SharedFrameRing, source_kind: str, source_options: dict,
+                          duration: float, report_path: str, frame_transform: FrameTransform = None, fps: float = 0):
+    """
+    fps > 0 时与 capture_process 一样由 DeadlineTimer 按节拍抓帧 (帧源本身不节拍)，
+    读帧耗时只计 source.read()，不包含等待截止时间的时间。
+    """
+    source = create_frame_source(source_kind, (0, 0, 0, 0), **paced_source_options(source_kind, source_options))
+    source.start()
+    cpu_start = time.process_time()
+    read_ns, put_ns, accepted = [], [], 0
+    attempted = 0
+    timer = None
+    if fps > 0:
+        timer = DeadlineTimer(fps)
+        timer.start()
+
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline and not source.finished:
+        if timer is not None:
+            timer.wait()
+        t0 = time.perf_counter_ns()
+        frame = source.read()
+        if frame is None:
+            continue
+        capture_time_ns = time.perf_counter_ns()
+        attempted += 1
+        if put_frame(frame_ring, frame_transform, frame, capture_time_ns):
+            accepted += 1
+        t1 = time.perf_counter_ns()
+        read_ns.append(capture_time_ns - t0)
+        put_ns.append(t1 - capture_time_ns)
+
+    cpu_sec = time.process_time() - cpu_start
+    source.stop()
+    frame_ring.close_writer()
+    frame_ring.close()
+
+    report = {
+        'attempted': attempted,
+        'accepted': accepted,
+        'cpu_sec': cpu_sec,
+        'elapsed_sec': duration,
+        'read_latency_ms': _percentiles_ms(read_ns),
+        'enqueue_latency_ms': _percentiles_ms(put_ns),
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f)
+
+
+def run_case(width: int, height: int, preset: str, args, work_dir: str, pix_fmt: str = 'bgr24') -> dict:
+    """
+    跑一个 (分辨率, 预设, 捕获像素格式) 组合，返回吞吐、丢帧率、分阶段延迟和两个进程的 CPU 占用。
+    指定 --source-size 时帧源固定输出该尺寸，width/height 是捕获阶段缩放后的尺寸；否则帧源直接输出 width x height。
+    """
+    tag = f"{width}x{height}_{preset}_{pix_fmt}"
+    src_w, src_h = parse_resolution(args.source_size) if args.source_size else (width, height)
+    video_path = os.path.join(work_dir, f"{tag}.mp4")
+    sync_path = os.path.join(work_dir, f"{tag}_start_time.txt")
+    capture_report = os.path.join(work_dir, f"{tag}_capture.json")
+    encode_report = os.path.join(work_dir, f"{tag}_encode.json")
+
+    if args.source == 'replay':
+        source_options = {'path': args.replay_path, 'width': src_w, 'height': src_h, 'loop': True}
+    else:
+        source_options = {'width': src_w, 'height': src_h, 'pattern': args.pattern}
+
+    frame_transform = FrameTransform(src_w, src_h, width, height, pix_fmt, args.transform)
+    frame_ring = SharedFrameRing(frame_shape(width, height, pix_fmt), slots=args.slots, policy='drop')
+    encoder_options = {'preset': preset, 'crf': str(args.crf)}
+    encode_proc = mp.Process(target=_quiet_encode_process,
+                             args=(frame_ring, video_path, sync_path, width, height, encoder_options, encode_report))
+    capture_proc = mp.Process(target=bench_capture_process,
+                              args=(frame_ring, args.source, source_options, args.duration, capture_report,
+                                    frame_transform, args.fps))
+
+    encode_proc.start()
+    capture_proc.start()
+    capture_proc.join()
+    encode_proc.join()
+
+    ring_stats = frame_ring.stats()
+    frame_ring.close()
+    frame_ring.unlink()
+
+    with open(capture_report, 'r', encoding='utf-8') as f:
+        capture = json.load(f)
+    try:
+        with open(encode_report, 'r', encoding='utf-8') as f:
+            encode = json.load(f)
+    except FileNotFoundError:
+        encode = {'frames': 0}
+
+    attempted = capture['attempted']
+    encode_elapsed = encode.get('elapsed_sec', 0.0)
+    return {
+        'source': f"{src_w}x{src_h}",
+        'resolution': f"{width}x{height}",
+        'pix_fmt': pix_fmt,
+        'preset': preset,
+        'target_fps': args.fps,
+        'captured': attempted,
+        'encoded': encode.get('frames', 0),
+        'encode_fps': encode.get('encode_fps', 0.0),
+        'drop_rate': ring_stats['dropped'] / attempted if attempted else 0.0,
+        'peak_ring_occupancy': ring_stats['peak_occupancy'],
+        'read_latency_ms': capture['read_latency_ms'],
+        'enqueue_latency_ms': capture['enqueue_latency_ms'],
+        'queue_latency_ms': encode.get('queue_latency_ms'),
+        'encode_latency_ms': encode.get('encode_latency_ms'),
+        'capture_cpu': capture['cpu_sec'] / capture['elapsed_sec'] if capture['elapsed_sec'] else 0.0,
+        'encode_cpu': encode.get('cpu_sec', 0.0) / encode_elapsed if encode_elapsed else 0.0,
+        'output_bytes': os.path.getsize(video_path) if os.path.exists(video_path) else 0,
+    }
+
+
+def print_results(results: List[dict]):
+    print(f"\n{'分辨率':<12}{'格式':<10}{'预设':<12}{'编码fps':>10}{'丢帧率':>10}{'采集CPU':>10}{'编码CPU':>10}"
+          f"{'读帧p50/p99(ms)':>20}{'入队p99(ms)':>14}{'排队p50/p99(ms)':>20}{'编码p50/p99(ms)':>20}")
+    for r in results:
+        queue_ms = r['queue_latency_ms'] or {'p50': 0.0, 'p99': 0.0}
+        encode_ms = r['encode_latency_ms'] or {'p50': 0.0, 'p99': 0.0}
+        print(f"{r['resolution']:<12}{r['pix_fmt']:<10}{r['preset']:<12}{r['encode_fps']:>10.1f}{r['drop_rate']:>10.2%}"
+              f"{r['capture_cpu']:>10.0%}{r['encode_cpu']:>10.0%}"
+              f"{r['read_latency_ms']['p50']:>10.2f}/{r['read_latency_ms']['p99']:<9.2f}"
+              f"{r['enqueue_latency_ms']['p99']:>14.2f}"
+              f"{queue_ms['p50']:>10.2f}/{queue_ms['p99']:<9.2f}"
+              f"{encode_ms['p50']:>10.2f}/{encode_ms['p99']:<9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="采集→帧环→编码 流水线吞吐基准")
+    parser.add_argument('--source', choices=['synthetic', 'replay'], default='synthetic')
+    parser.add_argument('--replay-path', help="replay 帧源使用的录像文件，例如 final_output.mp4")
+    parser.add_argument('--pattern', default='box', help="synthetic 帧源的运动模式: static/scroll/box/noise")
+    parser.add_argument('--resolutions', nargs='+', default=DEFAULT_RESOLUTIONS,
+                        help="帧源尺寸；指定 --source-size 时为捕获阶段缩放后的输出尺寸")
+    parser.add_argument('--source-size', help="固定帧源尺寸 (例如 1920x1080)，在捕获阶段缩放到各个 --resolutions")
+    parser.add_argument('--capture-pix-fmts', nargs='+', choices=CAPTURE_PIX_FMTS, default=['bgr24'],
+                        help="捕获阶段输出的像素格式，逐个对比")
+    parser.add_argument('--transform', choices=TRANSFORM_METHODS, default='swscale', help="捕获阶段缩放/转换的实现")
+    parser.add_argument('--presets', nargs='+', default=DEFAULT_PRESETS)
+    parser.add_argument('--crf', type=int, default=18)
+    parser.add_argument('--fps', type=float, default=DEFAULT_FPS, help="目标帧率，0 表示不限速")
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION)
+    parser.add_argument('--slots', type=int, default=DEFAULT_SLOTS)
+    parser.add_argument('--output', help="把结果写入 JSON 文件")
+    parser.add_argument('--keep-videos', help="保留编码产物的目录 (默认使用临时目录并在结束后删除)")
+    args = parser.parse_args()
+
+    if args.source == 'replay' and not args.replay_path:
+        parser.error("--source replay 需要同时指定 --replay-path")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.keep_videos or tmp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        for resolution in args.resolutions:
+            width, height = parse_resolution(resolution)
+            for pix_fmt in args.capture_pix_fmts:
+                for preset in args.presets:
+                    print(f"\n[基准] {resolution} / {pix_fmt} / {preset} ...")
+                    results.append(run_case(width, height, preset, args, work_dir, pix_fmt))
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n[基准] 结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    main()
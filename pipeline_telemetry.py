@@ -0,0 +1,344 @@
+import argparse
+import json
+import math
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List
+
+import numpy as np
+
+from frame_ring_buffer import attach_shared_memory
+
+# --- 计数器与延迟直方图 (每一项只由一个进程写入，读取方只做快照，不需要加锁) ---
+COUNTERS = (
+    'captured_frames',   # 捕获进程: 成功写入帧环的帧数
+    'static_skipped',    # 捕获进程: 被静止帧检测跳过的帧数
+    'encoded_frames',    # 编码进程: 已编码的帧数
+    'spooled_frames',    # 暂存进程 (先录后编): 已写入暂存文件的帧数
+    'events',            # 输入进程: 已写入事件日志的事件数
+    'events_dropped',    # 输入进程: 原生事件环溢出丢弃的事件数
+    'event_queue_peak',  # 输入进程 (pynput): 回调与写入线程之间的事件队列的峰值深度
+    'missed_deadlines',  # 捕获进程: 按 capture_fps 节拍时错过的抓帧截止时间数
+)
+HISTOGRAMS = (
+    'capture_to_enqueue',  # 捕获时间戳 -> 帧写入帧环 (拷贝与阻塞等待)
+    'enqueue_to_encode',   # 帧写入帧环 -> 该帧编码完成 (排队与编码)
+    'event_to_disk',       # 事件时间戳 -> 写入事件日志并刷新
+    'event_hook',          # pynput: 事件时间戳 -> 回调把事件放入写入队列 (输入钩子线程上的开销)
+    'capture_jitter',      # 按 capture_fps 节拍时，相邻两帧间隔与目标间隔之差的绝对值
+)
+BUCKETS_PER_OCTAVE = 8   # 对数分桶，相对误差约 9%
+HISTOGRAM_BUCKETS = BUCKETS_PER_OCTAVE * 40  # 覆盖 1 ns ~ 2^40 ns (约 18 分钟)
+
+# --- 默认参数 ---
+METRICS_INTERVAL = 1.0   # 写一行指标 (以及刷新实时摘要) 的间隔（秒）
+SAMPLE_INTERVAL = 0.05   # 采样帧环深度的间隔（秒）
+
+
+def bucket_of(latency_ns: int) -> int:
+    if latency_ns <= 1:
+        return 0
+    return min(int(math.log2(latency_ns) * BUCKETS_PER_OCTAVE), HISTOGRAM_BUCKETS - 1)
+
+
+def bucket_value_ns(bucket) -> np.ndarray:
+    """分桶的代表值 (桶上下界的几何中点)。"""
+    return np.exp2((np.asarray(bucket, dtype=np.float64) + 0.5) / BUCKETS_PER_OCTAVE)
+
+
+def histogram_percentiles(hist: np.ndarray, percentiles=(50, 99)) -> Dict[str, float]:
+    """由分桶计数估算百分位延迟 (毫秒)，没有样本时返回空字典。"""
+    total = int(hist.sum())
+    if total == 0:
+        return {}
+    cumulative = np.cumsum(hist)
+    result = {}
+    for p in percentiles:
+        bucket = int(np.searchsorted(cumulative, math.ceil(total * p / 100)))
+        result[f"p{p}"] = float(bucket_value_ns(bucket)) / 1e6
+    return result
+
+
+class PipelineTelemetry:
+    """
+    跨进程共享的流水线指标: 计数器和对数分桶的延迟直方图都放在一块 multiprocessing.shared_memory 中。
+    与 SharedFrameRing 一样，对象可以直接作为 mp.Process 的参数传递，子进程中按名称重新挂载。
+    热路径上只做整数加法，每帧/每批事件的开销在微秒以下；汇总与写文件由 TelemetryMonitor 在主进程中完成。
+    """
+
+    def __init__(self):
+        self._shm = shared_memory.SharedMemory(create=True, size=self._total_size())
+        self._owner = True
+        self._map_views()
+        self._counters[:] = 0
+        self._histograms[:] = 0
+        self._sums[:] = 0
+
+    @staticmethod
+    def _total_size() -> int:
+        return (len(COUNTERS) + len(HISTOGRAMS) * (HISTOGRAM_BUCKETS + 1)) * 8
+
+    def _map_views(self):
+        buf = self._shm.buf
+        n_counters, n_hist = len(COUNTERS), len(HISTOGRAMS)
+        self._counters = np.ndarray((n_counters,), dtype=np.int64, buffer=buf, offset=0)
+        self._histograms = np.ndarray((n_hist, HISTOGRAM_BUCKETS), dtype=np.int64, buffer=buf, offset=n_counters * 8)
+        self._sums = np.ndarray((n_hist,), dtype=np.int64, buffer=buf,
+                                offset=(n_counters + n_hist * HISTOGRAM_BUCKETS) * 8)
+
+    def __getstate__(self):
+        return {'name': self._shm.name}
+
+    def __setstate__(self, state):
+        self._shm = attach_shared_memory(state['name'])
+        self._owner = False
+        self._map_views()
+
+    # --- 写入 (热路径) ---
+    def add(self, counter: str, n: int = 1):
+        self._counters[COUNTERS.index(counter)] += n
+
+    def set(self, counter: str, value: int):
+        self._counters[COUNTERS.index(counter)] = value
+
+    def observe(self, histogram: str, latency_ns: int):
+        h = HISTOGRAMS.index(histogram)
+        self._histograms[h, bucket_of(latency_ns)] += 1
+        self._sums[h] += latency_ns
+
+    def observe_many(self, histogram: str, latencies_ns: np.ndarray):
+        """一次记录一批延迟 (例如一批事件的 写盘时间 - 事件时间戳)。"""
+        latencies_ns = np.asarray(latencies_ns, dtype=np.int64)
+        if len(latencies_ns) == 0:
+            return
+        h = HISTOGRAMS.index(histogram)
+        clipped = np.maximum(latencies_ns, 1)
+        buckets = np.minimum((np.log2(clipped) * BUCKETS_PER_OCTAVE).astype(np.int64), HISTOGRAM_BUCKETS - 1)
+        self._histograms[h] += np.bincount(buckets, minlength=HISTOGRAM_BUCKETS)
+        self._sums[h] += int(clipped.sum())
+
+    # --- 读取 ---
+    def snapshot(self) -> dict:
+        return {
+            'counters': {name: int(v) for name, v in zip(COUNTERS, self._counters.tolist())},
+            'histograms': self._histograms.copy(),
+            'sums': self._sums.copy(),
+        }
+
+    def close(self):
+        self._counters = self._histograms = self._sums = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+# ==============================================================================
+# 主进程中的监视线程: 定期采样并写入 JSON Lines 指标文件，可选地刷新一行实时摘要
+# ==============================================================================
+class TelemetryMonitor:
+    """
+    每 SAMPLE_INTERVAL 秒采样一次帧环深度，每 interval 秒向 metrics_path 追加一行:
+      elapsed_sec / queue_depth (当前、区间均值、区间最大) / 帧环写入、丢弃、覆盖的累计数和区间增量 /
+      encode_fps / events_per_sec / 各计数器 / 区间内各阶段延迟的 p50、p99 (毫秒)。
+    stop() 时再写一行 "final": true 的汇总，附带累计直方图 (稀疏形式)，供 summarize_metrics 生成报告。
+    live=True 时用一行 \\r 刷新的摘要代替编码进程的逐帧打印。
+    """
+
+    def __init__(self, telemetry: PipelineTelemetry, metrics_path: str, frame_ring=None,
+                 interval: float = METRICS_INTERVAL, live: bool = False):
+        self.telemetry = telemetry
+        self.metrics_path = metrics_path
+        self.frame_ring = frame_ring
+        self.interval = interval
+        self.live = live
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='TelemetryMonitor', daemon=True)
+        self._file = None
+        self._start = None
+        self._previous = None
+        self._previous_time = None
+        self._previous_ring = {}
+        self._depths: List[int] = []
+
+    def start(self):
+        self._file = open(self.metrics_path, 'w', encoding='utf-8')
+        self._start = time.perf_counter()
+        self._previous = self.telemetry.snapshot()
+        self._previous_time = self._start
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._write_line(final=True)
+        self._file.close()
+        if self.live:
+            print()
+
+    def _run(self):
+        next_write = self._start + self.interval
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            if self.frame_ring is not None:
+                self._depths.append(self.frame_ring.occupancy())
+            if time.perf_counter() >= next_write:
+                self._write_line(final=False)
+                next_write += self.interval
+
+    def _ring_stats(self) -> dict:
+        if self.frame_ring is None:
+            return {}
+        try:
+            return self.frame_ring.stats()
+        except Exception:  # 帧环已被关闭
+            return {}
+
+    def _write_line(self, final: bool):
+        now = time.perf_counter()
+        snapshot = self.telemetry.snapshot()
+        ring = self._ring_stats()
+        seconds = max(now - self._previous_time, 1e-9)
+        counters, previous = snapshot['counters'], self._previous['counters']
+        window_hist = snapshot['histograms'] - self._previous['histograms']
+
+        line = {'time': time.time(), 'elapsed_sec': round(now - self._start, 3)}
+        if ring:
+            depths = self._depths or [ring['occupancy']]
+            line.update({
+                'queue_depth': ring['occupancy'],
+                'queue_depth_mean': round(float(np.mean(depths)), 2),
+                'queue_depth_max': int(max(depths)),
+                'queue_peak': ring['peak_occupancy'],
+                'frames_written': ring['written'],
+                'frames_dropped': ring['dropped'],
+                'frames_overwritten': ring['overwritten'],
+                'new_drops': (ring['dropped'] - self._previous_ring.get('dropped', 0)
+                              + ring['overwritten'] - self._previous_ring.get('overwritten', 0)),
+            })
+            self._previous_ring = ring
+        self._depths = []
+        line['encode_fps'] = round((counters['encoded_frames'] - previous['encoded_frames']) / seconds, 2)
+        if counters['spooled_frames']:
+            line['spool_fps'] = round((counters['spooled_frames'] - previous['spooled_frames']) / seconds, 2)
+        line['events_per_sec'] = round((counters['events'] - previous['events']) / seconds, 2)
+        line['counters'] = counters
+        line['latency_ms'] = {name: histogram_percentiles(window_hist[i]) for i, name in enumerate(HISTOGRAMS)}
+        if final:
+            line['final'] = True
+            line['histograms'] = {name: {str(b): int(snapshot['histograms'][i, b])
+                                         for b in np.flatnonzero(snapshot['histograms'][i])}
+                                  for i, name in enumerate(HISTOGRAMS)}
+            line['latency_sum_ns'] = {name: int(snapshot['sums'][i]) for i, name in enumerate(HISTOGRAMS)}
+
+        self._file.write(json.dumps(line, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._previous, self._previous_time = snapshot, now
+        if self.live and not final:
+            print(f"\r{format_live_summary(line)}", end="", flush=True)
+
+
+def format_live_summary(line: dict) -> str:
+    def p99(name):
+        return line['latency_ms'].get(name, {}).get('p99', 0.0)
+
+    parts = [f"[遥测] {line['elapsed_sec']:7.1f}s"]
+    if 'spool_fps' in line:
+        parts.append(f"暂存 {line['spool_fps']:6.1f} fps")
+    else:
+        parts.append(f"编码 {line['encode_fps']:6.1f} fps")
+    if 'queue_depth' in line:
+        parts.append(f"帧环 {line['queue_depth']:3d} (峰值 {line['queue_peak']})")
+        parts.append(f"丢帧 {line['frames_dropped'] + line['frames_overwritten']}")
+    parts.append(f"排队+编码 p99 {p99('enqueue_to_encode'):6.1f} ms")
+    parts.append(f"事件 {line['events_per_sec']:7.1f}/s")
+    parts.append(f"写盘延迟 p99 {p99('event_to_disk'):6.1f} ms")
+    return " | ".join(parts)
+
+
+# ==============================================================================
+# 录制结束后的报告
+# ==============================================================================
+def summarize_metrics(metrics_path: str) -> dict:
+    """读取指标文件，汇总各阶段延迟的 p50/p99、平均吞吐、帧环深度和丢帧时间线 (每个出现丢帧的区间)。"""
+    lines = []
+    with open(metrics_path, 'r', encoding='utf-8') as f:
+        for text in f:
+            text = text.strip()
+            if text:
+                lines.append(json.loads(text))
+    if not lines:
+        return {}
+
+    final = lines[-1]
+    report = {'duration_sec': final['elapsed_sec'], 'counters': final['counters'], 'latency_ms': {}}
+    for name, sparse in final.get('histograms', {}).items():
+        hist = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+        for bucket, count in sparse.items():
+            hist[int(bucket)] = count
+        if hist.sum():
+            report['latency_ms'][name] = {**histogram_percentiles(hist), 'count': int(hist.sum()),
+                                          'mean': final['latency_sum_ns'][name] / hist.sum() / 1e6}
+    if not final.get('final'):
+        report['incomplete'] = True  # 录制进程异常退出，没有写出最终汇总
+
+    if final['elapsed_sec'] > 0:
+        # 先录后编 (spool) 时录制期间不编码，报告写入暂存文件的帧率
+        if final['counters'].get('spooled_frames'):
+            report['spool_fps'] = final['counters']['spooled_frames'] / final['elapsed_sec']
+        else:
+            report['encode_fps'] = final['counters']['encoded_frames'] / final['elapsed_sec']
+        report['events_per_sec'] = final['counters']['events'] / final['elapsed_sec']
+    if 'queue_depth' in final:
+        report['queue_peak'] = final['queue_peak']
+        report['queue_depth_mean'] = float(np.mean([line['queue_depth_mean'] for line in lines]))
+        report['frames_dropped'] = final['frames_dropped'] + final['frames_overwritten']
+        report['drop_timeline'] = [{'elapsed_sec': line['elapsed_sec'], 'dropped': line['new_drops'],
+                                    'queue_depth_max': line['queue_depth_max']}
+                                   for line in lines if line.get('new_drops')]
+    return report
+
+
+def format_report(report: dict) -> str:
+    if not report:
+        return "[遥测] 指标文件为空。"
+    out = [f"[遥测] 时长 {report['duration_sec']:.1f} 秒" + (" (不完整)" if report.get('incomplete') else "")]
+    if 'spool_fps' in report:
+        out.append(f"  平均暂存帧率 {report['spool_fps']:.1f} fps，事件 {report['events_per_sec']:.1f}/秒")
+    elif 'encode_fps' in report:
+        out.append(f"  平均编码帧率 {report['encode_fps']:.1f} fps，事件 {report['events_per_sec']:.1f}/秒")
+    for name, stats in report['latency_ms'].items():
+        out.append(f"  {name:<20} p50 {stats['p50']:9.3f} ms  p99 {stats['p99']:9.3f} ms  "
+                   f"平均 {stats['mean']:9.3f} ms  ({stats['count']} 个样本)")
+    if 'queue_peak' in report:
+        out.append(f"  帧环深度: 平均 {report['queue_depth_mean']:.1f}，峰值 {report['queue_peak']}；"
+                   f"共丢帧 {report['frames_dropped']}")
+        for entry in report['drop_timeline']:
+            out.append(f"    {entry['elapsed_sec']:8.1f}s  丢帧 {entry['dropped']}  (区间内最大深度 {entry['queue_depth_max']})")
+    counters = report['counters']
+    if counters.get('events_dropped'):
+        out.append(f"  事件环溢出丢弃 {counters['events_dropped']} 个事件")
+    if counters.get('event_queue_peak'):
+        out.append(f"  事件写入队列峰值 {counters['event_queue_peak']}")
+    if counters.get('spooled_frames'):
+        out.append(f"  写入暂存文件 {counters['spooled_frames']} 帧 (未编码，需用 frame_spool.py 转码)")
+    if counters.get('missed_deadlines'):
+        out.append(f"  捕获错过截止时间 {counters['missed_deadlines']} 次")
+    if counters.get('static_skipped'):
+        out.append(f"  静止帧跳过 {counters['static_skipped']} 帧")
+    return "\n".join(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="汇总录制流水线的指标文件 (pipeline_metrics.jsonl)")
+    parser.add_argument('metrics', help="录制时写出的 JSON Lines 指标文件")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出报告")
+    args = parser.parse_args()
+
+    report = summarize_metrics(args.metrics)
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import collections
+import threading
+import time
+from typing import Dict
+
+import numpy as np
+
+from pipeline_telemetry import HISTOGRAM_BUCKETS, BUCKETS_PER_OCTAVE, histogram_percentiles
+
+# --- 默认参数 ---
+FLUSH_INTERVAL = 0.05  # 写入线程最长多久写出并刷新一次（秒）
+FLUSH_BATCH = 256      # 队列积累到这么多事件时提前唤醒写入线程
+
+
+def _histogram_add(hist: np.ndarray, latencies_ns: np.ndarray):
+    buckets = np.minimum((np.log2(np.maximum(latencies_ns, 1)) * BUCKETS_PER_OCTAVE).astype(np.int64),
+                         HISTOGRAM_BUCKETS - 1)
+    hist += np.bincount(buckets, minlength=HISTOGRAM_BUCKETS)
+
+
+def _format_row(row) -> list:
+    # pynput 的 Key/KeyCode/Button 对象在写入线程中才转为字符串，回调里不做任何格式化
+    return [v if v is None or isinstance(v, (int, float, str)) else str(v) for v in row]
+
+
+class QueuedEventWriter:
+    """
+    pynput 回调与事件日志之间的写入队列: 回调线程 (操作系统输入钩子所在的线程) 只调用 put()，
+    即把 (事件行, 入队时间) 追加到 deque，不做格式化和文件 I/O；专门的写入线程每 flush_interval 秒、
+    或队列达到 flush_batch 条时整批取出，写入底层写入器 (CsvEventWriter / BinaryEventWriter / RollingEventWriter 等)
+    并刷新。close() 保证把 close 之前入队的所有事件写出并刷新 (停止键 X1 之后调用)。
+
+    同时统计队列深度、回调开销 (事件时间戳 -> 入队) 和写盘延迟 (事件时间戳 -> 所在批次刷新完成)，
+    指定 telemetry 时写入 event_hook / event_to_disk 直方图和 event_queue_peak 计数器。
+    """
+
+    def __init__(self, writer, flush_interval: float = FLUSH_INTERVAL, flush_batch: int = FLUSH_BATCH,
+                 telemetry=None):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.telemetry = telemetry
+        self.written = 0
+        self.peak_depth = 0
+        self.max_hook_ns = 0
+        self.max_lag_ns = 0
+        self._hook_hist = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+        self._lag_hist = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+        self._queue = collections.deque()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='event-writer', daemon=True)
+        self._thread.start()
+
+    # --- 回调线程 (热路径) ---
+    def put(self, row):
+        """row[0] 为事件的 perf_counter_ns 时间戳；其余参数可以是任意对象，写入时才转换为字符串。"""
+        self._queue.append((row, time.perf_counter_ns()))
+        if len(self._queue) >= self.flush_batch:
+            self._wake.set()
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    # --- 写入线程 ---
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self._drain()
+            except Exception as e:
+                print(f"[事件写入线程] 写入事件日志出错: {e}")
+        self._drain()
+
+    def _drain(self):
+        n = len(self._queue)
+        if not n:
+            # 空闲时也刷新一次: 在线对齐 (EventFeedWriter) 借此得知事件日志已写到哪个时刻
+            self.writer.flush()
+            return
+        self.peak_depth = max(self.peak_depth, n)
+        batch = [self._queue.popleft() for _ in range(n)]
+        for row, _ in batch:
+            self.writer.write_row(_format_row(row))
+        self.writer.flush()
+        flushed_ns = time.perf_counter_ns()
+
+        timestamps = np.fromiter((row[0] for row, _ in batch), dtype=np.int64, count=n)
+        hook_ns = np.fromiter((enqueued for _, enqueued in batch), dtype=np.int64, count=n) - timestamps
+        lag_ns = flushed_ns - timestamps
+        _histogram_add(self._hook_hist, hook_ns)
+        _histogram_add(self._lag_hist, lag_ns)
+        self.max_hook_ns = max(self.max_hook_ns, int(hook_ns.max()))
+        self.max_lag_ns = max(self.max_lag_ns, int(lag_ns.max()))
+        self.written += n
+        if self.telemetry is not None:
+            self.telemetry.add('events', n)
+            self.telemetry.observe_many('event_hook', hook_ns)
+            self.telemetry.observe_many('event_to_disk', lag_ns)
+            self.telemetry.set('event_queue_peak', self.peak_depth)
+
+    def close(self):
+        """停止写入线程，写出并刷新队列中剩余的事件。底层写入器由调用方关闭。"""
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._drain()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'written': self.written,
+            'depth': self.depth,
+            'peak_depth': self.peak_depth,
+            'hook_us': {k: v * 1e3 for k, v in histogram_percentiles(self._hook_hist).items()},
+            'hook_max_us': self.max_hook_ns / 1e3,
+            'to_disk_ms': histogram_percentiles(self._lag_hist),
+            'to_disk_max_ms': self.max_lag_ns / 1e6,
+        }
+
+
+def format_writer_stats(stats: dict) -> str:
+    text = f"写出 {stats['written']} 个事件，队列峰值 {stats['peak_depth']}"
+    if stats['written']:
+        text += (f"；回调入队 p50 {stats['hook_us']['p50']:.1f} / p99 {stats['hook_us']['p99']:.1f} / "
+                 f"最大 {stats['hook_max_us']:.1f} µs；写盘延迟 p50 {stats['to_disk_ms']['p50']:.1f} / "
+                 f"p99 {stats['to_disk_ms']['p99']:.1f} / 最大 {stats['to_disk_max_ms']:.1f} ms")
+    return text
@@ -0,0 +1,10 @@
+from recorder.config import RecorderConfig, config_from_args, load_config_file, validate_config
+
+
+def run_recording(config: RecorderConfig):
+    """见 recorder.session.run_recording；延迟导入，使 `import recorder` 只加载配置模块。"""
+    from recorder.session import run_recording as _run_recording
+    return _run_recording(config)
+
+
+__all__ = ['RecorderConfig', 'config_from_args', 'load_config_file', 'validate_config', 'run_recording']
@@ -0,0 +1,16 @@
+import multiprocessing as mp
+
+from recorder.config import config_from_args
+
+# spawn 出的子进程会把本模块当作 __mp_main__ 重新导入，因此这里只导入配置模块，其余都在 main() 中导入
+
+
+def main(argv=None):
+    config = config_from_args(argv)
+    from recorder.session import run_recording
+    run_recording(config)
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    main()
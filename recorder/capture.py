@@ -0,0 +1,138 @@
+import os
+import time
+
+from capture_pacing import DeadlineTimer, PacingStats, format_pacing_summary, paced_source_options
+from frame_dedup import SkippedFrameLog, StaticFrameDetector
+from frame_sources import create_frame_source
+from frame_transform import put_frame
+from rolling_recorder import RollingSkippedFrameLog
+from recorder.startup_profile import mark_ready
+
+
+# ==============================================================================
+# 进程 1: 屏幕捕获 (生产者)。帧源 (dxcam / PyAV replay) 在 create_frame_source 内部才导入
+# ==============================================================================
+def capture_process(frame_ring, config, start_event, stop_event, telemetry=None, segment_schedule=None,
+                    frame_transform=None):
+    """
+    等待开始信号，然后从帧源捕获画面写入共享内存帧环，直到停止信号、录制时长到达或帧源结束。
+    结束时设置 stop_event，监听进程据此收尾。
+    config.capture_fps > 0 时由 DeadlineTimer 按固定节拍抓帧，并统计帧间隔抖动和错过的截止时间。
+    stop_event 是共享内存标志 (SharedFlag)，每 config.stop_check_frames 帧才检查一次。
+    """
+    try:
+        import psutil
+        p = psutil.Process(os.getpid())
+        p.nice(psutil.HIGH_PRIORITY_CLASS)
+        print(f"[捕获进程] 优先级已提升。")
+    except Exception as e:
+        print(f"[捕获进程] 提升优先级失败: {e}")
+
+    print(f"[捕获进程] 初始化帧源 ({config.frame_source})...")
+    source_options = config.frame_source_options or {}
+    if config.capture_fps > 0:
+        # 节拍由调度器控制，帧源不再自己节拍 (dxcam 使用同步 grab，合成/回放帧源尽快输出)
+        source_options = paced_source_options(config.frame_source, source_options)
+    try:
+        source = create_frame_source(config.frame_source, config.region, **source_options)
+    except Exception as e:
+        print(f"[捕获进程] 帧源创建失败: {e}")
+        stop_event.set()
+        if segment_schedule is not None:
+            segment_schedule.close()
+        frame_ring.close_writer()
+        return
+
+    # 静止帧检测: 与上一保留帧相同的帧不进入帧环，只记录其时间戳
+    detector = skipped_log = None
+    if config.skip_static_frames:
+        detector = StaticFrameDetector(**config.static_frame_options)
+        if segment_schedule is not None:
+            skipped_log = RollingSkippedFrameLog(config.output_dir, segment_schedule)
+        else:
+            skipped_log = SkippedFrameLog(config.skipped_frames_path)
+        print(f"[捕获进程] 已启用静止帧跳过: {config.static_frame_options}")
+
+    if frame_transform is not None and not frame_transform.identity:
+        print(f"[捕获进程] 捕获阶段输出 {frame_transform.width}x{frame_transform.height} {frame_transform.pix_fmt} "
+              f"({frame_transform.method})")
+    mark_ready()
+
+    if config.trigger == 'hotkey':
+        print("[捕获进程] 等待开始信号 (请按 鼠标侧键2)...")
+    while not start_event.wait(0.1):
+        if stop_event.is_set():
+            break
+    if config.trigger == 'hotkey' and not stop_event.is_set():
+        print("[捕获进程] 收到开始信号，将在 1 秒后开始录制...")
+        time.sleep(1)
+
+    source.start()
+    print("[捕获进程] --- 捕获进行中 ---")
+    block = config.ring_policy == 'block'
+    deadline = time.perf_counter() + config.duration if config.duration > 0 else None
+    timer = pacing = None
+    if config.capture_fps > 0:
+        timer = DeadlineTimer(config.capture_fps)
+        pacing = PacingStats(timer.period_ns)
+        timer.start()
+        print(f"[捕获进程] 按 {config.capture_fps} fps 节拍抓帧")
+    frame_count = 0
+    iteration = 0
+
+    while not source.finished:
+        if iteration % config.stop_check_frames == 0:
+            if stop_event.is_set() or (deadline is not None and time.perf_counter() >= deadline):
+                break
+            if timer is not None and telemetry is not None:
+                telemetry.set('missed_deadlines', timer.missed)
+        iteration += 1
+        if timer is not None:
+            frame_deadline_ns = timer.wait()
+        frame = source.read()
+        if frame is not None:
+            capture_time_ns = time.perf_counter_ns()
+            if pacing is not None:
+                jitter_ns = pacing.record(capture_time_ns, frame_deadline_ns)
+                if telemetry is not None and jitter_ns is not None:
+                    telemetry.observe('capture_jitter', jitter_ns)
+            # 滚动录制时每一帧 (包括被跳过的静止帧) 都检查分段边界；需要开始新分段的帧一定送去编码，
+            # 保证每个分段的第一帧是真实编码的画面
+            rolled = segment_schedule.begin_frame(capture_time_ns) if segment_schedule is not None else False
+            if detector is not None and not rolled and not detector.should_keep(frame, capture_time_ns):
+                skipped_log.append(capture_time_ns)
+                if segment_schedule is not None:
+                    # 推进事件水位，静止期间事件写入进程照常分配事件
+                    segment_schedule.end_frame(capture_time_ns, False, False)
+                if telemetry is not None:
+                    telemetry.add('static_skipped')
+                continue
+            # 直接写进共享内存槽位 (配置了 frame_transform 时缩放/转换的结果直接写进槽位)；
+            # 环满时按 ring_policy 丢弃或阻塞等待编码进程腾出槽位
+            accepted = put_frame(frame_ring, frame_transform, frame, capture_time_ns, block=block)
+            if segment_schedule is not None:
+                segment_schedule.end_frame(capture_time_ns, accepted, rolled)
+            if accepted:
+                if detector is not None:
+                    detector.mark_kept(frame, capture_time_ns)
+                frame_count += 1
+                if telemetry is not None:
+                    telemetry.add('captured_frames')
+                    telemetry.observe('capture_to_enqueue', time.perf_counter_ns() - capture_time_ns)
+
+    source.stop()
+    stop_event.set()
+    if skipped_log is not None:
+        skipped_log.close()
+        print(f"[捕获进程] 静止帧: 保留 {detector.kept} 帧，跳过 {detector.skipped} 帧")
+    print(f"\n[捕获进程] --- 捕获结束，共捕获 {frame_count} 帧 ---")
+    print(f"[捕获进程] 帧环统计: {frame_ring.stats()}")
+    if timer is not None:
+        if telemetry is not None:
+            telemetry.set('missed_deadlines', timer.missed)
+        print(f"[捕获进程] 节拍统计: {format_pacing_summary(pacing.summary(timer.missed))}")
+    if segment_schedule is not None:
+        segment_schedule.close()
+    frame_ring.close_writer()
+    frame_ring.close()
+    print("[捕获进程] 进程即将退出。")
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+from typing import NamedTuple, Optional, Tuple
+
+from session_layout import (ANALYSIS_CSV_FILENAME, EVENTS_BINARY_FILENAME, EVENTS_CSV_FILENAME, FRAME_INDEX_FILENAME,
+                            SKIPPED_FRAMES_FILENAME, SPOOL_FILENAME, SYNC_TIME_FILENAME, VIDEO_FILENAME)
+
+# 本模块只依赖标准库和 session_layout: 主进程解析配置、spawn 出的子进程反序列化配置时都不会顺带导入 av/dxcam/pynput
+INPUT_MODES = ('native', 'pynput')   # native: input_module_all_inf (含鼠标移动)；pynput: 键盘和鼠标点击，不含移动
+TRIGGERS = ('hotkey', 'immediate')   # hotkey: 鼠标侧键2 开始、侧键1 停止 (仅 pynput)；immediate: 启动后立即录制
+METRICS_FILENAME = "pipeline_metrics.jsonl"
+STARTUP_PROFILE_FILENAME = "startup_profile.json"
+
+
+class RecorderConfig(NamedTuple):
+    output_dir: str = "recording"
+    input_mode: str = 'pynput'
+    trigger: str = 'hotkey'
+    duration: float = 0  # 录制时长（秒），0 表示直到停止键 / Ctrl+C
+    region: Tuple[int, int, int, int] = (0, 0, 1920, 1080)
+    frame_source: str = 'dxcam'  # 帧源: 'dxcam' / 'synthetic' / 'replay'
+    frame_source_options: dict = {}  # 传给帧源的参数，例如 dxcam 的 target_fps、synthetic 的 fps/pattern、replay 的 path
+    capture_fps: float = 0  # 大于 0 时由捕获调度器按该帧率抓帧 (先 sleep 后自旋)，0 表示跟随帧源自身的节拍
+    stop_check_frames: int = 8  # 捕获循环每隔多少帧检查一次共享内存中的停止标志
+    frame_ring_slots: int = 240  # 共享内存帧环的槽位数 (1080p BGR 每个槽位约 6 MB，720p yuv420p 约 1.3 MB)
+    ring_policy: str = 'drop'  # 帧环满时: 'drop' 丢弃新帧 / 'block' 阻塞捕获 / 'overwrite' 覆盖最旧的帧
+    encoder_options: dict = {'preset': 'ultrafast', 'crf': '18'}
+    encoder_profile: Optional[str] = 'auto'  # encoder_tuning.py 生成的本机配置档: 'auto' 为默认路径，'' 表示不使用
+    encode_workers: int = 1  # 大于 1 时按时间分段并行编码，最后无损拼接
+    segment_seconds: float = 1.0  # 并行编码时每个时间分段的长度（秒）
+    skip_static_frames: bool = False
+    static_frame_options: dict = {'stride': 2, 'heartbeat_fps': 5}
+    event_log_format: str = 'csv'  # 'csv' 或 'binary'
+    input_delivery: str = 'batched'  # native 模式: 'batched' 批量取出原生事件环 / 'callback' 逐个回调
+    event_ring_capacity: int = 1 << 16
+    drain_interval: float = 0.01
+    event_flush_interval: float = 0.05  # pynput 模式: 写入线程批量写出并刷新事件日志的间隔（秒）
+    event_flush_batch: int = 256  # pynput 模式: 写入队列积累到这么多事件时提前写出
+    mouse_coalesce_hz: float = 0
+    metrics: bool = True  # 写 pipeline_metrics.jsonl 并在结束时打印报告
+    metrics_interval: float = 1.0
+    live_summary: bool = True
+    rolling_segment_seconds: float = 0
+    rolling_segment_mb: float = 0
+    output_size: Optional[Tuple[int, int]] = None
+    capture_pix_fmt: str = 'bgr24'
+    capture_transform: str = 'swscale'
+    profile_startup: bool = False
+    spool: bool = False  # 先录后编: 录制时只把原始帧写入内存映射暂存文件，之后用 frame_spool.py 离线并行转码
+    spool_dir: Optional[str] = None  # 暂存文件所在目录 (建议放在本地高速磁盘)，默认 output_dir
+    spool_prealloc_gb: float = 4.0
+    live_align: bool = False  # 录制时在线对齐事件与帧，结束时 frame_by_frame_analysis_final.csv 已写好
+    control_host: str = '127.0.0.1'  # 常驻录制服务 (python -m recorder.service) 的本地控制端口
+    control_port: int = 47800
+
+    @property
+    def rolling(self) -> bool:
+        return self.rolling_segment_seconds > 0 or self.rolling_segment_mb > 0
+
+    @property
+    def video_path(self) -> str:
+        return os.path.join(self.output_dir, VIDEO_FILENAME)
+
+    @property
+    def events_path(self) -> str:
+        name = EVENTS_BINARY_FILENAME if self.event_log_format == 'binary' else EVENTS_CSV_FILENAME
+        return os.path.join(self.output_dir, name)
+
+    @property
+    def sync_time_path(self) -> str:
+        return os.path.join(self.output_dir, SYNC_TIME_FILENAME)
+
+    @property
+    def skipped_frames_path(self) -> str:
+        return os.path.join(self.output_dir, SKIPPED_FRAMES_FILENAME)
+
+    @property
+    def frame_index_path(self) -> str:
+        return os.path.join(self.output_dir, FRAME_INDEX_FILENAME)
+
+    @property
+    def analysis_path(self) -> str:
+        return os.path.join(self.output_dir, ANALYSIS_CSV_FILENAME)
+
+    @property
+    def metrics_path(self) -> Optional[str]:
+        return os.path.join(self.output_dir, METRICS_FILENAME) if self.metrics else None
+
+    @property
+    def spool_path(self) -> str:
+        return os.path.join(self.spool_dir or self.output_dir, SPOOL_FILENAME)
+
+    @property
+    def startup_profile_path(self) -> str:
+        return os.path.join(self.output_dir, STARTUP_PROFILE_FILENAME)
+
+
+def validate_config(config: RecorderConfig) -> RecorderConfig:
+    """检查取值组合，返回 (必要时修正过的) 配置；不合法时抛出 ValueError。"""
+    if config.input_mode not in INPUT_MODES:
+        raise ValueError(f"未知的输入模式: {config.input_mode}")
+    if config.trigger not in TRIGGERS:
+        raise ValueError(f"未知的开始/停止方式: {config.trigger}")
+    if config.trigger == 'hotkey' and config.input_mode != 'pynput':
+        # 原生模块不上报侧键，热键只能由 pynput 监听
+        raise ValueError("trigger='hotkey' 需要 input_mode='pynput'；native 模式请使用 trigger='immediate'")
+    if config.spool and config.rolling:
+        raise ValueError("spool 模式不能与滚动录制同时使用")
+    if config.live_align and (config.spool or config.rolling or config.encode_workers > 1 or config.skip_static_frames):
+        raise ValueError("在线对齐只支持单进程直接编码 (不能与 spool、滚动录制、并行分段编码或静止帧跳过同时使用)")
+    if config.capture_fps < 0:
+        raise ValueError("capture_fps 不能为负数")
+    if config.stop_check_frames < 1:
+        raise ValueError("stop_check_frames 至少为 1")
+    if config.duration < 0:
+        raise ValueError("duration 不能为负数")
+    if config.output_size is not None:
+        config = config._replace(output_size=tuple(config.output_size))
+    return config._replace(region=tuple(config.region))
+
+
+def load_config_file(path: str) -> dict:
+    """读取 JSON 配置文件，键为 RecorderConfig 的字段名。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        values = json.load(f)
+    unknown = set(values) - set(RecorderConfig._fields)
+    if unknown:
+        raise ValueError(f"配置文件 {path} 含有未知字段: {sorted(unknown)}")
+    return values
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m recorder', description="屏幕 + 输入事件同步录制")
+    parser.add_argument('--config', help="JSON 配置文件 (键为 RecorderConfig 字段名)，命令行参数优先")
+    parser.add_argument('--output-dir', help="会话输出目录 (视频、事件日志、同步时间等使用 session_layout 中的文件名)")
+    parser.add_argument('--input-mode', choices=INPUT_MODES)
+    parser.add_argument('--trigger', choices=TRIGGERS, help="hotkey: 鼠标侧键2 开始、侧键1 停止；immediate: 立即开始")
+    parser.add_argument('--duration', type=float, help="录制时长（秒），0 表示直到停止键 / Ctrl+C")
+    parser.add_argument('--region', type=int, nargs=4, metavar=('LEFT', 'TOP', 'RIGHT', 'BOTTOM'))
+    parser.add_argument('--source', dest='frame_source', choices=('dxcam', 'synthetic', 'replay'))
+    parser.add_argument('--source-options', dest='frame_source_options', type=json.loads,
+                        help='传给帧源的参数 (JSON)，例如 \'{"fps": 60, "pattern": "scroll"}\'')
+    parser.add_argument('--capture-fps', type=float, help="捕获调度器的目标帧率，0 表示跟随帧源自身的节拍")
+    parser.add_argument('--event-log-format', choices=('csv', 'binary'))
+    parser.add_argument('--ring-policy', choices=('drop', 'block', 'overwrite'))
+    parser.add_argument('--spool', action='store_true', default=None,
+                        help="先录后编: 只把原始帧写入暂存文件，录制结束后用 frame_spool.py 转码")
+    parser.add_argument('--spool-dir', help="暂存文件所在目录，默认与 --output-dir 相同")
+    parser.add_argument('--encoder-profile', help="encoder_tuning.py 生成的编码器配置档路径，默认使用本机配置档")
+    parser.add_argument('--no-encoder-profile', dest='encoder_profile', action='store_const', const='',
+                        help="不加载编码器配置档，使用 encoder_options")
+    parser.add_argument('--live-align', action='store_true', default=None,
+                        help="录制时在线对齐事件与帧，结束时逐帧分析 CSV 已写好 (与 videoandevents_decoder 输出相同)")
+    parser.add_argument('--no-metrics', dest='metrics', action='store_false', default=None)
+    parser.add_argument('--profile-startup', action='store_true', default=None,
+                        help="记录各进程从启动到就绪的耗时和内存占用，结束时打印并写入 startup_profile.json")
+    parser.add_argument('--control-port', type=int, help="常驻录制服务监听的本地端口 (仅 recorder.service)")
+    return parser
+
+
+def config_from_args(argv=None, base: RecorderConfig = None) -> RecorderConfig:
+    """默认值 (或 base) < 配置文件 < 命令行参数。"""
+    args = build_arg_parser().parse_args(argv)
+    values = dict((base or RecorderConfig())._asdict())
+    if args.config:
+        values.update(load_config_file(args.config))
+    for key, value in vars(args).items():
+        if key != 'config' and value is not None:
+            values[key] = value
+    return validate_config(RecorderConfig(**values))
@@ -0,0 +1,120 @@
+import json
+import time
+
+import numpy as np
+
+from encoder_stream import add_encoder_stream
+from frame_index import FrameIndexWriter
+from frame_transform import pix_fmt_of_shape
+from recorder.config import RecorderConfig
+from recorder.startup_profile import mark_ready
+
+
+# ==============================================================================
+# 进程 2: 视频编码 (消费者)。PyAV 只在编码进程内导入
+# ==============================================================================
+def encode_process(frame_ring, output_path: str, sync_time_path: str, width: int, height: int,
+                   encoder_options: dict = None, report_path: str = None, frame_index_path: str = None,
+                   telemetry=None, frame_feed=None):
+    """
+    在另一个独立的进程中运行，负责从共享内存帧环中取出帧并编码成视频。
+    指定 report_path 时，结束后把每帧的排队延迟和编码耗时汇总写入该 JSON 文件 (供基准测试使用)。
+    指定 frame_index_path 时，同时写出帧索引旁路文件 (每帧 pts、关键帧标记和字节偏移)。
+    指定 telemetry 时记录 入环 -> 编码完成 的延迟和编码帧数，不再逐帧打印进度。
+    指定 frame_feed 时 (在线对齐)，每编码一帧放入它的 capture_time_ns，结束时放入 None。
+    """
+    print("[编码进程] --- 等待第一帧以开始编码 ---")
+    start_time_ns = None
+    index_writer = FrameIndexWriter(frame_index_path) if frame_index_path else None
+    dequeue_ns, encoded_ns, capture_ns = [], [], []
+
+    try:
+        import av
+
+        with av.open(output_path, mode='w') as container:
+            stream = add_encoder_stream(container, width, height, encoder_options or RecorderConfig().encoder_options)
+            # 捕获阶段已输出 yuv420p 时帧环里就是 I420 平面，编码器不再做颜色转换
+            input_pix_fmt = pix_fmt_of_shape(frame_ring.frame_shape)
+            mark_ready()
+
+            frame_count = 0
+            while True:
+                item = frame_ring.get()
+                if item is None:
+                    print("\n[编码进程] 收到结束信号。")
+                    break
+
+                frame_data, capture_time_ns, seq = item
+                if report_path:
+                    dequeue_ns.append(time.perf_counter_ns())
+                    capture_ns.append(capture_time_ns)
+                if start_time_ns is None:
+                    start_time_ns = capture_time_ns
+                    print("[编码进程] 收到第一帧，编码开始！")
+                    try:
+                        with open(sync_time_path, 'w') as f:
+                            f.write(str(start_time_ns))
+                        print(f"[编码进程] 已将同步时间点写入 {sync_time_path}")
+                    except Exception as e:
+                        print(f"[编码进程] 写入同步时间失败: {e}")
+
+                # from_ndarray 会把共享内存中的像素拷贝进 AVFrame，之后即可归还槽位
+                frame = av.VideoFrame.from_ndarray(frame_data, format=input_pix_fmt)
+                frame.pts = capture_time_ns - start_time_ns
+                enqueue_ns = frame_ring.enqueue_time_ns(seq) if telemetry is not None else 0
+                frame_ring.release(seq)
+                for packet in stream.encode(frame):
+                    if index_writer is not None:
+                        index_writer.add_packet(packet)
+                    container.mux(packet)
+                if report_path:
+                    encoded_ns.append(time.perf_counter_ns())
+                if frame_feed is not None:
+                    frame_feed.put(capture_time_ns)
+                frame_count += 1
+                if telemetry is not None:
+                    telemetry.add('encoded_frames')
+                    telemetry.observe('enqueue_to_encode', time.perf_counter_ns() - enqueue_ns)
+                else:
+                    print(f"\r[编码进程] 已编码帧数: {frame_count}", end="")
+
+            for packet in stream.encode():
+                if index_writer is not None:
+                    index_writer.add_packet(packet)
+                container.mux(packet)
+            print(f"\n[编码进程] --- 编码完成，已保存到 {output_path} ---")
+        if index_writer is not None and start_time_ns is not None:
+            index_writer.close(output_path)
+            print(f"[编码进程] 已将 {len(index_writer)} 条帧索引写入 {frame_index_path}")
+        if report_path:
+            _write_encode_report(report_path, capture_ns, dequeue_ns, encoded_ns, time.perf_counter_ns(), time.process_time())
+    except Exception as e:
+        print(f"\n[编码进程] 编码出错: {e}")
+    finally:
+        if frame_feed is not None:
+            frame_feed.put(None)
+        frame_ring.close()
+
+
+def _write_encode_report(report_path: str, capture_ns: list, dequeue_ns: list, encoded_ns: list, finished_ns: int,
+                         cpu_sec: float = 0.0):
+    """
+    汇总编码进程的每帧时间点：排队延迟 = 出队 - 捕获，编码耗时 = 编码完成 - 出队。
+    cpu_sec 是编码进程 (含 x264 线程) 累计占用的 CPU 时间。
+    """
+    capture = np.asarray(capture_ns, dtype=np.int64)
+    dequeue = np.asarray(dequeue_ns, dtype=np.int64)
+    encoded = np.asarray(encoded_ns, dtype=np.int64)
+    report = {'frames': int(len(encoded)), 'cpu_sec': cpu_sec}
+    if len(encoded):
+        elapsed_sec = (finished_ns - dequeue[0]) / 1e9
+        queue_ms = (dequeue - capture) / 1e6
+        encode_ms = (encoded - dequeue) / 1e6
+        report.update({
+            'elapsed_sec': elapsed_sec,
+            'encode_fps': len(encoded) / elapsed_sec if elapsed_sec > 0 else 0.0,
+            'queue_latency_ms': {'p50': float(np.percentile(queue_ms, 50)), 'p99': float(np.percentile(queue_ms, 99))},
+            'encode_latency_ms': {'p50': float(np.percentile(encode_ms, 50)), 'p99': float(np.percentile(encode_ms, 99))},
+        })
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
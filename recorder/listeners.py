@@ -0,0 +1,185 @@
+import os
+import queue
+import time
+
+from queued_event_writer import QueuedEventWriter, format_writer_stats
+from rolling_recorder import open_session_event_writer
+from recorder.startup_profile import mark_ready
+
+
+def _lower_priority(tag: str):
+    try:
+        import psutil
+        p = psutil.Process(os.getpid())
+        p.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+        print(f"[{tag}] 优先级已降低。")
+    except Exception as e:
+        print(f"[{tag}] 降低优先级失败: {e}")
+
+
+def _open_event_writer(config, clock_source: str, segment_schedule=None, alignment_feed=None):
+    writer = open_session_event_writer(config.events_path, config.event_log_format, clock_source, segment_schedule)
+    if alignment_feed is not None:
+        from live_alignment import EventFeedWriter
+        writer = EventFeedWriter(writer, alignment_feed)
+    return writer
+
+
+# ==============================================================================
+# 进程 3a: 原生输入监听 (input_module_all_inf，含鼠标移动)。原生模块只在这个进程中导入
+# ==============================================================================
+def native_listener_process(config, start_event, stop_event, telemetry=None, segment_schedule=None,
+                            alignment_feed=None):
+    """
+    监听所有输入事件并写入事件日志 (CSV 或二进制)，直到 stop_event 被设置。
+    指定 telemetry 时统计事件数、事件环溢出数，以及 事件时间戳 -> 写入事件日志 的延迟。
+    指定 segment_schedule 时 (滚动录制)，事件按分段边界写入各分段目录。
+    指定 alignment_feed 时 (在线对齐)，写入日志的事件同时送给主进程的 LiveAligner。
+    """
+    _lower_priority('原生输入进程')
+    import input_module_all_inf as input_module
+
+    delivery = config.input_delivery
+    if delivery == 'batched' and not hasattr(input_module, 'drain'):
+        print("[原生输入进程] 已安装的 input_module_all_inf 不支持批量模式，请重新编译安装。回退到回调模式。")
+        delivery = 'callback'
+    if config.mouse_coalesce_hz > 0:
+        if hasattr(input_module, 'set_mouse_coalescing'):
+            input_module.set_mouse_coalescing(config.mouse_coalesce_hz)
+            print(f"[原生输入进程] 鼠标移动按 {config.mouse_coalesce_hz} Hz 合并。")
+        else:
+            print("[原生输入进程] 已安装的 input_module_all_inf 不支持鼠标移动合并，请重新编译安装。保持逐条记录。")
+
+    with _open_event_writer(config, 'QueryPerformanceCounter', segment_schedule, alignment_feed) as writer:
+        if delivery == 'batched':
+            _batched_listener_loop(input_module, writer, config, stop_event, telemetry, segment_schedule)
+        else:
+            _callback_listener_loop(input_module, writer, stop_event, telemetry)
+    print("[原生输入进程] 监听已结束，进程即将退出。")
+
+
+def _callback_listener_loop(input_module, writer, stop_event, telemetry=None):
+    event_queue = queue.Queue()
+
+    def event_handler_callback(data_tuple):
+        event_queue.put(data_tuple)
+
+    input_module.start_listener(event_handler_callback)
+    print("[原生输入进程] --- 输入监听已启动 ---")
+    mark_ready()
+
+    while True:
+        try:
+            event_data = event_queue.get(timeout=0.1)
+        except queue.Empty:
+            writer.flush()
+            if stop_event.is_set():
+                return
+            continue
+        writer.write_row(event_data)
+        if telemetry is not None:
+            telemetry.add('events')
+            telemetry.observe('event_to_disk', time.perf_counter_ns() - event_data[0])
+
+
+def _batched_listener_loop(input_module, writer, config, stop_event, telemetry=None, segment_schedule=None):
+    """批量模式: 原生消息循环线程把事件写入无锁环 (不获取 GIL)，这里定期整批取出并写入事件日志。"""
+    input_module.start_buffered_listener(config.event_ring_capacity)
+    print("[原生输入进程] --- 输入监听已启动 (批量模式) ---")
+    mark_ready()
+
+    last_dropped = 0
+    while True:
+        # 先读停止标志再取事件，保证停止前进入事件环的事件都会被写出
+        stopping = stop_event.is_set()
+        records = input_module.drain(0)
+        if len(records):
+            writer.write_records(records)
+            # 每批写完就刷新，进程被强制终止时也不会丢失缓冲区中的事件
+            writer.flush()
+            if telemetry is not None:
+                telemetry.add('events', len(records))
+                telemetry.observe_many('event_to_disk', time.perf_counter_ns() - records['timestamp_ns'])
+        else:
+            # 滚动录制时，分段边界确定之前的事件留在内存中，空闲时也要把它们写出；
+            # 在线对齐时，空闲时的刷新同时把水位送给对齐线程
+            writer.flush()
+            if stopping:
+                return
+            time.sleep(config.drain_interval)
+
+        dropped = input_module.stats().get('dropped', 0)
+        if dropped != last_dropped:
+            print(f"[原生输入进程] 警告: 事件环溢出，累计丢弃 {dropped} 个事件。")
+            last_dropped = dropped
+            if telemetry is not None:
+                telemetry.set('events_dropped', dropped)
+
+
+# ==============================================================================
+# 进程 3b: pynput 输入监听 (键盘和鼠标点击，不含移动)，同时负责热键开始/停止
+# ==============================================================================
+def pynput_listener_process(config, start_event, stop_event, telemetry=None, segment_schedule=None,
+                            alignment_feed=None):
+    """
+    监听键盘和鼠标点击并写入事件日志 (CSV 或二进制)，直到 stop_event 被设置。
+    trigger='hotkey' 时，鼠标侧键2 (前进键) 设置 start_event，侧键1 设置 stop_event。
+    """
+    # pynput 在导入时就会连接系统输入后端，只在监听进程中导入
+    from pynput import mouse, keyboard
+
+    hotkey = config.trigger == 'hotkey'
+    print("[输入进程] --- 输入监听已启动 ---")
+    if hotkey:
+        print("[输入进程] 请按 鼠标侧键2 (前进键) 开始录制...")
+
+    try:
+        # 与原生模式使用完全相同的表头/记录格式
+        with _open_event_writer(config, 'perf_counter_ns', segment_schedule, alignment_feed) as writer:
+            # 回调运行在系统输入钩子的线程上，只取时间戳并入队；格式化和文件 I/O 都在写入线程中完成
+            queued = QueuedEventWriter(writer, config.event_flush_interval, config.event_flush_batch, telemetry)
+
+            def on_key_action(key, action_type):
+                # 写入标准6元组，多余参数为None (key 在写入线程中才转为字符串)
+                queued.put((time.perf_counter_ns(), action_type, key, None, None, None))
+
+            def on_click(x, y, button, pressed):
+                """记录鼠标点击事件，并处理开始/停止热键"""
+                timestamp = time.perf_counter_ns()
+                queued.put((timestamp, 'mouse_press' if pressed else 'mouse_release', x, y, button, None))
+
+                if not hotkey or not pressed:
+                    return
+                if button == mouse.Button.x2 and not start_event.is_set():
+                    print("[输入进程] 检测到开始键 (侧键2)！发送开始信号...")
+                    start_event.set()
+                elif button == mouse.Button.x1 and start_event.is_set():
+                    print("[输入进程] 检测到停止键 (侧键1)！发送停止信号...")
+                    stop_event.set()
+
+            k_listener = keyboard.Listener(
+                on_press=lambda key: on_key_action(key, 'key_press'),
+                on_release=lambda key: on_key_action(key, 'key_release')
+            )
+            m_listener = mouse.Listener(on_click=on_click)
+            k_listener.start()
+            m_listener.start()
+            mark_ready()
+
+            try:
+                stop_event.wait()
+                k_listener.stop()
+                m_listener.stop()
+                k_listener.join()
+                m_listener.join()
+            finally:
+                # 监听器停止后不会再有新事件入队: 写出队列中剩余的事件 (包括停止键本身) 并刷新
+                queued.close()
+                print(f"[输入进程] 事件写入: {format_writer_stats(queued.stats())}")
+
+    except Exception as e:
+        print(f"[输入进程] 发生错误: {e}")
+        stop_event.set()
+
+    print("[输入进程] 监听已结束，进程即将退出。")
+
@@ -0,0 +1,410 @@
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Optional
+
+from recorder.config import RecorderConfig, config_from_args
+
+# spawn 出的子进程会重新导入本模块 (作为 __mp_main__)，这里只导入标准库和配置模块，其余在 RecorderService 中导入
+COMMANDS = ('start', 'stop', 'new-session', 'status', 'shutdown')
+SESSIONS_LOG_FILENAME = "service_sessions.jsonl"  # output_dir 下，每结束一个会话追加一行指标
+READY_TIMEOUT = 60.0          # 等待三个常驻进程就绪的时间（秒）
+FIRST_FRAME_TIMEOUT = 2.0     # 开始命令等待第一帧进入帧环的时间（秒），超时仍然开始录制，只是不报告延迟
+FINALIZE_TIMEOUT = 30.0       # 停止后等待视频和事件日志关闭的时间（秒）
+LISTENER_JOIN_TIMEOUT = 5.0
+DEFAULT_HOST = RecorderConfig().control_host
+DEFAULT_PORT = RecorderConfig().control_port
+
+
+class RecorderService:
+    """
+    常驻录制服务: 帧源、编码器和输入监听只启动一次，之后通过本地控制端口 (或 pynput 侧键) 反复开始/停止会话。
+    每个会话写入 output_dir 下单独的会话目录，布局与一次性录制相同；下一个会话的视频和事件日志在上一个会话停止时
+    就预先打开，开始命令只需在共享会话表里写入开始时间。
+    """
+
+    def __init__(self, config: RecorderConfig):
+        self.config = config
+        self.next_session = 0
+        self.prepared = None    # (会话序号, 会话目录)，已预先打开、等待开始的会话
+        self.recording = None   # (会话序号, 会话目录)
+        self._finalizing = {}   # 会话序号 -> (会话目录, 收尾任务)
+        self._discarded_dirs = []
+        self._processes = {}
+        self._clients = {}      # 控制连接的处理任务 -> 其 StreamWriter
+        self.table = self.frame_ring = None
+
+    # --- 常驻进程 ---
+    def launch(self):
+        from frame_ring_buffer import SharedFrameRing
+        from encoder_tuning import apply_encoder_profile
+        from frame_sources import probe_frame_size
+        from frame_transform import FrameTransform, frame_shape, output_frame_size
+        from recorder.session import _run_child
+        from recorder.standby import SessionTable
+
+        config = self.config
+        os.makedirs(config.output_dir, exist_ok=True)
+        if config.rolling or config.encode_workers > 1 or config.skip_static_frames or config.live_align:
+            print("[服务] 常驻模式不使用滚动录制、并行分段编码、静止帧跳过和在线对齐，这些配置已忽略。")
+        src_w, src_h = probe_frame_size(config.frame_source, config.region, **(config.frame_source_options or {}))
+        w, h = output_frame_size(src_w, src_h, config.output_size)
+        config = self.config = apply_encoder_profile(config, w, h)
+        frame_transform = FrameTransform(src_w, src_h, w, h, config.capture_pix_fmt, config.capture_transform)
+        self.frame_ring = SharedFrameRing(frame_shape(w, h, config.capture_pix_fmt), slots=config.frame_ring_slots,
+                                          policy=config.ring_policy)
+        self.table = SessionTable()
+        self.encode_control = mp.Queue()
+        self.listener_control = mp.Queue()
+        self.hotkey_commands = mp.Queue()
+        print(f"[服务] 视频尺寸: {w}x{h} {config.capture_pix_fmt}，帧环 {config.frame_ring_slots} 个槽位")
+
+        roles = {
+            'listener': ('recorder.standby', 'standby_listener_process',
+                         (config, self.table, self.listener_control, self.hotkey_commands), {}),
+            'encode': ('recorder.standby', 'standby_encode_process',
+                       (self.frame_ring, self.table, self.encode_control, w, h, config.encoder_options), {}),
+            'capture': ('recorder.standby', 'standby_capture_process', (self.frame_ring, self.table, config),
+                        {'frame_transform': frame_transform}),
+        }
+        for role, spec in roles.items():
+            proc = self._processes[role] = mp.Process(target=_run_child, args=(role,) + spec, name=role)
+            proc.start()
+
+    async def wait_ready(self):
+        launched_ns = time.perf_counter_ns()
+        deadline = time.perf_counter() + READY_TIMEOUT
+        while not self.table.all_ready():
+            dead = [role for role, proc in self._processes.items() if not proc.is_alive()]
+            if dead:
+                raise RuntimeError(f"常驻进程启动失败: {dead}")
+            if time.perf_counter() >= deadline:
+                ready = self.table.ready_roles()
+                raise RuntimeError(f"等待常驻进程就绪超时，未就绪: {[role for role in self._processes if role not in ready]}")
+            await asyncio.sleep(0.01)
+        print(f"[服务] 捕获、编码、输入监听已就绪 ({(time.perf_counter_ns() - launched_ns) / 1e6:.0f} ms)")
+
+    # --- 会话 ---
+    def _session_dir(self, name: Optional[str]) -> str:
+        if name:
+            path = os.path.join(self.config.output_dir, name)
+            if os.path.exists(path) and os.listdir(path):
+                raise ValueError(f"会话目录已存在且不为空: {path}")
+            return path
+        n = self.next_session
+        while os.path.exists(os.path.join(self.config.output_dir, f"session_{n:04d}")):
+            n += 1
+        return os.path.join(self.config.output_dir, f"session_{n:04d}")
+
+    def _prepare(self, name: Optional[str] = None):
+        session_dir = self._session_dir(name)
+        os.makedirs(session_dir, exist_ok=True)
+        session = self.next_session
+        self.next_session += 1
+        self.table.reset(session)
+        self.encode_control.put(('prepare', session, session_dir))
+        self.listener_control.put(('prepare', session, session_dir))
+        self.prepared = (session, session_dir)
+
+    def _discard_prepared(self):
+        session, session_dir = self.prepared
+        self.encode_control.put(('discard', session))
+        self.listener_control.put(('discard', session))
+        self._discarded_dirs.append(session_dir)
+        self.prepared = None
+
+    def _start_locked(self, name: Optional[str], start_ns: int) -> dict:
+        if self.recording is not None:
+            return {'ok': False, 'error': f"正在录制 {self.recording[1]}"}
+        if name and os.path.basename(self.prepared[1]) != name:
+            self._session_dir(name)  # 目录不可用时先报错，保留已准备的会话
+            self._discard_prepared()
+            self._prepare(name)
+        session, session_dir = self.recording = self.prepared
+        self.prepared = None
+        self.table.start(session, start_ns)
+        print(f"[服务] 会话 {session} 开始录制 -> {session_dir}")
+        return {'ok': True, 'session': session, 'dir': session_dir}
+
+    def _stop_locked(self, stop_ns: int) -> dict:
+        if self.recording is None:
+            return {'ok': False, 'error': "当前没有在录制"}
+        session, session_dir = self.recording
+        self.table.stop(session, stop_ns)
+        self.recording = None
+        # 下一个会话的文件立即预先打开，收尾在后台进行
+        self._prepare()
+        task = asyncio.get_running_loop().create_task(self._finalize(session, session_dir))
+        self._finalizing[session] = (session_dir, task)
+        print(f"[服务] 会话 {session} 停止录制")
+        return {'ok': True, 'session': session, 'dir': session_dir}
+
+    async def _await_first_frame(self, reply: dict) -> dict:
+        from recorder.standby import ROW_FIRST_FRAME_NS, ROW_START_NS
+
+        session = reply['session']
+        deadline = time.perf_counter() + FIRST_FRAME_TIMEOUT
+        while not self.table.get(session, ROW_FIRST_FRAME_NS) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.001)
+        first_frame_ns = self.table.get(session, ROW_FIRST_FRAME_NS)
+        if first_frame_ns:
+            reply['start_latency_ms'] = (first_frame_ns - self.table.get(session, ROW_START_NS)) / 1e6
+        return reply
+
+    async def start(self, name: Optional[str] = None, start_ns: Optional[int] = None) -> dict:
+        start_ns = start_ns or time.perf_counter_ns()
+        async with self._lock:
+            reply = self._start_locked(name, start_ns)
+        return await self._await_first_frame(reply) if reply['ok'] else reply
+
+    async def stop(self, stop_ns: Optional[int] = None, wait: bool = True) -> dict:
+        stop_ns = stop_ns or time.perf_counter_ns()
+        async with self._lock:
+            reply = self._stop_locked(stop_ns)
+        if not reply['ok'] or not wait:
+            return reply
+        return {'ok': True, **await self._finalizing[reply['session']][1]}
+
+    async def new_session(self, name: Optional[str] = None) -> dict:
+        """录制中: 停止当前会话并立即开始下一个 (两个会话在同一时间点衔接)；空闲时: 把已准备的会话换成指定名字。"""
+        now_ns = time.perf_counter_ns()
+        async with self._lock:
+            if self.recording is None:
+                if name:
+                    self._session_dir(name)
+                    self._discard_prepared()
+                    self._prepare(name)
+                return {'ok': True, 'prepared': self.prepared[1]}
+            stopped = self._stop_locked(now_ns)
+            reply = self._start_locked(name, now_ns)
+        reply['previous'] = stopped['dir']
+        return await self._await_first_frame(reply) if reply['ok'] else reply
+
+    def status(self) -> dict:
+        return {'ok': True, 'recording': self.recording[1] if self.recording else None,
+                'prepared': self.prepared[1] if self.prepared else None,
+                'finalizing': [session_dir for session_dir, _ in self._finalizing.values()],
+                'frame_ring': self.frame_ring.stats()}
+
+    async def _finalize(self, session: int, session_dir: str) -> dict:
+        from recorder.standby import ROW_ENCODE_DONE, ROW_EVENTS_DONE
+
+        deadline = time.perf_counter() + FINALIZE_TIMEOUT
+        while not (self.table.get(session, ROW_ENCODE_DONE) and self.table.get(session, ROW_EVENTS_DONE)):
+            if time.perf_counter() >= deadline:
+                print(f"[服务] 警告: 会话 {session} 的视频或事件日志未能按时关闭。")
+                break
+            await asyncio.sleep(0.01)
+        metrics = self._write_session_metrics(session, session_dir)
+        del self._finalizing[session]
+        self._remove_discarded_dirs()
+        return metrics
+
+    def _write_session_metrics(self, session: int, session_dir: str) -> dict:
+        from recorder.standby import ROW_ENCODE_DONE, ROW_EVENTS_DONE
+        from session_layout import SESSION_METRICS_FILENAME
+
+        row = self.table.row(session)
+
+        def latency_ms(field):
+            return (row[field] - row['start_ns']) / 1e6 if row[field] else None
+
+        metrics = {
+            'session': session, 'dir': os.path.basename(session_dir),
+            'start_ns': row['start_ns'], 'stop_ns': row['stop_ns'],
+            'duration_sec': (row['stop_ns'] - row['start_ns']) / 1e9,
+            'start_latency_ms': latency_ms('first_frame_ns'),            # 开始命令 -> 第一帧进入帧环
+            'first_encoded_latency_ms': latency_ms('first_encoded_ns'),  # 开始命令 -> 第一帧编码完成
+            'frames': row['frames'], 'dropped_frames': row['dropped'], 'encoded_frames': row['encoded'],
+            'events': row['events'],
+            'complete': bool(self.table.get(session, ROW_ENCODE_DONE) and self.table.get(session, ROW_EVENTS_DONE)),
+        }
+        with open(os.path.join(session_dir, SESSION_METRICS_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, indent=2)
+        with open(os.path.join(self.config.output_dir, SESSIONS_LOG_FILENAME), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(metrics) + "\n")
+        latency = metrics['start_latency_ms']
+        print(f"[服务] 会话 {session} 已保存: {metrics['encoded_frames']} 帧, {metrics['events']} 个事件, "
+              f"开始延迟 {'-' if latency is None else f'{latency:.1f} ms'}")
+        return metrics
+
+    def _remove_discarded_dirs(self):
+        """丢弃的会话由编码、监听进程删除预先创建的文件，目录变空后在这里删除。"""
+        for session_dir in list(self._discarded_dirs):
+            try:
+                os.rmdir(session_dir)
+                self._discarded_dirs.remove(session_dir)
+            except FileNotFoundError:
+                self._discarded_dirs.remove(session_dir)
+            except OSError:
+                pass
+
+    # --- 控制端口 ---
+    async def handle_command(self, request: dict) -> dict:
+        command = request.get('command')
+        name = request.get('name')
+        try:
+            if command == 'start':
+                return await self.start(name, request.get('timestamp_ns'))
+            if command == 'stop':
+                return await self.stop(request.get('timestamp_ns'))
+            if command == 'new-session':
+                return await self.new_session(name)
+            if command == 'status':
+                return self.status()
+            if command == 'shutdown':
+                self._shutdown.set()
+                return {'ok': True}
+        except ValueError as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': False, 'error': f"未知命令: {command}"}
+
+    async def _handle_client(self, reader, writer):
+        """每行一个 JSON 请求，例如 {"command": "start", "name": "take_01"}，每个请求回复一行 JSON。收到 shutdown 后不再读取。"""
+        task = asyncio.current_task()
+        self._clients[task] = writer
+        try:
+            while not self._shutdown.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as e:
+                    reply = {'ok': False, 'error': f"无法解析请求: {e}"}
+                else:
+                    reply = await self.handle_command(request)
+                writer.write((json.dumps(reply, ensure_ascii=False) + "\n").encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            self._clients.pop(task, None)
+
+    async def _close_clients(self):
+        """关闭仍然连着的控制连接 (它们的 readline 随即读到 EOF) 并等待处理任务结束，退出时不留下被取消的连接任务。"""
+        for writer in list(self._clients.values()):
+            writer.close()
+        await asyncio.gather(*self._clients, return_exceptions=True)
+
+    def _forward_hotkeys(self, loop):
+        """监听进程检测到侧键2 / 侧键1 时放入 (命令, 按键时间戳)，以按键时间作为会话开始/停止时间。"""
+        while True:
+            item = self.hotkey_commands.get()
+            if item is None:
+                return
+            command, timestamp_ns = item
+            print(f"[服务] 检测到{'开始键 (侧键2)' if command == 'start' else '停止键 (侧键1)'}")
+            request = {'command': command, 'timestamp_ns': timestamp_ns}
+            asyncio.run_coroutine_threadsafe(self.handle_command(request), loop)
+
+    async def serve(self):
+        self._lock = asyncio.Lock()
+        self._shutdown = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self.launch()
+        forwarder = threading.Thread(target=self._forward_hotkeys, args=(loop,), daemon=True)
+        try:
+            await self.wait_ready()
+            self._prepare()
+            server = await asyncio.start_server(self._handle_client, self.config.control_host,
+                                                self.config.control_port)
+            forwarder.start()
+            print(f"[服务] 控制端口 {self.config.control_host}:{self.config.control_port} 已打开 "
+                  f"(命令: {', '.join(COMMANDS)})")
+            if self.config.trigger == 'hotkey':
+                print("[服务] 也可以按 鼠标侧键2 开始、侧键1 停止。")
+            async with server:
+                await self._shutdown.wait()
+                await self._close_clients()
+            if self.recording is not None:
+                await self.stop()
+            for _, task in list(self._finalizing.values()):
+                await task
+        finally:
+            self.hotkey_commands.put(None)
+            if forwarder.is_alive():
+                forwarder.join()
+            self.close()
+
+    def close(self):
+        """通知各常驻进程退出并等待它们收尾；仍在录制或未收尾的会话照常写出指标。"""
+        if self.table is None:
+            return
+        if self.recording is not None:
+            self.table.stop(self.recording[0], time.perf_counter_ns())
+            self._finalizing[self.recording[0]] = (self.recording[1], None)
+            self.recording = None
+        if self.prepared is not None:
+            self._discarded_dirs.append(self.prepared[1])
+            self.prepared = None
+        self.table.shutdown()
+        for role in ('capture', 'encode'):
+            if role in self._processes:
+                self._processes[role].join()
+        listener = self._processes.get('listener')
+        if listener is not None:
+            listener.join(LISTENER_JOIN_TIMEOUT)
+            if listener.is_alive():
+                print("[服务] 输入监听进程未能按时退出，强制终止。")
+                listener.terminate()
+                listener.join()
+        for session, (session_dir, _) in list(self._finalizing.items()):
+            self._write_session_metrics(session, session_dir)
+        self._finalizing.clear()
+        self._remove_discarded_dirs()
+        self.frame_ring.close()
+        self.frame_ring.unlink()
+        self.table.release()
+        self.table.unlink()
+        self.table = None
+        print("[服务] 已退出。")
+
+
+def run_service(config: RecorderConfig):
+    try:
+        asyncio.run(RecorderService(config).serve())
+    except KeyboardInterrupt:
+        print("\n[服务] 收到 Ctrl+C。")
+
+
+def send_command(command: str, name: Optional[str] = None, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 timeout: float = 60.0) -> dict:
+    """向常驻录制服务发送一条命令并返回回复。"""
+    request = {'command': command}
+    if name:
+        request['name'] = name
+    with socket.create_connection((host, port), timeout=timeout) as conn:
+        conn.sendall((json.dumps(request) + "\n").encode('utf-8'))
+        with conn.makefile('r', encoding='utf-8') as f:
+            return json.loads(f.readline())
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ['send']:
+        parser = argparse.ArgumentParser(prog='python -m recorder.service send', description="向常驻录制服务发送命令")
+        parser.add_argument('command', choices=COMMANDS)
+        parser.add_argument('name', nargs='?', help="start / new-session: 会话目录名 (默认 session_XXXX)")
+        parser.add_argument('--host', default=DEFAULT_HOST)
+        parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+        args = parser.parse_args(argv[1:])
+        reply = send_command(args.command, args.name, args.host, args.port)
+        print(json.dumps(reply, ensure_ascii=False, indent=2))
+        return 0 if reply.get('ok') else 1
+    if argv[:1] == ['serve']:
+        argv = argv[1:]
+    run_service(config_from_args(argv))
+    return 0
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import multiprocessing as mp
+import os
+import signal
+import time
+
+from capture_pacing import SharedFlag
+from encoder_tuning import apply_encoder_profile
+from frame_ring_buffer import SharedFrameRing
+from frame_sources import probe_frame_size
+from frame_transform import FrameTransform, frame_shape, output_frame_size
+from pipeline_telemetry import PipelineTelemetry, TelemetryMonitor, format_report, summarize_metrics
+from rolling_recorder import SegmentSchedule
+from recorder.config import RecorderConfig
+from recorder.startup_profile import StartupProfiler, begin_role, format_startup_report
+
+# 主进程只导入上面这些轻量模块 (标准库 + NumPy)。各角色的入口函数按 "模块:函数" 登记，
+# 子进程反序列化时只导入自己角色所在的模块，重量级依赖在角色函数内部才导入
+LISTENER_JOIN_TIMEOUT = 5.0  # 停止后等待监听进程写完事件日志的时间（秒），超时则强制终止
+
+
+def _run_child(role: str, module_name: str, function_name: str, args: tuple, kwargs: dict, profile_channel=None):
+    """子进程入口: Ctrl+C 只由主进程处理 (它再设置 stop_event 让各进程正常收尾)。"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import importlib
+    target = getattr(importlib.import_module(module_name), function_name)
+    if profile_channel is not None:
+        begin_role(role, profile_channel)
+    return target(*args, **kwargs)
+
+
+def _encoder_role(config: RecorderConfig, frame_ring, width: int, height: int, telemetry, schedule, frame_feed=None):
+    if config.spool:
+        # 先录后编: 录制时不编码，原始帧写入暂存文件
+        return ('frame_spool', 'spool_process',
+                (frame_ring, config.spool_path, config.sync_time_path, int(config.spool_prealloc_gb * 2**30)),
+                {'telemetry': telemetry})
+    if schedule is not None:
+        # 滚动录制: 各分段写入 output_dir/segment_XXXXXX/，并行分段编码不与之组合
+        return ('rolling_recorder', 'rolling_encode_process',
+                (frame_ring, schedule, config.output_dir, width, height, config.encoder_options),
+                {'telemetry': telemetry})
+    if config.encode_workers > 1:
+        return ('segmented_encoder', 'segmented_encode_process',
+                (frame_ring, config.video_path, config.sync_time_path, width, height, config.encode_workers,
+                 config.segment_seconds, config.encoder_options),
+                {'frame_index_path': config.frame_index_path})
+    return ('recorder.encode', 'encode_process',
+            (frame_ring, config.video_path, config.sync_time_path, width, height, config.encoder_options),
+            {'frame_index_path': config.frame_index_path, 'telemetry': telemetry, 'frame_feed': frame_feed})
+
+
+def run_recording(config: RecorderConfig):
+    """按配置完成一次录制: 分配帧环，启动捕获、编码、输入监听三个进程并等待它们结束。"""
+    os.makedirs(config.output_dir, exist_ok=True)
+    if config.spool and config.spool_dir:
+        os.makedirs(config.spool_dir, exist_ok=True)
+    profiler = StartupProfiler() if config.profile_startup else None
+    start_event = mp.Event()
+
+    print("[主进程] 获取视频尺寸...")
+    try:
+        src_w, src_h = probe_frame_size(config.frame_source, config.region, **(config.frame_source_options or {}))
+    except Exception as e:
+        print(f"[主进程] 无法获取视频尺寸，请检查屏幕是否开启: {e}")
+        return
+    print(f"[主进程] 视频尺寸: {src_w}x{src_h}")
+    # 停止标志放在共享内存中，捕获循环读取它不经过信号量 (开始信号需要能被阻塞等待，仍使用 mp.Event)
+    stop_event = SharedFlag()
+
+    # 捕获阶段缩放/转换后，帧环、编码器都按输出尺寸和像素格式分配
+    w, h = output_frame_size(src_w, src_h, config.output_size)
+    # 本机的编码器配置档按输出尺寸/像素格式/帧率查找，可能替换 encoder_options 并降低 capture_fps
+    config = apply_encoder_profile(config, w, h)
+    frame_transform = FrameTransform(src_w, src_h, w, h, config.capture_pix_fmt, config.capture_transform)
+    if not frame_transform.identity:
+        print(f"[主进程] 捕获输出: {w}x{h} {config.capture_pix_fmt} ({config.capture_transform})")
+    frame_ring = SharedFrameRing(frame_shape(w, h, config.capture_pix_fmt), slots=config.frame_ring_slots,
+                                 policy=config.ring_policy)
+    print(f"[主进程] 帧环已分配: {config.frame_ring_slots} 个槽位 "
+          f"({frame_ring.frame_nbytes * config.frame_ring_slots / 2**20:.0f} MB)")
+
+    telemetry = PipelineTelemetry() if config.metrics else None
+    schedule = None
+    if config.rolling:
+        schedule = SegmentSchedule(config.rolling_segment_seconds, int(config.rolling_segment_mb * 2**20))
+
+    aligner = None
+    frame_feed = event_feed = None
+    if config.live_align:
+        # 在线对齐: 编码进程送帧时间戳、监听进程送事件行，主进程中的对齐线程边录边写逐帧分析文件
+        from live_alignment import LiveAligner
+        frame_feed, event_feed = mp.Queue(), mp.Queue()
+        aligner = LiveAligner(config.analysis_path, frame_feed, event_feed)
+        aligner.start()
+
+    listener_function = 'native_listener_process' if config.input_mode == 'native' else 'pynput_listener_process'
+    roles = {
+        'listener': ('recorder.listeners', listener_function, (config, start_event, stop_event),
+                     {'telemetry': telemetry, 'segment_schedule': schedule, 'alignment_feed': event_feed}),
+        'encode': _encoder_role(config, frame_ring, w, h, telemetry, schedule, frame_feed),
+        'capture': ('recorder.capture', 'capture_process', (frame_ring, config, start_event, stop_event),
+                    {'telemetry': telemetry, 'segment_schedule': schedule, 'frame_transform': frame_transform}),
+    }
+    channel = profiler.channel if profiler is not None else None
+    processes = {role: mp.Process(target=_run_child, args=(role,) + spec + (channel,), name=role)
+                 for role, spec in roles.items()}
+
+    monitor = None
+    if telemetry is not None:
+        monitor = TelemetryMonitor(telemetry, config.metrics_path, frame_ring, config.metrics_interval,
+                                   config.live_summary)
+        monitor.start()
+
+    print("[主进程] 启动所有进程...")
+    for role, proc in processes.items():
+        spawn_ns = time.perf_counter_ns()
+        proc.start()
+        if profiler is not None:
+            profiler.started(role, spawn_ns)
+    if config.trigger == 'immediate':
+        start_event.set()
+
+    print("[主进程] 所有进程已启动。等待录制完成 (Ctrl+C 停止)...")
+    try:
+        processes['capture'].join()
+    except KeyboardInterrupt:
+        print("\n[主进程] 收到 Ctrl+C，发送停止信号...")
+        stop_event.set()
+        processes['capture'].join()
+    stop_event.set()
+    processes['encode'].join()
+    processes['listener'].join(LISTENER_JOIN_TIMEOUT)
+    if processes['listener'].is_alive():
+        print("[主进程] 输入监听进程未能按时退出，强制终止。")
+        processes['listener'].terminate()
+        processes['listener'].join()
+
+    print(f"[主进程] 帧环统计: {frame_ring.stats()}")
+    if aligner is not None:
+        aligner.finish()
+        stats = aligner.stats()
+        print(f"[主进程] 在线对齐: {stats['frames']} 帧，{stats['events']} 个事件 (分配到帧 {stats['assigned']} 个)，"
+              f"待定事件峰值 {stats['max_pending']}，已写入 {config.analysis_path}")
+        if stats['late_events']:
+            # 水位之后仍有事件落入已写出的帧，在线结果不可信，按离线对齐重写
+            from live_alignment import realign_offline
+            print(f"[主进程] 警告: {stats['late_events']} 个事件晚于水位到达，改用离线对齐重写分析文件...")
+            realign_offline(config.output_dir, config.analysis_path)
+    if monitor is not None:
+        monitor.stop()
+        print(format_report(summarize_metrics(config.metrics_path)))
+        telemetry.close()
+        telemetry.unlink()
+    if schedule is not None:
+        schedule.release()
+        schedule.unlink()
+    frame_ring.close()
+    frame_ring.unlink()
+    stop_event.close()
+    stop_event.unlink()
+
+    if profiler is not None:
+        report = profiler.report()
+        profiler.write(config.startup_profile_path, report)
+        print(format_startup_report(report))
+        print(f"[主进程] 启动剖析已写入 {config.startup_profile_path}")
+
+    print("\n[主进程] 所有任务完成！视频、事件日志和同步文件已保存。")
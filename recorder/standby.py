@@ -0,0 +1,515 @@
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from binary_event_log import open_event_writer
+from capture_pacing import DeadlineTimer, paced_source_options
+from encoder_stream import add_encoder_stream
+from frame_index import FrameIndexWriter
+from frame_ring_buffer import attach_shared_memory
+from frame_transform import pix_fmt_of_shape, put_frame
+from queued_event_writer import QueuedEventWriter, format_writer_stats
+from session_layout import EVENTS_BINARY_FILENAME, EVENTS_CSV_FILENAME, FRAME_INDEX_FILENAME, SYNC_TIME_FILENAME, \
+    VIDEO_FILENAME
+from recorder.startup_profile import mark_ready
+
+MAX_SESSIONS = 1024                  # 会话表的行数，按会话序号取模循环使用
+EVENT_GRACE_NS = 250_000_000         # 会话停止后继续接收迟到事件的时间，之后关闭该会话的事件日志
+NOT_STOPPED = np.iinfo(np.int64).max
+
+# --- 头部字段 ---
+_HDR_CURRENT = 0      # 最近一次开始的会话序号 (主进程写)
+_HDR_RECORDING = 1    # 1 表示 _HDR_CURRENT 正在录制
+_HDR_SHUTDOWN = 2     # 1 表示服务正在退出，各进程收尾后结束
+_HDR_READY = 3        # 各进程角色的就绪标志，每个角色一个字段 (见 ROLE_READY_FIELDS)，各自只写自己的字段
+_HDR_FIELDS = 8
+
+# --- 每个会话一行 ---
+ROW_START_NS = 0          # 开始命令的时间 (perf_counter_ns，热键开始时为按键事件的时间戳)
+ROW_STOP_NS = 1           # 停止命令的时间，未停止时为 NOT_STOPPED
+ROW_FIRST_FRAME_NS = 2    # 会话第一帧的 capture_time_ns (捕获进程写)
+ROW_FRAMES = 3            # 写入帧环的帧数
+ROW_DROPPED = 4           # 帧环已满而丢弃的帧数
+ROW_CAPTURE_DONE = 5      # 捕获进程不会再为该会话写入帧
+ROW_FIRST_ENCODED_NS = 6  # 第一帧编码完成的时间 (编码进程写)
+ROW_ENCODED = 7           # 编码帧数
+ROW_ENCODE_DONE = 8       # 视频文件已关闭
+ROW_EVENTS = 9            # 写入的事件数 (监听进程写)
+ROW_EVENTS_DONE = 10      # 事件日志已关闭
+_ROW_FIELDS = 12
+
+ROLE_READY_FIELDS = {'capture': _HDR_READY, 'encode': _HDR_READY + 1, 'listener': _HDR_READY + 2}
+
+
+class SessionTable:
+    """
+    常驻录制服务的会话表，放在 multiprocessing.shared_memory 中，可以直接作为 mp.Process 的参数传递。
+    主进程写开始/停止时间，捕获、编码、监听进程按时间戳判断帧和事件属于哪个会话，并回填各自的进度。
+    开始命令只是几次内存写入，捕获进程在下一帧就能看到，不经过任何队列。
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS):
+        self.max_sessions = int(max_sessions)
+        self._shm = shared_memory.SharedMemory(create=True, size=(_HDR_FIELDS + self.max_sessions * _ROW_FIELDS) * 8)
+        self._owner = True
+        self._map_views()
+        self._header[:] = 0
+        self._header[_HDR_CURRENT] = -1
+        self._rows[:] = 0
+
+    def _map_views(self):
+        buf = self._shm.buf
+        self._header = np.ndarray((_HDR_FIELDS,), dtype=np.int64, buffer=buf, offset=0)
+        self._rows = np.ndarray((self.max_sessions, _ROW_FIELDS), dtype=np.int64, buffer=buf, offset=_HDR_FIELDS * 8)
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'max_sessions': self.max_sessions}
+
+    def __setstate__(self, state):
+        self.max_sessions = state['max_sessions']
+        self._shm = attach_shared_memory(state['name'])
+        self._owner = False
+        self._map_views()
+
+    # --- 主进程 ---
+    def reset(self, session: int):
+        """准备会话时清空它的行 (行按序号取模复用)。"""
+        row = self._rows[session % self.max_sessions]
+        row[:] = 0
+        row[ROW_STOP_NS] = NOT_STOPPED
+
+    def start(self, session: int, start_ns: int):
+        row = self._rows[session % self.max_sessions]
+        row[ROW_STOP_NS] = NOT_STOPPED
+        row[ROW_START_NS] = start_ns
+        self._header[_HDR_CURRENT] = session
+        self._header[_HDR_RECORDING] = 1
+
+    def stop(self, session: int, stop_ns: int):
+        self._rows[session % self.max_sessions, ROW_STOP_NS] = stop_ns
+        self._header[_HDR_RECORDING] = 0
+
+    def shutdown(self):
+        self._header[_HDR_SHUTDOWN] = 1
+
+    # --- 各进程 ---
+    @property
+    def shutting_down(self) -> bool:
+        return bool(self._header[_HDR_SHUTDOWN])
+
+    @property
+    def recording(self) -> bool:
+        return bool(self._header[_HDR_RECORDING])
+
+    def current_session(self) -> Optional[int]:
+        """最近一次开始的会话 (可能已经停止)，还没有开始过任何会话时为 None。"""
+        session = int(self._header[_HDR_CURRENT])
+        return session if session >= 0 else None
+
+    def set_ready(self, role: str):
+        # 每个角色写自己的字段，而不是在共享的位掩码上做读-改-写，几个进程同时就绪时不会丢失彼此的标志
+        self._header[ROLE_READY_FIELDS[role]] = 1
+
+    def ready_roles(self) -> List[str]:
+        return [role for role, field in ROLE_READY_FIELDS.items() if self._header[field]]
+
+    def all_ready(self) -> bool:
+        return all(self._header[field] for field in ROLE_READY_FIELDS.values())
+
+    def get(self, session: int, field: int) -> int:
+        return int(self._rows[session % self.max_sessions, field])
+
+    def set(self, session: int, field: int, value: int):
+        self._rows[session % self.max_sessions, field] = value
+
+    def add(self, session: int, field: int, value: int = 1):
+        self._rows[session % self.max_sessions, field] += value
+
+    def contains(self, session: int, timestamp_ns: int) -> bool:
+        """时间戳落在会话的 [开始, 停止) 区间内。"""
+        row = self._rows[session % self.max_sessions]
+        return 0 < row[ROW_START_NS] <= timestamp_ns < row[ROW_STOP_NS]
+
+    def row(self, session: int) -> Dict[str, int]:
+        values = self._rows[session % self.max_sessions]
+        return {'start_ns': int(values[ROW_START_NS]), 'stop_ns': int(values[ROW_STOP_NS]),
+                'first_frame_ns': int(values[ROW_FIRST_FRAME_NS]), 'frames': int(values[ROW_FRAMES]),
+                'dropped': int(values[ROW_DROPPED]), 'first_encoded_ns': int(values[ROW_FIRST_ENCODED_NS]),
+                'encoded': int(values[ROW_ENCODED]), 'events': int(values[ROW_EVENTS])}
+
+    def release(self):
+        self._header = self._rows = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+# ==============================================================================
+# 常驻捕获进程: 帧源只创建、启动一次，空闲时持续读取并丢弃帧，开始命令后的下一帧即进入帧环
+# ==============================================================================
+def standby_capture_process(frame_ring, table: SessionTable, config, frame_transform=None):
+    try:
+        import psutil
+        p = psutil.Process(os.getpid())
+        p.nice(psutil.HIGH_PRIORITY_CLASS)
+    except Exception as e:
+        print(f"[常驻捕获] 提升优先级失败: {e}")
+
+    from frame_sources import create_frame_source
+    source_options = config.frame_source_options or {}
+    if config.capture_fps > 0:
+        source_options = paced_source_options(config.frame_source, source_options)
+    try:
+        source = create_frame_source(config.frame_source, config.region, **source_options)
+    except Exception as e:
+        print(f"[常驻捕获] 帧源创建失败: {e}")
+        frame_ring.close_writer()
+        return
+    source.start()
+    timer = DeadlineTimer(config.capture_fps) if config.capture_fps > 0 else None
+    if timer is not None:
+        timer.start()
+    block = config.ring_policy == 'block'
+    watched = None
+    mark_ready()
+    table.set_ready('capture')
+    print(f"[常驻捕获] 帧源 ({config.frame_source}) 已启动，等待开始命令。")
+
+    while not table.shutting_down and not source.finished:
+        if timer is not None:
+            timer.wait()
+        frame = source.read()
+        capture_time_ns = time.perf_counter_ns()
+        current = table.current_session()
+        if current != watched:
+            # 主进程只在上一个会话停止之后才开始新会话，换会话时上一个会话一定已经结束
+            if watched is not None:
+                table.set(watched, ROW_CAPTURE_DONE, 1)
+            watched = current
+        if watched is None or table.get(watched, ROW_CAPTURE_DONE):
+            continue
+        if capture_time_ns >= table.get(watched, ROW_STOP_NS):
+            table.set(watched, ROW_CAPTURE_DONE, 1)
+            continue
+        if frame is None or not table.contains(watched, capture_time_ns):
+            continue
+        if put_frame(frame_ring, frame_transform, frame, capture_time_ns, block=block):
+            if table.get(watched, ROW_FRAMES) == 0:
+                table.set(watched, ROW_FIRST_FRAME_NS, capture_time_ns)
+            table.add(watched, ROW_FRAMES)
+        else:
+            table.add(watched, ROW_DROPPED)
+
+    source.stop()
+    if watched is not None:
+        table.set(watched, ROW_CAPTURE_DONE, 1)
+    frame_ring.close_writer()
+    frame_ring.close()
+    table.release()
+    print("[常驻捕获] 进程即将退出。")
+
+
+# ==============================================================================
+# 常驻编码进程: 每个会话的 MP4 和编码器在 prepare 消息到达时就打开，开始录制时只剩编码本身
+# ==============================================================================
+class _WarmVideoOutput:
+    def __init__(self, av, session_dir: str, width: int, height: int, encoder_options: dict):
+        self.session_dir = session_dir
+        self.video_path = os.path.join(session_dir, VIDEO_FILENAME)
+        self.start_ns = None
+        self.frames = 0
+        self.container = av.open(self.video_path, mode='w')
+        self.stream = add_encoder_stream(self.container, width, height, encoder_options)
+        # 预先打开 libx264，第一帧到达时不再付出编码器初始化的时间
+        self.stream.codec_context.open()
+        self.index_writer = FrameIndexWriter(os.path.join(session_dir, FRAME_INDEX_FILENAME))
+
+    def _mux(self, packets):
+        for packet in packets:
+            self.index_writer.add_packet(packet)
+            self.container.mux(packet)
+
+    def encode(self, frame, capture_time_ns: int):
+        if self.start_ns is None:
+            self.start_ns = capture_time_ns
+            with open(os.path.join(self.session_dir, SYNC_TIME_FILENAME), 'w') as f:
+                f.write(str(capture_time_ns))
+        frame.pts = capture_time_ns - self.start_ns
+        self._mux(self.stream.encode(frame))
+        self.frames += 1
+
+    def close(self):
+        if self.frames:
+            self._mux(self.stream.encode())
+        self.container.close()
+        if self.frames:
+            self.index_writer.close(self.video_path)
+
+    def discard(self):
+        """未开始录制的会话: 关闭并删除预先创建的文件。"""
+        self.container.close()
+        if os.path.exists(self.video_path):
+            os.remove(self.video_path)
+
+
+def standby_encode_process(frame_ring, table: SessionTable, control: 'queue.Queue', width: int, height: int,
+                           encoder_options: dict = None):
+    """
+    control 队列中的消息: ('prepare', 会话序号, 会话目录) / ('discard', 会话序号)。
+    帧按 capture_time_ns 落在哪个会话的 [开始, 停止) 区间归属到该会话；帧环是先进先出的，
+    所以读到后一个会话的帧、或捕获进程已结束该会话且帧环为空时，前面的会话就可以关闭了。
+    """
+    import av
+
+    input_pix_fmt = pix_fmt_of_shape(frame_ring.frame_shape)
+    outputs: Dict[int, _WarmVideoOutput] = {}
+    mark_ready()
+    table.set_ready('encode')
+
+    def handle(message):
+        if message[0] == 'prepare':
+            _, session, session_dir = message
+            outputs[session] = _WarmVideoOutput(av, session_dir, width, height, encoder_options)
+        elif message[0] == 'discard':
+            output = outputs.pop(message[1], None)
+            if output is not None:
+                output.discard()
+
+    def drain_control(timeout: float = 0.0):
+        try:
+            handle(control.get(timeout=timeout) if timeout else control.get_nowait())
+            while True:
+                handle(control.get_nowait())
+        except queue.Empty:
+            pass
+
+    def finish(session: int):
+        output = outputs.pop(session)
+        output.close()
+        table.set(session, ROW_ENCODE_DONE, 1)
+        print(f"[常驻编码] 会话 {session} 完成: {output.frames} 帧 -> {output.video_path}")
+
+    def finish_completed():
+        for session in sorted(outputs):
+            if table.get(session, ROW_START_NS) and table.get(session, ROW_CAPTURE_DONE) and frame_ring.occupancy() == 0:
+                finish(session)
+
+    def session_of(capture_time_ns: int) -> Optional[int]:
+        for session in sorted(outputs):
+            if table.contains(session, capture_time_ns):
+                return session
+        return None
+
+    try:
+        while True:
+            drain_control()
+            try:
+                item = frame_ring.get(timeout=0.02)
+            except queue.Empty:
+                finish_completed()
+                continue
+            if item is None:
+                break
+            frame_data, capture_time_ns, seq = item
+
+            session = session_of(capture_time_ns)
+            if session is None:
+                # prepare 消息经过队列，可能比共享内存里的开始命令晚到一点
+                drain_control(timeout=1.0)
+                session = session_of(capture_time_ns)
+            if session is None:
+                print(f"[常驻编码] 警告: 帧 {capture_time_ns} 不属于任何已准备的会话，已丢弃。")
+                frame_ring.release(seq)
+                continue
+            for earlier in [s for s in sorted(outputs) if s < session and table.get(s, ROW_START_NS)]:
+                finish(earlier)
+
+            frame = av.VideoFrame.from_ndarray(frame_data, format=input_pix_fmt)
+            frame_ring.release(seq)
+            output = outputs[session]
+            output.encode(frame, capture_time_ns)
+            if output.frames == 1:
+                table.set(session, ROW_FIRST_ENCODED_NS, time.perf_counter_ns())
+            table.add(session, ROW_ENCODED)
+    except Exception as e:
+        print(f"\n[常驻编码] 编码出错: {e}")
+    finally:
+        for session in sorted(outputs):
+            if table.get(session, ROW_START_NS):
+                finish(session)
+            else:
+                outputs.pop(session).discard()
+        frame_ring.close()
+        table.release()
+        print("[常驻编码] 进程即将退出。")
+
+
+# ==============================================================================
+# 常驻输入监听: 事件按时间戳写入所属会话的事件日志，会话之间的事件丢弃
+# ==============================================================================
+class SessionEventRouter:
+    """监听进程内的会话事件日志集合；回调线程写事件，主循环调用 poll() 处理 prepare/discard 并关闭已结束的会话。"""
+
+    def __init__(self, table: SessionTable, control, log_format: str = 'csv', clock_source: str = 'perf_counter_ns'):
+        self.table = table
+        self.control = control
+        self.log_format = log_format
+        self.clock_source = clock_source
+        self._writers = {}
+        self._paths = {}
+        self._lock = threading.RLock()
+
+    def _events_path(self, session_dir: str) -> str:
+        name = EVENTS_BINARY_FILENAME if self.log_format == 'binary' else EVENTS_CSV_FILENAME
+        return os.path.join(session_dir, name)
+
+    def _session_of(self, timestamp_ns: int) -> Optional[int]:
+        for session in self._writers:
+            if self.table.contains(session, timestamp_ns):
+                return session
+        return None
+
+    def write_row(self, row) -> bool:
+        with self._lock:
+            session = self._session_of(row[0])
+            if session is None:
+                return False
+            self._writers[session].write_row(row)
+            self.table.add(session, ROW_EVENTS)
+            return True
+
+    def write_records(self, records: np.ndarray) -> int:
+        written = 0
+        with self._lock:
+            ts = records['timestamp_ns']
+            for session, writer in self._writers.items():
+                start, stop = self.table.get(session, ROW_START_NS), self.table.get(session, ROW_STOP_NS)
+                if not start:
+                    continue
+                mask = (ts >= start) & (ts < stop)
+                count = int(mask.sum())
+                if count:
+                    writer.write_records(records[mask])
+                    self.table.add(session, ROW_EVENTS, count)
+                    written += count
+        return written
+
+    def flush(self):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.flush()
+
+    def poll(self):
+        while True:
+            try:
+                message = self.control.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                if message[0] == 'prepare':
+                    _, session, session_dir = message
+                    self._paths[session] = self._events_path(session_dir)
+                    self._writers[session] = open_event_writer(self._paths[session], self.log_format, self.clock_source)
+                elif message[0] == 'discard':
+                    writer = self._writers.pop(message[1], None)
+                    if writer is not None:
+                        writer.close()
+                        os.remove(self._paths.pop(message[1]))
+
+        now = time.perf_counter_ns()
+        with self._lock:
+            for session in list(self._writers):
+                if self.table.get(session, ROW_START_NS) and now - self.table.get(session, ROW_STOP_NS) >= EVENT_GRACE_NS:
+                    self._close(session)
+                else:
+                    self._writers[session].flush()
+
+    def _close(self, session: int):
+        self._writers.pop(session).close()
+        self._paths.pop(session, None)
+        self.table.set(session, ROW_EVENTS_DONE, 1)
+
+    def close(self):
+        with self._lock:
+            for session in list(self._writers):
+                if self.table.get(session, ROW_START_NS):
+                    self._close(session)
+                else:
+                    self._writers.pop(session).close()
+                    os.remove(self._paths.pop(session))
+
+
+def standby_listener_process(config, table: SessionTable, control, commands, poll_interval: float = 0.02):
+    """
+    pynput 模式下同时监听侧键热键: 侧键2 / 侧键1 以按键时间戳向主进程发送 start / stop 命令 (commands 队列)。
+    native 模式只能通过控制套接字开始/停止。
+    """
+    if config.input_mode == 'native':
+        _standby_native_loop(config, table, control, poll_interval)
+    else:
+        _standby_pynput_loop(config, table, control, commands, poll_interval)
+    table.release()
+    print("[常驻监听] 进程即将退出。")
+
+
+def _standby_native_loop(config, table: SessionTable, control, poll_interval: float):
+    import input_module_all_inf as input_module
+
+    if config.mouse_coalesce_hz > 0 and hasattr(input_module, 'set_mouse_coalescing'):
+        input_module.set_mouse_coalescing(config.mouse_coalesce_hz)
+    router = SessionEventRouter(table, control, config.event_log_format, 'QueryPerformanceCounter')
+    input_module.start_buffered_listener(config.event_ring_capacity)
+    mark_ready()
+    table.set_ready('listener')
+    while not table.shutting_down:
+        router.poll()
+        records = input_module.drain(0)
+        if len(records):
+            router.write_records(records)
+        else:
+            time.sleep(min(config.drain_interval, poll_interval))
+    router.write_records(input_module.drain(0))
+    router.close()
+
+
+def _standby_pynput_loop(config, table: SessionTable, control, commands, poll_interval: float):
+    from pynput import mouse, keyboard
+
+    router = SessionEventRouter(table, control, config.event_log_format)
+    # 与 pynput_listener_process 相同: 回调只入队，由写入线程按时间戳分发到会话并写盘
+    queued = QueuedEventWriter(router, config.event_flush_interval, config.event_flush_batch)
+    hotkey = config.trigger == 'hotkey'
+
+    def on_key_action(key, action_type):
+        queued.put((time.perf_counter_ns(), action_type, key, None, None, None))
+
+    def on_click(x, y, button, pressed):
+        timestamp = time.perf_counter_ns()
+        if hotkey and pressed and button == mouse.Button.x2:
+            commands.put(('start', timestamp))
+        queued.put((timestamp, 'mouse_press' if pressed else 'mouse_release', x, y, button, None))
+        if hotkey and pressed and button == mouse.Button.x1:
+            commands.put(('stop', timestamp))
+
+    k_listener = keyboard.Listener(on_press=lambda key: on_key_action(key, 'key_press'),
+                                   on_release=lambda key: on_key_action(key, 'key_release'))
+    m_listener = mouse.Listener(on_click=on_click)
+    k_listener.start()
+    m_listener.start()
+    mark_ready()
+    table.set_ready('listener')
+    while not table.shutting_down:
+        router.poll()
+        time.sleep(poll_interval)
+    k_listener.stop()
+    m_listener.stop()
+    queued.close()
+    print(f"[常驻监听] 事件写入: {format_writer_stats(queued.stats())}")
+    router.close()
@@ -0,0 +1,122 @@
+import json
+import os
+import sys
+import time
+from typing import Dict
+
+# 录制相关的重量级依赖；每个进程角色只应该导入自己用到的那几个
+HEAVY_MODULES = ('av', 'dxcam', 'pynput', 'input_module_all_inf', 'psutil', 'pyarrow')
+
+_channel = None
+_role = None
+
+
+def _rss_bytes() -> int:
+    """当前进程的常驻内存 (Windows 为工作集)。只用标准库读取，不为测量而导入 psutil。"""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return 0
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def _sample(stage: str) -> dict:
+    return {'stage': stage, 'time_ns': time.perf_counter_ns(), 'modules': len(sys.modules),
+            'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules], 'rss': _rss_bytes()}
+
+
+def begin_role(role: str, channel):
+    """
+    子进程在进入角色函数之前调用: 记录此刻的状态 (解释器启动 + 反序列化参数 + 导入角色所在模块之后)，
+    角色函数在初始化完成后调用 mark_ready() 记录就绪时的状态。
+    """
+    global _channel, _role
+    _channel, _role = channel, role
+    channel.put((role, os.getpid(), _sample('entry')))
+
+
+def mark_ready():
+    """进程角色完成初始化 (帧源已创建 / 编码器已打开 / 监听已启动) 时调用；未开启剖析时什么也不做。"""
+    if _channel is not None:
+        _channel.put((_role, os.getpid(), _sample('ready')))
+
+
+class StartupProfiler:
+    """主进程侧: 记录每个子进程的 start() 时间，收集子进程发回的采样，生成启动报告。"""
+
+    def __init__(self):
+        import multiprocessing as mp
+        self.channel = mp.Queue()
+        self.spawn_ns: Dict[str, int] = {}
+        self.samples: Dict[str, dict] = {}
+
+    def started(self, role: str, spawn_ns: int):
+        self.spawn_ns[role] = spawn_ns
+
+    def collect(self, timeout: float = 0.1):
+        import queue
+        while True:
+            try:
+                role, pid, sample = self.channel.get(timeout=timeout)
+            except queue.Empty:
+                return
+            self.samples.setdefault(role, {'pid': pid})[sample['stage']] = sample
+
+    def report(self) -> dict:
+        self.collect()
+        main = _sample('main')
+        roles = {}
+        for role, spawn_ns in self.spawn_ns.items():
+            entry = self.samples.get(role, {}).get('entry')
+            ready = self.samples.get(role, {}).get('ready')
+            roles[role] = {
+                'pid': self.samples.get(role, {}).get('pid'),
+                'entry_ms': (entry['time_ns'] - spawn_ns) / 1e6 if entry else None,
+                'ready_ms': (ready['time_ns'] - spawn_ns) / 1e6 if ready else None,
+                'entry_rss_mb': entry['rss'] / 2**20 if entry else None,
+                'ready_rss_mb': ready['rss'] / 2**20 if ready else None,
+                'entry_modules': entry['modules'] if entry else None,
+                'heavy_modules': (ready or entry or {}).get('heavy_modules'),
+            }
+        return {'main': {'rss_mb': main['rss'] / 2**20, 'modules': main['modules'], 'heavy_modules': main['heavy_modules']},
+                'roles': roles}
+
+    def write(self, path: str, report: dict):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def format_startup_report(report: dict) -> str:
+    def ms(value):
+        return f"{value:.0f}" if value is not None else '-'
+
+    def mb(value):
+        return f"{value:.0f}" if value is not None else '-'
+
+    main = report['main']
+    lines = ["[启动剖析] 进程       进入(ms)  就绪(ms)  RSS进入/就绪(MB)  模块数  已导入的重量级依赖",
+             f"[启动剖析] {'main':<10}{'-':>8}{'-':>10}{mb(main['rss_mb']):>11}/{'-':<6}{main['modules']:>7}  "
+             f"{', '.join(main['heavy_modules']) or '-'}"]
+    for role, r in report['roles'].items():
+        lines.append(f"[启动剖析] {role:<10}{ms(r['entry_ms']):>8}{ms(r['ready_ms']):>10}"
+                     f"{mb(r['entry_rss_mb']):>11}/{mb(r['ready_rss_mb']):<6}"
+                     f"{r['entry_modules'] if r['entry_modules'] is not None else '-':>7}  "
+                     f"{', '.join(r['heavy_modules'] or []) or '-'}")
+    return "\n".join(lines)
@@ -0,0 +1,314 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from binary_event_log import open_event_writer
+from frame_ring_buffer import SharedFrameRing
+from frame_sources import SyntheticFrameSource
+from frame_transform import frame_shape
+from native_events import (EVENT_KEY_DOWN, EVENT_KEY_UP, EVENT_MOUSE_DOWN, EVENT_MOUSE_MOVE, EVENT_MOUSE_UP,
+                           NATIVE_EVENT_DTYPE)
+from session_layout import (EVENTS_BINARY_FILENAME, EVENTS_CSV_FILENAME, FRAME_INDEX_FILENAME, SYNC_TIME_FILENAME,
+                            VIDEO_FILENAME)
+
+# 录制端和解码端热路径的回归基准: 全部输入都是生成的 (合成帧、1000 Hz 合成事件日志、纳秒时间基准的短视频)，
+# 不需要屏幕、输入设备或已有的录像，可以在无桌面的 Linux 上运行。
+# 结果写成 JSON；指定 --baseline 时与保存的基线逐项比较，任一路径的耗时超过基线的 (1 + threshold) 倍则以状态码 1 退出。
+
+# --- 默认参数 ---
+DEFAULT_LENGTHS = [10, 60, 300]  # 会话长度（秒）
+DEFAULT_REPEATS = 3              # 每项重复次数，取中位数
+DEFAULT_THRESHOLD = 0.25         # 比基线慢 25% 以上视为回归
+MIN_COMPARABLE_SEC = 0.01        # 基线耗时低于此值的项只报告不判定，计时噪声会超过阈值
+FIXTURE_FPS = 120
+EVENT_RATE_HZ = 1000             # 合成事件日志的事件频率 (鼠标移动 + 按键/点击)
+DRAIN_BATCH = 10                 # 原生批量模式每次取出的事件数 (1000 Hz × 10 ms drain_interval)
+FIXTURE_VIDEO_SIZE = (128, 72)   # 解码端用的短视频尺寸，只关心时间戳
+ENCODE_SIZE = (1280, 720)        # encode_process 吞吐项的帧尺寸
+ENCODE_FRAMES = 240
+ENCODER_OPTIONS = {'preset': 'ultrafast', 'crf': '18'}
+START_NS = 1_000_000_000_000     # 合成会话第一帧的绝对时间戳
+
+
+# ==============================================================================
+# 合成输入
+# ==============================================================================
+def synthetic_frame_times(length_sec: float, fps: float = FIXTURE_FPS, seed: int = 0) -> np.ndarray:
+    """绝对帧时间戳: 按帧率递增，叠加 ±0.3 ms 的抖动 (保持严格递增)。"""
+    rng = np.random.default_rng(seed)
+    count = int(length_sec * fps)
+    period = 1e9 / fps
+    times = START_NS + (np.arange(count) * period + rng.uniform(-3e5, 3e5, count)).astype(np.int64)
+    times[0] = START_NS
+    return times
+
+
+def synthetic_event_records(length_sec: float, rate_hz: float = EVENT_RATE_HZ, seed: int = 1) -> np.ndarray:
+    """
+    原生模块格式的事件记录 (NATIVE_EVENT_DTYPE): 以鼠标移动为主，每 50 个事件插入一次按键按下/抬起，每 200 个插入一次点击。
+    时间戳从第一帧前 50 ms 开始，覆盖整个会话。
+    """
+    rng = np.random.default_rng(seed)
+    count = int(length_sec * rate_hz)
+    records = np.zeros(count, dtype=NATIVE_EVENT_DTYPE)
+    period = 1e9 / rate_hz
+    records['timestamp_ns'] = START_NS - 50_000_000 + (np.arange(count) * period).astype(np.int64)
+    records['first_timestamp_ns'] = records['timestamp_ns']
+    records['samples'] = 1
+    records['type'] = EVENT_MOUSE_MOVE
+    records['dx'] = rng.integers(-5, 6, count)
+    records['dy'] = rng.integers(-5, 6, count)
+    records['abs_x'] = np.clip(960 + np.cumsum(records['dx']), 0, 1919)
+    records['abs_y'] = np.clip(540 + np.cumsum(records['dy']), 0, 1079)
+    index = np.arange(count)
+    records['type'][index % 50 == 0] = EVENT_KEY_DOWN
+    records['type'][index % 50 == 1] = EVENT_KEY_UP
+    records['button'][index % 50 < 2] = 0x41 + (index[index % 50 < 2] // 50) % 26  # 按键的虚拟键码放在 button 字段
+    records['type'][index % 200 == 25] = EVENT_MOUSE_DOWN
+    records['type'][index % 200 == 26] = EVENT_MOUSE_UP
+    records['button'][(index % 200 == 25) | (index % 200 == 26)] = 1
+    return records
+
+
+def _quiet_encode_process(*args, **kwargs):
+    from recorder.encode import encode_process
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        encode_process(*args, **kwargs)
+
+
+def run_encode(session_dir: str, width: int, height: int, frame_times: np.ndarray, encoder_options: dict) -> dict:
+    """
+    用 recorder.encode.encode_process (独立进程) 把合成帧编码为 session_dir 下的 final_output.mp4、同步时间和帧索引，
+    帧环使用阻塞策略，不丢帧。返回编码进程的报告 (encode_fps、elapsed_sec 等)。
+    """
+    report_path = os.path.join(session_dir, "encode_report.json")
+    frame_ring = SharedFrameRing(frame_shape(width, height), slots=32, policy='block')
+    proc = mp.Process(target=_quiet_encode_process,
+                      args=(frame_ring, os.path.join(session_dir, VIDEO_FILENAME),
+                            os.path.join(session_dir, SYNC_TIME_FILENAME), width, height, encoder_options, report_path,
+                            os.path.join(session_dir, FRAME_INDEX_FILENAME)))
+    proc.start()
+    source = SyntheticFrameSource(width, height, fps=0, pattern='box')
+    source.start()
+    for capture_time_ns in frame_times.tolist():
+        frame_ring.put(source.read(), capture_time_ns, block=True)
+    frame_ring.close_writer()
+    proc.join()
+    frame_ring.close()
+    frame_ring.unlink()
+    with open(report_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_event_log(path: str, log_format: str, records: np.ndarray, per_row: bool = False):
+    """
+    按录制时的方式写事件日志: per_row=False 为原生批量模式 (每 DRAIN_BATCH 条 write_records 一次并 flush)，
+    per_row=True 为 pynput 回调 (逐条 write_row)。
+    """
+    from native_events import records_to_rows
+
+    with open_event_writer(path, log_format) as writer:
+        if per_row:
+            for row in records_to_rows(records):
+                writer.write_row(row)
+            return
+        for start in range(0, len(records), DRAIN_BATCH):
+            writer.write_records(records[start:start + DRAIN_BATCH])
+            writer.flush()
+
+
+# ==============================================================================
+# 计时
+# ==============================================================================
+def time_case(fn: Callable[[], None], repeats: int) -> List[float]:
+    """运行 fn repeats 次，返回每次的耗时（秒）。被测函数的打印输出被丢弃。"""
+    durations = []
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            fn()
+            durations.append(time.perf_counter() - t0)
+    return durations
+
+
+def case_result(name: str, items: int, unit: str, durations: List[float]) -> dict:
+    median = statistics.median(durations)
+    return {'name': name, 'items': int(items), 'unit': unit, 'seconds': median, 'min_seconds': min(durations),
+            'rate': items / median if median > 0 else 0.0}
+
+
+def bench_encode(work_dir: str, repeats: int) -> dict:
+    width, height = ENCODE_SIZE
+    frame_times = synthetic_frame_times(ENCODE_FRAMES / FIXTURE_FPS)
+    session_dir = os.path.join(work_dir, "encode")
+    os.makedirs(session_dir, exist_ok=True)
+    # 进程启动和 PyAV 导入不计入: 取编码进程报告里 第一帧出队 -> 编码完成 的时间
+    durations = [run_encode(session_dir, width, height, frame_times, ENCODER_OPTIONS)['elapsed_sec']
+                 for _ in range(repeats)]
+    return case_result(f"encode_process/{width}x{height}", len(frame_times), 'frames', durations)
+
+
+def bench_session(work_dir: str, length_sec: int, repeats: int) -> List[dict]:
+    """一种会话长度下的事件写入、读取、对齐和 CSV 输出；同时生成解码端使用的视频/事件日志。"""
+    from videoandevents_decoder import (correlate_events_to_frames, read_input_events, read_sync_time,
+                                        read_video_timestamps, write_output_csv)
+
+    session_dir = os.path.join(work_dir, f"session_{length_sec}s")
+    os.makedirs(session_dir, exist_ok=True)
+    tag = f"{length_sec}s"
+    results = []
+
+    records = synthetic_event_records(length_sec)
+    csv_path = os.path.join(session_dir, EVENTS_CSV_FILENAME)
+    bin_path = os.path.join(session_dir, EVENTS_BINARY_FILENAME)
+    row_path = os.path.join(session_dir, "events_rows.csv")
+    for name, path, log_format, per_row in (('event_write/native_csv', csv_path, 'csv', False),
+                                            ('event_write/native_binary', bin_path, 'binary', False),
+                                            ('event_write/pynput_rows_csv', row_path, 'csv', True)):
+        durations = time_case(lambda: write_event_log(path, log_format, records, per_row), repeats)
+        results.append(case_result(f"{name}/{tag}", len(records), 'events', durations))
+
+    frame_times = synthetic_frame_times(length_sec)
+    width, height = FIXTURE_VIDEO_SIZE
+    run_encode(session_dir, width, height, frame_times, ENCODER_OPTIONS)
+    video_path = os.path.join(session_dir, VIDEO_FILENAME)
+    index_path = os.path.join(session_dir, FRAME_INDEX_FILENAME)
+
+    for name, path in (('read_input_events/csv', csv_path), ('read_input_events/binary', bin_path)):
+        durations = time_case(lambda: read_input_events(path), repeats)
+        results.append(case_result(f"{name}/{tag}", len(records), 'events', durations))
+    durations = time_case(lambda: read_video_timestamps(video_path, index_path), repeats)
+    results.append(case_result(f"read_video_timestamps/index/{tag}", len(frame_times), 'frames', durations))
+    durations = time_case(lambda: read_video_timestamps(video_path), repeats)
+    results.append(case_result(f"read_video_timestamps/demux/{tag}", len(frame_times), 'frames', durations))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        frames_relative = read_video_timestamps(video_path, index_path)
+        events = read_input_events(csv_path)
+        video_start_ns = read_sync_time(os.path.join(session_dir, SYNC_TIME_FILENAME))
+    if frames_relative != (frame_times - video_start_ns).tolist():
+        raise RuntimeError(f"{tag}: 视频中的帧时间戳与写入的不一致")
+
+    processed = []
+    durations = time_case(lambda: processed.append(correlate_events_to_frames(frames_relative, events, video_start_ns)),
+                          repeats)
+    results.append(case_result(f"correlate_events_to_frames/{tag}", len(events), 'events', durations))
+    output_path = os.path.join(session_dir, "frame_by_frame_analysis.csv")
+    durations = time_case(lambda: write_output_csv(output_path, processed[-1]), repeats)
+    results.append(case_result(f"write_output_csv/{tag}", len(frames_relative), 'frames', durations))
+    return results
+
+
+def run_suite(work_dir: str, lengths: List[int], repeats: int, cases: Optional[List[str]] = None) -> dict:
+    def wanted(name: str) -> bool:
+        return not cases or any(name.startswith(c) or c.startswith(name) for c in cases)
+
+    results = []
+    if wanted('encode_process'):
+        print(f"[基准] encode_process {ENCODE_SIZE[0]}x{ENCODE_SIZE[1]} × {ENCODE_FRAMES} 帧 ...")
+        results.append(bench_encode(work_dir, repeats))
+    for length_sec in lengths:
+        print(f"[基准] {length_sec} 秒会话 ({length_sec * EVENT_RATE_HZ} 个事件，{length_sec * FIXTURE_FPS} 帧) ...")
+        results.extend(bench_session(work_dir, length_sec, repeats))
+    # 各会话长度的项共用同一组生成的输入，只在最后按名称筛选
+    results = [r for r in results if wanted(r['name'])]
+    return {
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+                    'python': platform.python_version()},
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'repeats': repeats,
+        'results': {r['name']: r for r in results},
+    }
+
+
+# ==============================================================================
+# 与基线比较
+# ==============================================================================
+def compare_to_baseline(current: dict, baseline: dict, threshold: float) -> List[dict]:
+    """逐项比较中位耗时，返回每项的 ratio (当前 / 基线) 和是否回归。只在一边出现的项不参与比较。"""
+    comparisons = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['seconds'] / base['seconds'] if base['seconds'] > 0 else float('inf')
+        comparable = base['seconds'] >= MIN_COMPARABLE_SEC
+        comparisons.append({'name': name, 'baseline_seconds': base['seconds'], 'seconds': result['seconds'],
+                            'ratio': ratio, 'regressed': comparable and ratio > 1 + threshold})
+    return comparisons
+
+
+def print_results(current: dict, comparisons: Optional[List[dict]] = None):
+    by_name = {c['name']: c for c in comparisons or []}
+    print(f"\n{'路径':<44}{'耗时(ms)':>12}{'吞吐':>20}{'基线(ms)':>12}{'比值':>8}")
+    for name, r in current['results'].items():
+        line = f"{name:<44}{r['seconds'] * 1e3:>12.2f}{r['rate']:>12.0f} {r['unit']:<7}"
+        c = by_name.get(name)
+        if c is not None:
+            line += f"{c['baseline_seconds'] * 1e3:>12.2f}{c['ratio']:>8.2f}"
+            if c['regressed']:
+                line += "  回归"
+        print(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="录制/解码热路径的回归基准 (全部使用生成的输入，可无桌面运行)")
+    parser.add_argument('--lengths', nargs='+', type=int, default=DEFAULT_LENGTHS, help="会话长度（秒）")
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help="每项重复次数，取中位数")
+    parser.add_argument('--cases', nargs='+', help="只运行名称以这些前缀开头的项，例如 read_input_events correlate")
+    parser.add_argument('--output', help="把结果写入 JSON 文件")
+    parser.add_argument('--baseline', help="与该基线 JSON 比较，有回归时以状态码 1 退出")
+    parser.add_argument('--save-baseline', help="把本次结果保存为基线 JSON")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="耗时超过基线的 (1 + threshold) 倍视为回归")
+    parser.add_argument('--work-dir', help="保留生成的输入和输出的目录 (默认使用临时目录并在结束后删除)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        current = run_suite(work_dir, args.lengths, args.repeats, args.cases)
+
+    comparisons = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('machine', {}).get('processor') != current['machine']['processor'] or \
+                baseline.get('machine', {}).get('cpu_count') != current['machine']['cpu_count']:
+            print(f"[基准] 警告: 基线是在另一台机器上生成的 ({baseline.get('machine')})，比较结果仅供参考。")
+        comparisons = compare_to_baseline(current, baseline, args.threshold)
+        current['comparison'] = {'baseline': args.baseline, 'threshold': args.threshold, 'cases': comparisons}
+    print_results(current, comparisons)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(current, f, ensure_ascii=False, indent=2)
+            print(f"[基准] 结果已写入 {path}")
+
+    regressed = [c for c in comparisons or [] if c['regressed']]
+    if regressed:
+        print(f"\n[基准] {len(regressed)} 项比基线慢 {args.threshold:.0%} 以上:")
+        for c in regressed:
+            print(f"  - {c['name']}: {c['baseline_seconds'] * 1e3:.2f} ms -> {c['seconds'] * 1e3:.2f} ms "
+                  f"({c['ratio']:.2f}x)")
+        return 1
+    if comparisons is not None:
+        print(f"\n[基准] 与基线相比没有超过 {args.threshold:.0%} 的回归 ({len(comparisons)} 项)。")
+    return 0
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    sys.exit(main())
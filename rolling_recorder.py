@@ -0,0 +1,398 @@
+import json
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from binary_event_log import open_event_writer
+from encoder_stream import add_encoder_stream
+from frame_dedup import SkippedFrameLog
+from frame_index import FrameIndexWriter
+from frame_ring_buffer import attach_shared_memory
+from frame_transform import pix_fmt_of_shape
+from session_layout import (FRAME_INDEX_FILENAME, SESSION_MANIFEST_FILENAME, SKIPPED_FRAMES_FILENAME,
+                            SYNC_TIME_FILENAME, VIDEO_FILENAME, segment_dirname)
+
+# --- 默认参数 ---
+MAX_SEGMENTS = 1 << 16          # 分段边界表的容量，1 秒一段也足够录制 18 小时
+LATE_EVENT_GRACE_NS = 1_000_000_000  # 分段结束后再保留其事件文件打开的时间，容纳延迟送达的事件
+
+# --- 共享头部字段在 int64 数组中的下标 ---
+_HDR_COUNT = 0          # 已发布的分段边界数 (捕获进程独占写)
+_HDR_HORIZON = 1        # 捕获进程已处理到的 capture_time_ns，早于它的事件可以确定所属分段
+_HDR_BYTES_SEGMENT = 2  # 编码进程正在写的分段序号 (编码进程独占写)
+_HDR_BYTES = 3          # 该分段已写出的字节数
+_HDR_FIELDS = 8
+_CLOSED_HORIZON = np.iinfo(np.int64).max
+
+
+class SegmentSchedule:
+    """
+    滚动录制的分段边界表，放在 multiprocessing.shared_memory 中，可以直接作为 mp.Process 的参数传递。
+
+    分段由捕获进程决定: 距当前分段第一帧超过 segment_seconds，或编码进程报告当前分段已超过 segment_bytes 时，
+    下一帧成为新分段的第一帧，其 capture_time_ns 作为边界发布出来。编码进程按边界切换输出文件，
+    事件写入进程按同一张表把事件分到各分段 (事件归属与解码端一致: 时间戳早于下一段第一帧的事件属于上一段)。
+    horizon 保证事件写入进程只在边界确定之后才分配事件。
+    """
+
+    def __init__(self, segment_seconds: float = 0, segment_bytes: int = 0, max_segments: int = MAX_SEGMENTS):
+        if segment_seconds <= 0 and segment_bytes <= 0:
+            raise ValueError("segment_seconds 和 segment_bytes 至少要指定一个")
+        self.segment_ns = int(segment_seconds * 1_000_000_000)
+        self.segment_bytes = int(segment_bytes)
+        self.max_segments = int(max_segments)
+        self._shm = shared_memory.SharedMemory(create=True, size=(_HDR_FIELDS + self.max_segments) * 8)
+        self._owner = True
+        self._map_views()
+        self._header[:] = 0
+        self._header[_HDR_BYTES_SEGMENT] = -1
+
+    def _map_views(self):
+        buf = self._shm.buf
+        self._header = np.ndarray((_HDR_FIELDS,), dtype=np.int64, buffer=buf, offset=0)
+        self._boundaries = np.ndarray((self.max_segments,), dtype=np.int64, buffer=buf, offset=_HDR_FIELDS * 8)
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'segment_ns': self.segment_ns, 'segment_bytes': self.segment_bytes,
+                'max_segments': self.max_segments}
+
+    def __setstate__(self, state):
+        self.segment_ns = state['segment_ns']
+        self.segment_bytes = state['segment_bytes']
+        self.max_segments = state['max_segments']
+        self._shm = attach_shared_memory(state['name'])
+        self._owner = False
+        self._map_views()
+
+    # --- 捕获进程 ---
+    def begin_frame(self, capture_time_ns: int) -> bool:
+        """在帧写入帧环之前调用。需要开始新分段时先发布边界 (编码进程读到这一帧时边界已经可见)，返回 True。"""
+        count = int(self._header[_HDR_COUNT])
+        if count == 0:
+            roll = True
+        elif count >= self.max_segments:
+            roll = False
+        else:
+            start = int(self._boundaries[count - 1])
+            roll = (self.segment_ns > 0 and capture_time_ns - start >= self.segment_ns) or \
+                   (self.segment_bytes > 0 and int(self._header[_HDR_BYTES_SEGMENT]) == count - 1
+                    and int(self._header[_HDR_BYTES]) >= self.segment_bytes)
+        if roll:
+            self._boundaries[count] = capture_time_ns
+            self._header[_HDR_COUNT] = count + 1
+        return roll
+
+    def end_frame(self, capture_time_ns: int, accepted: bool, rolled: bool):
+        """帧写入帧环之后调用。帧被丢弃时撤回刚发布的边界，让下一个被接受的帧成为分段的第一帧。"""
+        if rolled and not accepted:
+            self._header[_HDR_COUNT] -= 1
+        self._header[_HDR_HORIZON] = capture_time_ns
+
+    def close(self):
+        """捕获结束: 之后的所有事件都属于最后一个分段。"""
+        self._header[_HDR_HORIZON] = _CLOSED_HORIZON
+
+    # --- 编码进程 ---
+    def report_bytes(self, segment: int, nbytes: int):
+        self._header[_HDR_BYTES] = nbytes
+        self._header[_HDR_BYTES_SEGMENT] = segment
+
+    # --- 读取 ---
+    def boundaries(self) -> np.ndarray:
+        return self._boundaries[:int(self._header[_HDR_COUNT])].copy()
+
+    def horizon(self) -> int:
+        return int(self._header[_HDR_HORIZON])
+
+    def segment_of(self, timestamp_ns: int) -> int:
+        """时间戳所属的分段序号；早于第一段的时间戳 (例如录制开始前的事件) 归入第 0 段，还没有分段时返回 -1。"""
+        count = int(self._header[_HDR_COUNT])
+        if count == 0:
+            return -1
+        return max(int(np.searchsorted(self._boundaries[:count], timestamp_ns, side='right')) - 1, 0)
+
+    def current_segment(self) -> int:
+        return int(self._header[_HDR_COUNT]) - 1
+
+    def release(self):
+        self._header = self._boundaries = None
+        self._shm.close()
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+
+
+def segment_dir(session_dir: str, segment: int) -> str:
+    path = os.path.join(session_dir, segment_dirname(segment))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# ==============================================================================
+# 会话清单
+# ==============================================================================
+def load_session_manifest(session_dir: str) -> Optional[dict]:
+    path = os.path.join(session_dir, SESSION_MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_session_manifest(session_dir: str, manifest: dict):
+    """先写临时文件再替换，崩溃时清单总是完整的上一版本。"""
+    path = os.path.join(session_dir, SESSION_MANIFEST_FILENAME)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def completed_segment_dirs(session_dir: str) -> List[str]:
+    """清单中已完整写出的分段目录 (崩溃时最后一个打开的分段不包括在内)，每个都是独立的会话目录。"""
+    manifest = load_session_manifest(session_dir) or {'segments': []}
+    return [os.path.join(session_dir, seg['dir']) for seg in manifest['segments'] if seg.get('complete')]
+
+
+# ==============================================================================
+# 编码进程: 与 encode_process 相同的帧环输入，按分段边界切换到新的 MP4
+# ==============================================================================
+class _SegmentOutput:
+    def __init__(self, session_dir: str, index: int, width: int, height: int, encoder_options: dict,
+                 first_capture_ns: int):
+        import av
+
+        self.index = index
+        self.dir = segment_dir(session_dir, index)
+        self.video_path = os.path.join(self.dir, VIDEO_FILENAME)
+        self.start_ns = first_capture_ns
+        self.end_ns = first_capture_ns
+        self.frames = 0
+        self.bytes = 0
+        with open(os.path.join(self.dir, SYNC_TIME_FILENAME), 'w') as f:
+            f.write(str(first_capture_ns))
+
+        self.container = av.open(self.video_path, mode='w')
+        self.stream = add_encoder_stream(self.container, width, height, encoder_options)
+        self.index_writer = FrameIndexWriter(os.path.join(self.dir, FRAME_INDEX_FILENAME))
+
+    def _mux(self, packets):
+        for packet in packets:
+            self.index_writer.add_packet(packet)
+            self.bytes += packet.size
+            self.container.mux(packet)
+
+    def encode(self, frame, capture_time_ns: int):
+        frame.pts = capture_time_ns - self.start_ns
+        self._mux(self.stream.encode(frame))
+        self.frames += 1
+        self.end_ns = capture_time_ns
+
+    def close(self):
+        self._mux(self.stream.encode())
+        self.container.close()
+        self.index_writer.close(self.video_path)
+
+    def manifest_entry(self, complete: bool) -> dict:
+        return {'index': self.index, 'dir': os.path.basename(self.dir), 'start_ns': self.start_ns,
+                'end_ns': self.end_ns, 'frames': self.frames, 'bytes': self.bytes, 'complete': complete}
+
+
+def rolling_encode_process(frame_ring, schedule: SegmentSchedule, session_dir: str, width: int, height: int,
+                           encoder_options: dict = None, telemetry=None):
+    """
+    滚动录制的编码进程。每个分段单独打开一个编码器 (从关键帧开始，可以独立解码)，
+    写入 session_dir/segment_XXXXXX/ 下的 final_output.mp4、video_start_time.txt (该段第一帧的 capture_time_ns)
+    和 frame_index.npy，布局与单文件录制的会话目录相同，解码、导出和批处理可以按分段并行。
+    每开始和结束一个分段都会更新 session_dir 下的会话清单；崩溃时只丢失当前打开的分段。
+    """
+    import av
+
+    os.makedirs(session_dir, exist_ok=True)
+    manifest = {'segment_seconds': schedule.segment_ns / 1e9, 'segment_bytes': schedule.segment_bytes,
+                'segments': []}
+    save_session_manifest(session_dir, manifest)
+    print(f"[滚动编码] --- 等待第一帧以开始编码 (分段: {schedule.segment_ns / 1e9:g} 秒 / "
+          f"{schedule.segment_bytes / 2**20:g} MB，0 表示不限) ---")
+
+    current: Optional[_SegmentOutput] = None
+    input_pix_fmt = pix_fmt_of_shape(frame_ring.frame_shape)
+
+    def finish_segment():
+        current.close()
+        manifest['segments'][-1] = current.manifest_entry(complete=True)
+        save_session_manifest(session_dir, manifest)
+        print(f"\n[滚动编码] 分段 {current.index} 完成: {current.frames} 帧, {current.bytes / 2**20:.1f} MB")
+
+    try:
+        while True:
+            item = frame_ring.get()
+            if item is None:
+                print("\n[滚动编码] 收到结束信号。")
+                break
+            frame_data, capture_time_ns, seq = item
+
+            segment = schedule.segment_of(capture_time_ns)
+            if current is None or segment != current.index:
+                if current is not None:
+                    finish_segment()
+                current = _SegmentOutput(session_dir, segment, width, height, encoder_options, capture_time_ns)
+                manifest['segments'].append(current.manifest_entry(complete=False))
+                save_session_manifest(session_dir, manifest)
+
+            # from_ndarray 会把共享内存中的像素拷贝进 AVFrame，之后即可归还槽位
+            frame = av.VideoFrame.from_ndarray(frame_data, format=input_pix_fmt)
+            enqueue_ns = frame_ring.enqueue_time_ns(seq) if telemetry is not None else 0
+            frame_ring.release(seq)
+            current.encode(frame, capture_time_ns)
+            schedule.report_bytes(current.index, current.bytes)
+            if telemetry is not None:
+                telemetry.add('encoded_frames')
+                telemetry.observe('enqueue_to_encode', time.perf_counter_ns() - enqueue_ns)
+
+        if current is not None:
+            finish_segment()
+        print(f"[滚动编码] --- 编码完成，共 {len(manifest['segments'])} 个分段，清单: "
+              f"{os.path.join(session_dir, SESSION_MANIFEST_FILENAME)} ---")
+    except Exception as e:
+        print(f"\n[滚动编码] 编码出错: {e}")
+    finally:
+        frame_ring.close()
+
+
+# ==============================================================================
+# 事件写入: 与 BinaryEventWriter / CsvEventWriter 接口相同，按分段边界把事件写入各分段目录
+# ==============================================================================
+class RollingEventWriter:
+    """
+    output_path 给出会话目录和事件日志文件名，例如 .../session/input_events.csv，
+    事件实际写入 .../session/segment_XXXXXX/input_events.csv。时间戳不早于 horizon 的事件先留在内存中，
+    等捕获进程处理到更晚的帧 (边界确定) 后再分配，通常只滞留一帧的时间。
+    分段结束 LATE_EVENT_GRACE_NS 之后关闭其事件文件；更晚送达的属于已关闭分段的事件写入下一个分段并计数。
+    """
+
+    def __init__(self, output_path: str, schedule: SegmentSchedule, log_format: str = 'csv',
+                 clock_source: str = 'perf_counter_ns'):
+        self.session_dir, self.filename = os.path.split(output_path)
+        self.schedule = schedule
+        self.log_format = log_format
+        self.clock_source = clock_source
+        self.late_events = 0
+        self._rows: List[list] = []
+        self._records: List[np.ndarray] = []
+        self._writers: Dict[int, object] = {}
+        self._closed_through = -1
+        # pynput 的键盘和鼠标监听器在各自的线程里回调，写入需要互斥
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows) + sum(len(r) for r in self._records)
+
+    def _writer(self, segment: int):
+        if segment <= self._closed_through:
+            self.late_events += 1
+            segment = self._closed_through + 1
+        writer = self._writers.get(segment)
+        if writer is None:
+            path = os.path.join(segment_dir(self.session_dir, segment), self.filename)
+            writer = self._writers[segment] = open_event_writer(path, self.log_format, self.clock_source)
+        return writer
+
+    def _assign(self, final: bool = False):
+        """把边界已确定的事件写入所属分段。"""
+        boundaries = self.schedule.boundaries()
+        if len(boundaries) == 0 and not final:
+            return
+        horizon = _CLOSED_HORIZON if final else self.schedule.horizon()
+
+        if self._rows:
+            ready = [row for row in self._rows if int(row[0]) < horizon]
+            if ready:
+                self._rows = [row for row in self._rows if int(row[0]) >= horizon]
+                segments = np.searchsorted(boundaries, [int(row[0]) for row in ready], side='right') - 1
+                for row, segment in zip(ready, segments.tolist()):
+                    self._writer(max(segment, 0)).write_row(row)
+
+        if self._records:
+            records = np.concatenate(self._records) if len(self._records) > 1 else self._records[0]
+            ready = records['timestamp_ns'] < horizon
+            self._records = [records[~ready]] if not ready.all() else []
+            records = records[ready]
+            if len(records):
+                segments = np.maximum(np.searchsorted(boundaries, records['timestamp_ns'], side='right') - 1, 0)
+                for segment in np.unique(segments).tolist():
+                    self._writer(segment).write_records(records[segments == segment])
+
+        # 分段结束足够久之后关闭其事件文件
+        for segment in sorted(self._writers):
+            if segment + 1 < len(boundaries) and horizon - int(boundaries[segment + 1]) > LATE_EVENT_GRACE_NS:
+                self._writers.pop(segment).close()
+                self._closed_through = max(self._closed_through, segment)
+
+    def write_row(self, row):
+        with self._lock:
+            self._rows.append(row)
+            self._assign()
+
+    def write_records(self, records: np.ndarray):
+        with self._lock:
+            self._records.append(records)
+            self._assign()
+
+    def flush(self):
+        with self._lock:
+            self._assign()
+            for writer in self._writers.values():
+                writer.flush()
+
+    def close(self):
+        with self._lock:
+            self._assign(final=True)
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+        if self.late_events:
+            print(f"[滚动录制] {self.late_events} 个事件在其分段关闭后才送达，已写入下一个分段。")
+
+
+def open_session_event_writer(output_path: str, log_format: str = 'csv', clock_source: str = 'perf_counter_ns',
+                              schedule: Optional[SegmentSchedule] = None):
+    """录制脚本使用的事件写入器: 指定 schedule 时按分段写入，否则与 open_event_writer 相同。"""
+    if schedule is not None:
+        return RollingEventWriter(output_path, schedule, log_format, clock_source)
+    return open_event_writer(output_path, log_format, clock_source)
+
+
+class RollingSkippedFrameLog:
+    """静止帧旁路文件的滚动版本: 跳过的帧写入捕获进程当前所在分段的 skipped_frames.txt。"""
+
+    def __init__(self, session_dir: str, schedule: SegmentSchedule):
+        self.session_dir = session_dir
+        self.schedule = schedule
+        self._segment = None
+        self._log: Optional[SkippedFrameLog] = None
+
+    def append(self, capture_time_ns: int):
+        segment = max(self.schedule.current_segment(), 0)
+        if segment != self._segment:
+            if self._log is not None:
+                self._log.close()
+            self._log = SkippedFrameLog(os.path.join(segment_dir(self.session_dir, segment), SKIPPED_FRAMES_FILENAME))
+            self._segment = segment
+        self._log.append(capture_time_ns)
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
@@ -0,0 +1,244 @@
+import os
+import shutil
+import time
+import multiprocessing as mp
+from typing import List
+
+from encoder_stream import add_encoder_stream
+from frame_index import FrameIndexWriter
+from frame_ring_buffer import SharedFrameRing
+from frame_transform import pix_fmt_of_shape
+
+# --- 默认参数 ---
+SEGMENT_SECONDS = 1.0       # 每个时间分段的长度（秒），每段由一个独立的编码器从关键帧开始编码
+WORKER_RING_SLOTS = 60      # 每个编码工作进程的输入帧环槽位数
+DISPATCH_POLL_SECONDS = 0.5  # 工作进程帧环满时，每隔这么久检查一次工作进程是否还活着
+
+
+def segment_dir_for(output_path: str) -> str:
+    """分段文件存放目录，例如 final_output.mp4 -> final_output_segments/"""
+    stem, _ = os.path.splitext(output_path)
+    return f"{stem}_segments"
+
+
+def segment_path(segment_dir: str, segment_index: int) -> str:
+    return os.path.join(segment_dir, f"seg_{segment_index:06d}.mp4")
+
+
+# ==============================================================================
+# 编码工作进程: 每个时间分段单独打开一个编码器，分段之间是封闭的 GOP
+# ==============================================================================
+def segment_worker_process(worker_ring: SharedFrameRing, segment_dir: str, width: int, height: int,
+                           start_time_value, segment_ns: int, encoder_options: dict):
+    """
+    从自己的帧环中取帧。帧按 (capture_time_ns - 起始时间) // segment_ns 归属到时间分段，
+    遇到新的分段就关闭当前文件并新开一个编码器。每段的 pts 从该段第一帧开始计 (纳秒)，拼接时再加回该段的起点。
+    """
+    import av
+
+    container = stream = None
+    current_segment = None
+    segment_start_ns = None
+    frame_count = 0
+    input_pix_fmt = pix_fmt_of_shape(worker_ring.frame_shape)
+
+    def close_segment():
+        if container is None:
+            return
+        for packet in stream.encode():
+            container.mux(packet)
+        container.close()
+
+    try:
+        while True:
+            item = worker_ring.get()
+            if item is None:
+                break
+            frame_data, capture_time_ns, seq = item
+            start_time_ns = start_time_value.value
+            segment_index = (capture_time_ns - start_time_ns) // segment_ns
+
+            if segment_index != current_segment:
+                close_segment()
+                container = av.open(segment_path(segment_dir, segment_index), mode='w')
+                stream = add_encoder_stream(container, width, height, encoder_options)
+                current_segment = segment_index
+                segment_start_ns = capture_time_ns
+
+            frame = av.VideoFrame.from_ndarray(frame_data, format=input_pix_fmt)
+            frame.pts = capture_time_ns - segment_start_ns
+            worker_ring.release(seq)
+            for packet in stream.encode(frame):
+                container.mux(packet)
+            frame_count += 1
+
+        close_segment()
+    except Exception as e:
+        print(f"\n[编码工作进程 {os.getpid()}] 编码出错: {e}")
+        # 出错后继续清空自己的帧环直到结束信号，避免分发进程阻塞在一个没人读的满环上
+        while True:
+            item = worker_ring.get()
+            if item is None:
+                break
+            worker_ring.release(item[2])
+    finally:
+        worker_ring.close()
+    print(f"[编码工作进程 {os.getpid()}] 完成，共编码 {frame_count} 帧。")
+
+
+# ==============================================================================
+# 拼接: 把各分段的压缩数据包按顺序重新封装进一个文件，不重新编码
+# ==============================================================================
+def concat_segments(segment_paths: List[str], output_path: str, frame_index_path: str = None,
+                    pts_offsets: List[int] = None) -> int:
+    """
+    按顺序把分段无损重封装为一个 MP4，返回写入的数据包数量。指定 frame_index_path 时同时写出帧索引。
+    MP4 用毫秒级的影片时间基准在编辑列表中记录分段起点，分段内直接使用全局 pts 时起点会被取整；
+    因此各分段的 pts 从 0 开始编码，由 pts_offsets 给出每段第一帧的全局 pts，在这里精确加回。
+    """
+    import av
+
+    index_writer = FrameIndexWriter(frame_index_path) if frame_index_path else None
+    packet_count = 0
+    last_dts = None
+    with av.open(output_path, mode='w') as output:
+        out_stream = None
+        for i, path in enumerate(segment_paths):
+            offset = pts_offsets[i] if pts_offsets is not None else 0
+            with av.open(path, 'r') as segment:
+                in_stream = segment.streams.video[0]
+                if out_stream is None:
+                    add_from_template = getattr(output, 'add_stream_from_template', None)
+                    if add_from_template is not None:
+                        out_stream = add_from_template(in_stream)
+                    else:
+                        out_stream = output.add_stream(template=in_stream)
+                    out_stream.time_base = in_stream.time_base
+
+                for packet in segment.demux(in_stream):
+                    if packet.dts is None:
+                        continue
+                    if offset:
+                        packet.dts += offset
+                        if packet.pts is not None:
+                            packet.pts += offset
+                    # 各分段的编码器各自计算 dts，拼接处强制 dts 单调递增
+                    if last_dts is not None and packet.dts <= last_dts:
+                        packet.dts = last_dts + 1
+                        if packet.pts is not None and packet.pts < packet.dts:
+                            packet.pts = packet.dts
+                    last_dts = packet.dts
+                    packet.stream = out_stream
+                    if index_writer is not None:
+                        index_writer.add_packet(packet)
+                    output.mux(packet)
+                    packet_count += 1
+    if index_writer is not None:
+        index_writer.close(output_path)
+    return packet_count
+
+
+def _dispatch_frame(worker_ring: SharedFrameRing, worker_proc, frame_data, capture_time_ns: int) -> bool:
+    """
+    把一帧交给工作进程。帧环满时阻塞等待，但每隔 DISPATCH_POLL_SECONDS 检查一次工作进程是否还活着；
+    工作进程已退出时放弃该帧并返回 False。
+    """
+    while True:
+        if worker_ring.put(frame_data, capture_time_ns, block=True, timeout=DISPATCH_POLL_SECONDS):
+            return True
+        if not worker_proc.is_alive():
+            return False
+
+
+# ==============================================================================
+# 分段编码进程: 替代 encode_process，把帧按时间分段分发给 K 个编码工作进程
+# ==============================================================================
+def segmented_encode_process(frame_ring: SharedFrameRing, output_path: str, sync_time_path: str,
+                             width: int, height: int, workers: int = 4, segment_seconds: float = SEGMENT_SECONDS,
+                             encoder_options: dict = None, worker_slots: int = WORKER_RING_SLOTS,
+                             keep_segments: bool = False, frame_index_path: str = None):
+    """
+    与 encode_process 的输入/输出约定相同: 从帧环取帧，第一帧的 capture_time_ns 写入 sync_time_path，
+    最终输出 output_path，其中每帧 pts = capture_time_ns - 起始时间 (纳秒)。
+    第 i 个时间分段交给第 i % workers 个工作进程编码，编码吞吐随核数扩展。
+    指定 frame_index_path 时，拼接的同时写出帧索引旁路文件。
+    """
+    print(f"[分段编码] --- 等待第一帧以开始编码 ({workers} 个工作进程，每段 {segment_seconds} 秒) ---")
+    segment_ns = int(segment_seconds * 1_000_000_000)
+    segment_dir = segment_dir_for(output_path)
+    # 清掉上一次中断留下的分段，避免被拼接进本次的输出
+    shutil.rmtree(segment_dir, ignore_errors=True)
+    os.makedirs(segment_dir)
+
+    start_time_value = mp.Value('q', 0, lock=False)
+    worker_rings = [SharedFrameRing(frame_ring.frame_shape, slots=worker_slots, dtype=frame_ring.dtype, policy='block')
+                    for _ in range(workers)]
+    worker_procs = [mp.Process(target=segment_worker_process,
+                               args=(ring, segment_dir, width, height, start_time_value, segment_ns, encoder_options))
+                    for ring in worker_rings]
+    for proc in worker_procs:
+        proc.start()
+
+    start_time_ns = None
+    segment_starts = {}  # 分段序号 -> 该段第一帧的 capture_time_ns
+    frame_count = 0
+    lost_frames = 0
+    try:
+        while True:
+            item = frame_ring.get()
+            if item is None:
+                print("\n[分段编码] 收到结束信号。")
+                break
+
+            frame_data, capture_time_ns, seq = item
+            if start_time_ns is None:
+                start_time_ns = capture_time_ns
+                start_time_value.value = start_time_ns
+                print("[分段编码] 收到第一帧，编码开始！")
+                try:
+                    with open(sync_time_path, 'w') as f:
+                        f.write(str(start_time_ns))
+                    print(f"[分段编码] 已将同步时间点写入 {sync_time_path}")
+                except Exception as e:
+                    print(f"[分段编码] 写入同步时间失败: {e}")
+
+            segment_index = (capture_time_ns - start_time_ns) // segment_ns
+            segment_starts.setdefault(segment_index, capture_time_ns)
+            # 工作进程积压时阻塞在这里，压力会传回主帧环并按其策略丢帧
+            worker = segment_index % workers
+            if _dispatch_frame(worker_rings[worker], worker_procs[worker], frame_data, capture_time_ns):
+                frame_count += 1
+            else:
+                lost_frames += 1
+            frame_ring.release(seq)
+    except Exception as e:
+        print(f"\n[分段编码] 分发出错: {e}")
+    finally:
+        for ring in worker_rings:
+            ring.close_writer()
+        for proc in worker_procs:
+            proc.join()
+        for ring in worker_rings:
+            ring.close()
+            ring.unlink()
+        frame_ring.close()
+    if lost_frames:
+        print(f"[分段编码] 警告: 有编码工作进程提前退出，{lost_frames} 帧未能编码。")
+
+    indices = [i for i in sorted(segment_starts) if os.path.exists(segment_path(segment_dir, i))]
+    segments = [segment_path(segment_dir, i) for i in indices]
+    if not segments:
+        print("[分段编码] 没有可拼接的分段。")
+        return
+
+    t0 = time.perf_counter()
+    try:
+        packet_count = concat_segments(segments, output_path, frame_index_path,
+                                       [segment_starts[i] - start_time_ns for i in indices])
+    except Exception as e:
+        print(f"[分段编码] 拼接出错，分段文件保留在 {segment_dir}: {e}")
+        return
+    print(f"[分段编码] --- 已将 {len(segments)} 个分段 ({frame_count} 帧, {packet_count} 个数据包) "
+          f"拼接到 {output_path}，耗时 {time.perf_counter() - t0:.2f} 秒 ---")
+    if not keep_segments:
+        shutil.rmtree(segment_dir, ignore_errors=True)
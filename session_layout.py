@@ -0,0 +1,50 @@
+import os
+from typing import NamedTuple
+
+# 一次录制 (会话) 目录中的文件名，与录制包 recorder 的 output_dir 布局一致
+VIDEO_FILENAME = "final_output.mp4"
+EVENTS_CSV_FILENAME = "input_events.csv"
+EVENTS_BINARY_FILENAME = "input_events.bin"
+SYNC_TIME_FILENAME = "video_start_time.txt"
+SKIPPED_FRAMES_FILENAME = "skipped_frames.txt"
+FRAME_INDEX_FILENAME = "frame_index.npy"
+ANALYSIS_CSV_FILENAME = "frame_by_frame_analysis_final.csv"  # 解码端输出，列式格式使用同名不同扩展名
+INPUT_STATE_DIRNAME = "input_state"
+SESSION_MANIFEST_FILENAME = "session_manifest.json"  # 滚动录制: 列出各分段目录，每个分段目录本身是一个完整的会话
+SPOOL_FILENAME = "capture_spool.raw"                 # 先录后编: 未编码的原始帧暂存文件，转码成功后删除
+SESSION_METRICS_FILENAME = "session_metrics.json"    # 常驻录制服务: 该会话的开始延迟、帧数和事件数
+
+
+def segment_dirname(segment: int) -> str:
+    return f"segment_{segment:06d}"
+
+
+class SessionPaths(NamedTuple):
+    root: str
+    video: str
+    events: str           # 存在二进制事件日志时优先使用它，否则为 CSV
+    sync_time: str
+    skipped_frames: str   # 可选
+    frame_index: str      # 可选
+    analysis_csv: str
+    input_state: str
+
+
+def session_paths(session_dir: str) -> SessionPaths:
+    binary_events = os.path.join(session_dir, EVENTS_BINARY_FILENAME)
+    return SessionPaths(
+        root=session_dir,
+        video=os.path.join(session_dir, VIDEO_FILENAME),
+        events=binary_events if os.path.exists(binary_events) else os.path.join(session_dir, EVENTS_CSV_FILENAME),
+        sync_time=os.path.join(session_dir, SYNC_TIME_FILENAME),
+        skipped_frames=os.path.join(session_dir, SKIPPED_FRAMES_FILENAME),
+        frame_index=os.path.join(session_dir, FRAME_INDEX_FILENAME),
+        analysis_csv=os.path.join(session_dir, ANALYSIS_CSV_FILENAME),
+        input_state=os.path.join(session_dir, INPUT_STATE_DIRNAME),
+    )
+
+
+def is_session_dir(session_dir: str) -> bool:
+    """视频、事件日志和同步时间文件齐全的目录才算一次完整的录制。"""
+    paths = session_paths(session_dir)
+    return all(os.path.isfile(path) for path in (paths.video, paths.events, paths.sync_time))
@@ -1,49 +1,88 @@
 import av
 import csv
+import os
 import sys
-from typing import List, Tuple
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from binary_event_log import BinaryEventLog, event_timestamps, is_binary_event_log, take_rows
+from columnar_output import write_columnar_output
+from frame_dedup import read_skipped_frames
+from frame_index import build_frame_index, compare_frame_indexes, frame_timestamps, load_frame_index
+from input_state import compute_input_state, write_input_state
 
 # --- 配置输入和输出文件名 ---
 VIDEO_INPUT_PATH = r"1080p_jisuanqi_123add456\final_output.mp4"
-EVENTS_INPUT_PATH = r"1080p_jisuanqi_123add456\input_events.csv"
+EVENTS_INPUT_PATH = r"1080p_jisuanqi_123add456\input_events.csv"  # 也可以是二进制事件日志 input_events.bin
 SYNC_TIME_PATH = r"1080p_jisuanqi_123add456\video_start_time.txt"  # 新增：同步时间文件
 OUTPUT_CSV_PATH = r"1080p_jisuanqi_123add456\frame_by_frame_analysis_final.csv"
+# 'csv': 每帧一行，事件写在一个多行单元格里；'npz' / 'parquet' / 'arrow': 帧表 + 事件表的列式文件，
+# 与 OUTPUT_CSV_PATH 同名 (去掉扩展名)，parquet/arrow 需要安装 pyarrow
+OUTPUT_FORMAT = 'csv'
+SKIPPED_FRAMES_PATH = r"1080p_jisuanqi_123add456\skipped_frames.txt"  # 可选：录制时跳过的静止帧时间戳
+FRAME_INDEX_PATH = r"1080p_jisuanqi_123add456\frame_index.npy"  # 可选：录制时写出的帧索引，存在时无需读取视频
+VERIFY_FRAME_INDEX = False  # 为 True 时用视频本身校验帧索引 (需要解封装整个视频)
+INPUT_STATE_DIR = r"1080p_jisuanqi_123add456\input_state"  # 逐帧输入状态张量 (.npy) 的输出目录，设为 None 则不生成
+
 
+class SessionInputError(Exception):
+    """会话的输入文件缺失或无法读取。单独运行本脚本时打印信息并以状态码 1 退出，批处理时只把该会话记为失败。"""
 
-def read_video_timestamps(video_path: str) -> List[int]:
+
+def read_video_timestamps(video_path: str, frame_index_path: Optional[str] = None, verify_index: bool = False) -> List[int]:
     """
-    读取视频文件，返回每一帧的时间戳列表（单位：纳秒）。
+    返回视频每一帧的时间戳列表（单位：纳秒），按显示顺序排列。
+    优先读取录制时写出的帧索引旁路文件，完全不需要打开视频；没有索引时只解封装数据包 (container.demux)，不解码。
+    verify_index 为 True 时，额外解封装一遍视频，与帧索引逐项比较，不一致时以视频为准。
     """
-    print(f"正在从 '{video_path}' 读取视频帧时间戳...")
-    timestamps_ns = []
+    index = load_frame_index(frame_index_path)
+    if index is not None and not verify_index:
+        print(f"正在从帧索引 '{frame_index_path}' 读取视频帧时间戳...")
+        timestamps_ns = frame_timestamps(index).tolist()
+        print(f"成功读取 {len(timestamps_ns)} 帧时间戳 (帧索引)。")
+        return timestamps_ns
+
+    print(f"正在从 '{video_path}' 读取视频帧时间戳 (仅解封装)...")
     try:
         with av.open(video_path, 'r') as container:
             stream = container.streams.video[0]
             # 确保时间基准是纳秒，与我们录制时设置的一致
             if stream.time_base.denominator != 1_000_000_000:
                 print(f"警告: 视频时间基准不是纳秒 (1/{stream.time_base.denominator})，结果可能不精确。")
+        demuxed = build_frame_index(video_path)
+    except FileNotFoundError as e:
+        raise SessionInputError(f"错误: 视频文件 '{video_path}' 未找到。") from e
+    except Exception as e:
+        raise SessionInputError(f"读取视频时出错: {e}") from e
 
-            for frame in container.decode(stream):
-                # frame.pts 已经是纳秒单位的整数
-                timestamps_ns.append(frame.pts)
+    if index is not None:
+        problems = compare_frame_indexes(index, demuxed)
+        if problems:
+            print("警告: 帧索引与视频不一致，改用视频中的时间戳:")
+            for problem in problems:
+                print(f"  - {problem}")
+        else:
+            print("帧索引校验通过。")
 
-        print(f"成功读取 {len(timestamps_ns)} 帧时间戳。")
-        return timestamps_ns
-    except FileNotFoundError:
-        print(f"错误: 视频文件 '{video_path}' 未找到。")
-        sys.exit(1)
-    except Exception as e:
-        print(f"读取视频时出错: {e}")
-        sys.exit(1)
+    timestamps_ns = frame_timestamps(demuxed).tolist()
+    print(f"成功读取 {len(timestamps_ns)} 帧时间戳。")
+    return timestamps_ns
 
 
-def read_input_events(csv_path: str) -> List[list]:
+def read_input_events(csv_path: str) -> Sequence[list]:
     """
-    读取输入事件CSV文件，返回事件列表。
+    读取输入事件CSV文件 (或二进制事件日志)，返回事件列表。
+    二进制日志返回按需构造行的 BinaryEventRows，其 timestamps 直接来自内存映射，见 event_timestamps。
     """
     print(f"正在从 '{csv_path}' 读取输入事件...")
     events = []
     try:
+        if is_binary_event_log(csv_path):
+            events = BinaryEventLog(csv_path).rows()
+            print(f"成功读取 {len(events)} 个输入事件 (二进制日志)。")
+            return events
+
         with open(csv_path, 'r', encoding='utf-8') as f:
             reader = csv.reader(f)
             header = next(reader)  # 跳过表头
@@ -54,53 +93,103 @@ def read_input_events(csv_path: str) -> List[list]:
 
         print(f"成功读取 {len(events)} 个输入事件。")
         return events
-    except FileNotFoundError:
-        print(f"错误: 事件文件 '{csv_path}' 未找到。")
-        sys.exit(1)
+    except FileNotFoundError as e:
+        raise SessionInputError(f"错误: 事件文件 '{csv_path}' 未找到。") from e
     except Exception as e:
-        print(f"读取CSV时出错: {e}")
-        sys.exit(1)
+        raise SessionInputError(f"读取CSV时出错: {e}") from e
+
+
+
+def merge_skipped_frames(frame_timestamps_relative: List[int], skipped_timestamps_relative: List[int]) -> Tuple[List[int], List[int]]:
+    """
+    把录制时跳过的静止帧还原到时间轴上。
+    返回 (合并后的帧时间戳, 每一帧实际显示的视频帧序号)，被跳过的帧显示的是它之前最近的一个已编码帧。
+    """
+    timeline = []
+    source_indices = []
+    skipped = sorted(skipped_timestamps_relative)
+    skip_idx = 0
+    for i, pts in enumerate(frame_timestamps_relative):
+        next_pts = frame_timestamps_relative[i + 1] if i + 1 < len(frame_timestamps_relative) else float('inf')
+        timeline.append(pts)
+        source_indices.append(i)
+        # 跳过早于当前帧的时间戳 (理论上不会出现，第一帧总会被保留)
+        while skip_idx < len(skipped) and skipped[skip_idx] <= pts:
+            skip_idx += 1
+        while skip_idx < len(skipped) and skipped[skip_idx] < next_pts:
+            timeline.append(skipped[skip_idx])
+            source_indices.append(i)
+            skip_idx += 1
+    return timeline, source_indices
 
 
+def align_events_to_frames(frame_timestamps: np.ndarray, event_timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    向量化的事件-帧对齐。两个参数都是同一时间基准下的 int64 纳秒时间戳 (帧时间戳须递增，事件按记录顺序排列)。
+    第 i 帧的时间窗口为 [frame_timestamps[i], frame_timestamps[i + 1])，最后一帧的窗口延伸到无穷。
 
-def correlate_events_to_frames(frame_timestamps_relative: List[int], events_absolute: List[list], video_start_ns: int) -> List[dict]:
+    返回 CSR 形式的结果 (offsets, event_indices):
+      第 i 帧的事件为 event_indices[offsets[i]:offsets[i + 1]]，即事件数组中的下标，保持记录顺序。
+    早于第一帧的事件不属于任何帧；与原先逐帧扫描的实现一致，
+    如果某个事件比它之前的事件所在的帧还早 (多线程记录导致的轻微乱序)，它同样会被丢弃。
+    """
+    frame_timestamps = np.asarray(frame_timestamps, dtype=np.int64)
+    event_timestamps = np.asarray(event_timestamps, dtype=np.int64)
+    n_frames = len(frame_timestamps)
+    if n_frames == 0 or len(event_timestamps) == 0:
+        return np.zeros(n_frames + 1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # 每个事件所在的帧: frame_timestamps[k] <= t < frame_timestamps[k + 1]，早于第一帧时为 -1
+    frame_of_event = np.searchsorted(frame_timestamps, event_timestamps, side='right') - 1
+    # 顺序扫描时 "当前帧" 只会前进不会后退，落在当前帧之前的事件被跳过
+    current_frame = np.maximum.accumulate(frame_of_event)
+    kept = (frame_of_event >= 0) & (frame_of_event == current_frame)
+
+    event_indices = np.flatnonzero(kept)
+    counts = np.bincount(frame_of_event[event_indices], minlength=n_frames)
+    offsets = np.zeros(n_frames + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, event_indices
+
+
+def correlate_events_to_frames(frame_timestamps_relative: List[int], events_absolute: Sequence[list], video_start_ns: int,
+                               source_frame_indices: Optional[List[int]] = None) -> List[dict]:
     """
     将事件列表关联到每个视频帧的时间间隔内。
+    基于 align_events_to_frames 的兼容接口，输出与原先相同的逐帧字典列表 (事件时间戳换算为相对视频开始的纳秒)。
+    source_frame_indices 不为空时 (见 merge_skipped_frames)，每一帧额外记录其实际显示的视频帧序号。
     """
     if not frame_timestamps_relative: return []
     print("正在使用同步点关联事件与视频帧...")
 
-    processed_data = []
-    event_idx = 0
+    frame_times = np.asarray(frame_timestamps_relative, dtype=np.int64)
+    event_times = event_timestamps(events_absolute) - video_start_ns
+    offsets, event_indices = align_events_to_frames(frame_times, event_times)
 
-    for i in range(len(frame_timestamps_relative)):
-        frame_start_relative_ns = frame_timestamps_relative[i]
-        frame_end_relative_ns = frame_timestamps_relative[i + 1] if i + 1 < len(frame_timestamps_relative) else float('inf')
+    durations_ms = (np.diff(frame_times) / 1e6).tolist() + [0]
+    # 只取被分配到帧的事件行 (二进制日志只构造这些行)
+    rows = take_rows(events_absolute, event_indices)
+    offsets = offsets.tolist()
+    event_times = event_times[event_indices].tolist()
 
+    processed_data = []
+    for i, frame_start_relative_ns in enumerate(frame_timestamps_relative):
         frame_events = []
-        # 查找所有落在这个时间区间的事件
-        while event_idx < len(events_absolute):
-            # 将事件的绝对时间戳转换为相对于视频开始的相对时间戳
-            event_time_relative_ns = events_absolute[event_idx][0] - video_start_ns
-
-            if frame_start_relative_ns <= event_time_relative_ns < frame_end_relative_ns:
-                # 复制一份事件数据，并把相对时间戳也加进去
-                event_data_copy = events_absolute[event_idx][:]
-                event_data_copy[0] = event_time_relative_ns
-                frame_events.append(event_data_copy)
-                event_idx += 1
-            elif event_time_relative_ns >= frame_end_relative_ns:
-                break
-            else:
-                event_idx += 1
-
-        duration_ms = (frame_end_relative_ns - frame_start_relative_ns) / 1e6 if frame_end_relative_ns != float('inf') else 0
-        processed_data.append({
+        for j in range(offsets[i], offsets[i + 1]):
+            # 复制一份事件数据，并把相对时间戳也加进去
+            event_data_copy = rows[j][:]
+            event_data_copy[0] = event_times[j]
+            frame_events.append(event_data_copy)
+
+        row = {
             "frame_index": i,
             "timestamp_sec": frame_start_relative_ns / 1e9,
-            "duration_ms": duration_ms,
+            "duration_ms": durations_ms[i],
             "events": frame_events
-        })
+        }
+        if source_frame_indices is not None:
+            row["source_frame_index"] = source_frame_indices[i]
+        processed_data.append(row)
 
     print("关联完成。")
     return processed_data
@@ -111,9 +200,13 @@ def write_output_csv(output_path: str, processed_data: List[dict]):
     将处理好的数据写入新的CSV文件。
     """
     print(f"正在将分析结果写入 '{output_path}'...")
+    has_source_index = bool(processed_data) and "source_frame_index" in processed_data[0]
     with open(output_path, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow(['frame_index', 'timestamp_sec', 'frame_duration_ms', 'events_in_frame'])
+        header = ['frame_index', 'timestamp_sec', 'frame_duration_ms', 'events_in_frame']
+        if has_source_index:
+            header.append('source_frame_index')
+        writer.writerow(header)
 
         for row_data in processed_data:
             # 将事件列表格式化为人类可读的字符串
@@ -124,35 +217,102 @@ def write_output_csv(output_path: str, processed_data: List[dict]):
                 # 每个事件占一行，在单元格内换行以方便阅读
                 events_str = "\n".join(formatted_events)
 
-            writer.writerow([
+            row = [
                 row_data["frame_index"],
                 f"{row_data['timestamp_sec']:.6f}",
                 f"{row_data['duration_ms']:.3f}",
                 events_str
-            ])
+            ]
+            if has_source_index:
+                row.append(row_data["source_frame_index"])
+            writer.writerow(row)
     print("写入完成！")
 
 
-if __name__ == "__main__":
+def read_sync_time(sync_time_path: str) -> int:
+    """读取关键的同步点：视频的绝对开始时间。"""
+    try:
+        with open(sync_time_path, 'r') as f:
+            video_start_time_absolute_ns = int(f.read())
+        print(f"成功读取视频绝对开始时间: {video_start_time_absolute_ns}")
+        return video_start_time_absolute_ns
+    except FileNotFoundError as e:
+        raise SessionInputError(f"错误: 同步文件 '{sync_time_path}' 未找到！请先运行修改后的录制脚本。") from e
+    except ValueError as e:
+        raise SessionInputError(f"错误: 同步文件 '{sync_time_path}' 的内容不是整数纳秒时间戳: {e}") from e
+
+
+class AlignedSession(NamedTuple):
+    frame_timestamps: List[int]                # 相对视频开始的帧时间戳 (含还原的静止帧)
+    source_frame_indices: Optional[List[int]]  # 每一帧实际显示的视频帧序号，没有跳过静止帧时为 None
+    events: Sequence[list]                     # 事件行，时间戳为绝对时间
+    video_start_ns: int
+    offsets: np.ndarray                        # align_events_to_frames 的 CSR 结果
+    event_indices: np.ndarray
+
+
+def load_aligned_session(video_path: str, events_path: str, sync_time_path: str,
+                         skipped_frames_path: Optional[str] = None, frame_index_path: Optional[str] = None,
+                         verify_index: bool = False) -> AlignedSession:
+    """读取一次录制的帧时间戳、事件和同步点，并把事件对齐到帧。"""
     # 1. 读取数据
     # 读取的是视频内部的相对时间戳 (0, 8333..., 1666...)
-    frame_times_relative = read_video_timestamps(VIDEO_INPUT_PATH)
+    frame_times_relative = read_video_timestamps(video_path, frame_index_path, verify_index)
     # 读取的是事件的绝对时间戳 (87345..., 87346...)
-    events_absolute = read_input_events(EVENTS_INPUT_PATH)
+    events_absolute = read_input_events(events_path)
 
     # 2. 读取关键的同步点：视频的绝对开始时间
+    video_start_time_absolute_ns = read_sync_time(sync_time_path)
+
+    # 3. 如果录制时跳过了静止帧，把被跳过的时刻还原为保持上一帧画面的帧
+    source_frame_indices = None
+    skipped_absolute = read_skipped_frames(skipped_frames_path) if skipped_frames_path else None
+    if skipped_absolute is not None and len(skipped_absolute):
+        skipped_relative = [int(t) - video_start_time_absolute_ns for t in skipped_absolute]
+        frame_times_relative, source_frame_indices = merge_skipped_frames(frame_times_relative, skipped_relative)
+        print(f"已还原 {len(skipped_relative)} 个被跳过的静止帧。")
+
+    # 4. 核心逻辑：传入同步点，把事件对齐到帧 (CSR: 每帧在事件下标数组中的区间)
+    event_times_relative = event_timestamps(events_absolute) - video_start_time_absolute_ns
+    offsets, event_indices = align_events_to_frames(np.asarray(frame_times_relative, dtype=np.int64), event_times_relative)
+    return AlignedSession(frame_times_relative, source_frame_indices, events_absolute, video_start_time_absolute_ns,
+                          offsets, event_indices)
+
+
+def write_session_outputs(session: AlignedSession, output_csv_path: str, output_format: str = 'csv',
+                          input_state_dir: Optional[str] = None) -> List[str]:
+    """写出分析结果 (CSV 或列式文件，列式文件与 output_csv_path 同名、扩展名不同) 和可选的逐帧输入状态张量，返回写出的路径。"""
+    # 5. 写入结果
+    if output_format == 'csv':
+        final_data = correlate_events_to_frames(session.frame_timestamps, session.events, session.video_start_ns,
+                                                session.source_frame_indices)
+        write_output_csv(output_csv_path, final_data)
+        output_paths = [output_csv_path]
+    else:
+        output_paths = write_columnar_output(os.path.splitext(output_csv_path)[0], session.frame_timestamps,
+                                             session.offsets, session.event_indices, session.events,
+                                             session.video_start_ns, session.source_frame_indices, output_format)
+
+    # 6. 逐帧输入状态张量 (按键位图、鼠标按键、位移之和、光标位置、滚轮)，与帧序号对齐
+    if input_state_dir:
+        input_state = compute_input_state(len(session.frame_timestamps), session.offsets, session.event_indices,
+                                          session.events)
+        write_input_state(input_state_dir, input_state)
+        output_paths.append(input_state_dir)
+        print(f"已将逐帧输入状态张量写入 '{input_state_dir}'。")
+    return output_paths
+
+
+if __name__ == "__main__":
+    # 1-4. 读取帧时间戳、事件、同步点，还原跳过的静止帧，并把事件对齐到帧
     try:
-        with open(SYNC_TIME_PATH, 'r') as f:
-            video_start_time_absolute_ns = int(f.read())
-        print(f"成功读取视频绝对开始时间: {video_start_time_absolute_ns}")
-    except FileNotFoundError:
-        print(f"错误: 同步文件 '{SYNC_TIME_PATH}' 未找到！请先运行修改后的录制脚本。")
+        session = load_aligned_session(VIDEO_INPUT_PATH, EVENTS_INPUT_PATH, SYNC_TIME_PATH, SKIPPED_FRAMES_PATH,
+                                       FRAME_INDEX_PATH, VERIFY_FRAME_INDEX)
+    except SessionInputError as e:
+        print(e)
         sys.exit(1)
 
-    # 3. 核心逻辑：传入同步点进行关联
-    final_data = correlate_events_to_frames(frame_times_relative, events_absolute, video_start_time_absolute_ns)
-
-    # 4. 写入结果
-    write_output_csv(OUTPUT_CSV_PATH, final_data)
+    # 5-6. 写入逐帧分析结果和逐帧输入状态张量
+    output_paths = write_session_outputs(session, OUTPUT_CSV_PATH, OUTPUT_FORMAT, INPUT_STATE_DIR)
 
-    print(f"\n所有处理已完成！请查看最终的分析文件: {OUTPUT_CSV_PATH}")
+    print(f"\n所有处理已完成！请查看最终的分析文件: {', '.join(output_paths)}")